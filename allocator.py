@@ -0,0 +1,294 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import perf
+import response_curves
+
+# Budget allocation over the fitted response curves of one model (see
+# response_curves). All arrays are (..., n_channels), which lets one call
+# solve a whole batch of scenarios.
+UNCONSTRAINED_MULT = 3
+N_ITERATIONS = 300
+# Step size changes of the gradient polish after an improving / a rejected step
+STEP_GROWTH = 1.2
+STEP_SHRINK = 0.7
+GRID_POINTS = 512
+BISECTION_STEPS = 60
+# (lower, upper) multipliers offered by the channel constraint selectboxes
+CONSTRAINT_PRESETS = {
+    f"{low}-{up}": (low, up)
+    for low in [0.5, 1.0, 1.2, 1.5, 1.8] for up in [1.5, 2.0, 2.5, 2.8, 3.0] if low < up
+}
+
+
+def project(values, lower, upper, budget):
+    """Closest point to `values` with lower <= x <= upper and sum(x) == budget, batched.
+
+    The projection is clip(values - tau, lower, upper) for the shift tau that
+    meets the budget. The clipped sum is piecewise linear in tau with kinks
+    at values - upper and values - lower, so tau is interpolated exactly
+    between the two kinks that bracket the budget, for every scenario at once.
+    """
+    budget = np.asarray(budget, dtype="float64")[..., np.newaxis]
+    kinks = np.sort(np.concatenate(np.broadcast_arrays(values - upper, values - lower), axis=-1), axis=-1)
+    sums = np.clip(values[..., np.newaxis, :] - kinks[..., np.newaxis],
+                   lower[..., np.newaxis, :], upper[..., np.newaxis, :]).sum(axis=-1)
+    # sums decreases with tau; k is the last kink whose sum still covers the budget
+    k = np.clip((sums >= budget).sum(axis=-1, keepdims=True) - 1, 0, kinks.shape[-1] - 2)
+    tau_low, tau_high = np.take_along_axis(kinks, k, -1), np.take_along_axis(kinks, k + 1, -1)
+    sum_low, sum_high = np.take_along_axis(sums, k, -1), np.take_along_axis(sums, k + 1, -1)
+    drop = sum_low - sum_high
+    tau = tau_low + np.where(drop > 0, (sum_low - budget) / np.where(drop > 0, drop, 1), 0) * (tau_high - tau_low)
+    return np.clip(values - tau, lower, upper)
+
+
+def dual_grid_start(response_fn, lower, upper, budget, n_grid=GRID_POINTS):
+    """Global starting point from the Lagrangian dual on a spend grid.
+
+    For a price lambda every channel independently picks the grid spend that
+    maximises response - lambda * spend; lambda is bisected until the picks
+    fit the budget. This finds the concave-hull optimum, which plain gradient
+    steps miss when S-shaped curves have flat starts.
+    """
+    # The grid axis goes first so batched curve parameters still broadcast
+    steps = np.linspace(0.0, 1.0, n_grid).reshape((n_grid,) + (1,) * lower.ndim)
+    grid = lower + (upper - lower) * steps
+    values = response_fn(grid)
+    budget = np.asarray(budget, dtype="float64")[..., np.newaxis]
+
+    def picks(price):
+        best = np.argmax(values - price * grid, axis=0)
+        return np.take_along_axis(grid, best[np.newaxis], axis=0)[0]
+
+    slopes = np.diff(values, axis=0) / np.maximum(np.diff(grid, axis=0), 1e-12)
+    price_low = np.zeros(budget.shape)
+    price_high = np.maximum(slopes.max(axis=(0, -1)), 0)[..., np.newaxis] * 2 + 1e-9
+    for _ in range(BISECTION_STEPS):
+        price = (price_low + price_high) / 2
+        over = picks(price).sum(axis=-1, keepdims=True) > budget
+        price_low = np.where(over, price, price_low)
+        price_high = np.where(over, price_high, price)
+    return picks(price_high)
+
+
+def maximize_response(curves, init_spend, lower, upper, budget, response_fn=None, marginal_fn=None):
+    """Maximise total daily response under the budget and per-channel spend bounds.
+
+    Polishes the dual grid solution and the initial spend with projected
+    gradient ascent, using analytic gradients over all channels at once.
+    Only steps that raise the total response are taken; each scenario's step
+    grows after a successful step and shrinks after a rejected one, which
+    copes with the very different curve scales. Works on any leading batch
+    shape.
+    """
+    response_fn = response_fn or (lambda x: response_curves.response(curves, x))
+    marginal_fn = marginal_fn or (lambda x: response_curves.marginal_response(curves, x))
+    lower, upper = np.broadcast_arrays(np.asarray(lower, dtype="float64"), np.asarray(upper, dtype="float64"))
+    budget = np.asarray(budget, dtype="float64")
+    if np.any(lower.sum(axis=-1) > budget + 1e-6) or np.any(upper.sum(axis=-1) < budget - 1e-6):
+        raise ValueError("Total budget is outside the range allowed by the channel constraints")
+
+    # Both starts are polished, stacked on a new leading axis: with S-shaped
+    # curves the better start does not always lead to the better local optimum
+    x = np.stack([project(np.broadcast_to(init_spend, lower.shape), lower, upper, budget),
+                  project(dual_grid_start(response_fn, lower, upper, budget), lower, upper, budget)])
+    best_total = response_fn(x).sum(axis=-1)
+    # Steps move the largest-gradient channel by `step` of the scenario's mean feasible range
+    width = (upper - lower).mean(axis=-1, keepdims=True)
+    step = np.full(best_total.shape + (1,), 0.1)
+    for _ in range(N_ITERATIONS):
+        gradient = marginal_fn(x)
+        norm = np.abs(gradient).max(axis=-1, keepdims=True)
+        candidate = project(x + step * width * gradient / np.where(norm == 0, 1, norm), lower, upper, budget)
+        total = response_fn(candidate).sum(axis=-1)
+        improved = total > best_total
+        x = np.where(improved[..., np.newaxis], candidate, x)
+        best_total = np.where(improved, total, best_total)
+        step = np.where(improved[..., np.newaxis], step * STEP_GROWTH, step * STEP_SHRINK)
+    return np.where((best_total[1] > best_total[0])[..., np.newaxis], x[1], x[0])
+
+
+def allocate(curves, raw, date_var, channel_constraints, total_budget=None, date_range=None,
+             dep_var_type="revenue", curve_table=None):
+    """Run the allocator for one model and return a table with Robyn's allocator columns.
+
+    With a `curve_table` from response_curves the search interpolates the
+    cached curve arrays instead of evaluating the Hill curves; the reported
+    responses are always exact.
+    """
+    channels = curves["channels"]
+    window = response_curves.window_spend(raw, date_var, date_range)
+    periods = len(window)
+    hist_all = raw[channels].fillna(0).sum().to_numpy(dtype="float64")
+    hist_window = window[channels].fillna(0).sum().to_numpy(dtype="float64")
+    init_unit = hist_window / periods
+
+    low = np.array([channel_constraints.get(c, {}).get("lower_bound", 1.0) for c in channels])
+    up = np.array([channel_constraints.get(c, {}).get("upper_bound", 1.0) for c in channels])
+    low_unb = np.maximum(1 - (1 - low) * UNCONSTRAINED_MULT, 0)
+    up_unb = 1 + (up - 1) * UNCONSTRAINED_MULT
+    budget_unit = total_budget / periods if total_budget else init_unit.sum()
+
+    search = {}
+    if curve_table is not None:
+        search = {"response_fn": lambda x: response_curves.table_response(curve_table, x),
+                  "marginal_fn": lambda x: response_curves.table_marginal(curve_table, x)}
+    # A budget the bounds can't absorb is spent as close to target as they allow
+    optm = maximize_response(curves, init_unit, low * init_unit, up * init_unit,
+                             np.clip(budget_unit, (low * init_unit).sum(), (up * init_unit).sum()), **search)
+    optm_unb = maximize_response(curves, init_unit, low_unb * init_unit, up_unb * init_unit,
+                                 np.clip(budget_unit, (low_unb * init_unit).sum(), (up_unb * init_unit).sum()), **search)
+
+    # Robyn lists both spend blocks (bounded, then unbound) before the response blocks
+    def spend_block(spend_unit, suffix):
+        return {
+            f"optmSpendUnit{suffix}": spend_unit,
+            f"optmSpendUnitDelta{suffix}": _ratio(spend_unit, init_unit) - 1,
+            f"optmSpendUnitTotal{suffix}": spend_unit.sum(),
+            f"optmSpendUnitTotalDelta{suffix}": spend_unit.sum() / init_unit.sum() - 1,
+            f"optmSpendShareUnit{suffix}": spend_unit / spend_unit.sum(),
+            f"optmSpendTotal{suffix}": spend_unit.sum() * periods,
+        }
+
+    def response_block(spend_unit, suffix):
+        resp = response_curves.response(curves, spend_unit)
+        return {
+            f"optmResponseUnit{suffix}": resp,
+            f"optmResponseMargUnit{suffix}": response_curves.marginal_response(curves, spend_unit),
+            f"optmResponseUnitTotal{suffix}": resp.sum(),
+            f"optmResponseTotal{suffix}": resp.sum() * periods,
+            f"optmResponseUnitShare{suffix}": resp / resp.sum(),
+            f"optmRoiUnit{suffix}": _ratio(resp, spend_unit),
+            f"optmCpaUnit{suffix}": _ratio(spend_unit, resp),
+            f"optmResponseUnitLift{suffix}": _ratio(resp, init_response) - 1,
+        }
+
+    init_response = response_curves.response(curves, init_unit)
+    dates = pd.to_datetime(window[date_var])
+    table = pd.DataFrame({
+        "solID": curves["solID"],
+        "dep_var_type": dep_var_type,
+        "channels": channels,
+        "date_min": dates.min().strftime("%Y-%m-%d"),
+        "date_max": dates.max().strftime("%Y-%m-%d"),
+        "periods": f"{periods} days",
+        "constr_low": low,
+        "constr_low_abs": low * init_unit,
+        "constr_up": up,
+        "constr_up_abs": up * init_unit,
+        "unconstr_mult": UNCONSTRAINED_MULT,
+        "constr_low_unb": low_unb,
+        "constr_low_unb_abs": low_unb * init_unit,
+        "constr_up_unb": up_unb,
+        "constr_up_unb_abs": up_unb * init_unit,
+        "histSpendAll": hist_all,
+        "histSpendAllTotal": hist_all.sum(),
+        "histSpendAllUnit": hist_all / len(raw),
+        "histSpendAllUnitTotal": hist_all.sum() / len(raw),
+        "histSpendAllShare": hist_all / hist_all.sum(),
+        "histSpendWindow": hist_window,
+        "histSpendWindowTotal": hist_window.sum(),
+        "histSpendWindowUnit": init_unit,
+        "histSpendWindowUnitTotal": init_unit.sum(),
+        "histSpendWindowShare": hist_window / hist_window.sum(),
+        "initSpendUnit": init_unit,
+        "initSpendUnitTotal": init_unit.sum(),
+        "initSpendShare": init_unit / init_unit.sum(),
+        "initSpendTotal": hist_window.sum(),
+        "initResponseUnit": init_response,
+        "initResponseUnitTotal": init_response.sum(),
+        "initResponseMargUnit": response_curves.marginal_response(curves, init_unit),
+        "initResponseTotal": init_response.sum() * periods,
+        "initResponseUnitShare": init_response / init_response.sum(),
+        "initRoiUnit": _ratio(init_response, init_unit),
+        "initCpaUnit": _ratio(init_unit, init_response),
+        "total_budget_unit": budget_unit,
+        "total_budget_unit_delta": budget_unit / init_unit.sum() - 1,
+        **spend_block(optm, ""),
+        **spend_block(optm_unb, "Unbound"),
+        **response_block(optm, ""),
+        **response_block(optm_unb, "Unbound"),
+    }, index=pd.Index(channels, name=""))
+    table["optmResponseUnitTotalLift"] = table["optmResponseUnitTotal"] / init_response.sum() - 1
+    table["optmResponseUnitTotalLiftUnbound"] = table["optmResponseUnitTotalUnbound"] / init_response.sum() - 1
+    return table
+
+
+def _ratio(numerator, denominator):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(denominator == 0, np.nan, numerator / np.where(denominator == 0, 1, denominator))
+
+
+def sweep(curves_list, raw, date_var, budgets, presets=None, date_range=None):
+    """Allocate every budget x constraint preset x model scenario in one batched solve.
+
+    Budgets are totals over the date range, like `total_budget`. Returns a tidy
+    table with one row per scenario and channel, and the efficiency frontier
+    with one row per scenario. Budgets outside what a preset allows are
+    clipped to the nearest feasible total and flagged.
+    """
+    presets = presets or CONSTRAINT_PRESETS
+    stacked = response_curves.stack_curves(curves_list)
+    channels = stacked["channels"]
+    window = response_curves.window_spend(raw, date_var, date_range)
+    periods = len(window)
+    init_unit = window.reindex(columns=channels).fillna(0).sum().to_numpy(dtype="float64") / periods
+
+    # Scenario axes: (model, preset, budget, channel)
+    curves = {key: stacked[key][:, np.newaxis, np.newaxis, :] for key in ["coef", "inflexion", "alpha", "theta"]}
+    bounds = np.array(list(presets.values()), dtype="float64")
+    lower = np.broadcast_to((bounds[:, 0, np.newaxis] * init_unit)[np.newaxis, :, np.newaxis, :],
+                            (len(curves_list), len(presets), len(budgets), len(channels)))
+    upper = np.broadcast_to((bounds[:, 1, np.newaxis] * init_unit)[np.newaxis, :, np.newaxis, :], lower.shape)
+    requested = np.broadcast_to(np.asarray(budgets, dtype="float64")[np.newaxis, np.newaxis, :] / periods,
+                                lower.shape[:-1])
+    budget_unit = np.clip(requested, lower.sum(axis=-1), upper.sum(axis=-1))
+
+    spend = maximize_response(curves, init_unit, lower, upper, budget_unit)
+    resp = response_curves.response(curves, spend)
+    marginal = response_curves.marginal_response(curves, spend)
+
+    index = pd.MultiIndex.from_product([stacked["solID"], list(presets), list(budgets), channels],
+                                       names=["solID", "preset", "total_budget", "channel"])
+    table = pd.DataFrame({
+        "constr_low": np.repeat(np.tile(bounds[:, 0], len(curves_list)), len(budgets) * len(channels)),
+        "constr_up": np.repeat(np.tile(bounds[:, 1], len(curves_list)), len(budgets) * len(channels)),
+        "initSpendUnit": np.tile(init_unit, spend.size // len(channels)),
+        "optmSpendUnit": spend.ravel(),
+        "optmSpendTotal": spend.ravel() * periods,
+        "optmResponseUnit": resp.ravel(),
+        "optmResponseTotal": resp.ravel() * periods,
+        "optmResponseMargUnit": marginal.ravel(),
+        "optmRoiUnit": _ratio(resp, spend).ravel(),
+    }, index=index).reset_index()
+
+    frontier = pd.DataFrame({
+        "allocated_budget": spend.sum(axis=-1).ravel() * periods,
+        "feasible": np.isclose(budget_unit, requested).ravel(),
+        "optmResponseTotal": resp.sum(axis=-1).ravel() * periods,
+        "roi": _ratio(resp.sum(axis=-1), spend.sum(axis=-1)).ravel(),
+    }, index=index.droplevel("channel").unique()).reset_index()
+    # Response gained per extra unit of budget along each model/preset frontier
+    frontier["marginal_roi"] = frontier.groupby(["solID", "preset"])["optmResponseTotal"].diff() / \
+        frontier.groupby(["solID", "preset"])["allocated_budget"].diff()
+    return table, frontier
+
+
+def results_csv_name(sol_id):
+    return f"{sol_id}_max_response_reallocated.csv"
+
+
+@perf.timed("allocation")
+def run_allocation(run_dir, params, output_dir):
+    """Allocate for the model and settings of `allocation_params.json` and write the results CSV."""
+    curves = response_curves.load_model_curves(run_dir, params["model"])
+    raw, date_var = response_curves.load_raw_data(run_dir)
+    table = allocate(curves, raw, date_var, params.get("channel_constraints", {}),
+                     params.get("total_budget"), params.get("date_range"),
+                     curve_table=response_curves.curve_table(run_dir, params["model"], params.get("date_range")))
+    os.makedirs(output_dir, exist_ok=True)
+    csv_path = os.path.join(output_dir, results_csv_name(params["model"]))
+    table.to_csv(csv_path)
+    return csv_path
@@ -0,0 +1,106 @@
+import os
+
+import pandas as pd
+
+import data_ingest
+import data_schema
+import job_runner
+import robyn_export
+import run_cache
+import run_catalog
+import workspace
+
+# Batch mode: one upload with several countries (EU5 + UK) becomes one model
+# run per country. The upload is split with a single groupby, every country's
+# rows are cached as their own upload, and each country's run is queued as a
+# model job in that country's workspace; the job runner's slots are the
+# worker pool. Finished runs are indexed in the run catalog and summarised in
+# one cross-country table.
+COMPARISON_COLUMNS = ["country", "status", "run", "solID", "nrmse", "decomp.rssd", "rsq_train",
+                      "window_start", "window_end", "days", "total_spend", "total_effect", "roi_total", "top_channel"]
+
+
+def partition(df):
+    """{country: rows of that country} from one groupby over the upload."""
+    if data_schema.COUNTRY_COLUMN not in df.columns:
+        raise ValueError(f"The upload has no '{data_schema.COUNTRY_COLUMN}' column")
+    return {str(country): rows.reset_index(drop=True)
+            for country, rows in df.groupby(data_schema.COUNTRY_COLUMN, observed=True, sort=True)}
+
+
+def submit_batch(df, cust, settings, workers=1):
+    """Queue one model run per country of `df`; returns {country: {"job": id} or {"run_dir": path}}.
+
+    `settings` are the model job parameters shared by every country (bounds,
+    iterations, trials, ...). Countries whose identical run already exists
+    reuse it; countries whose workspace is over quota get {"error": message}.
+    """
+    parts = partition(df)
+    # Split the cores between the runs that can execute at the same time
+    per_run = max(1, workers // min(len(parts), job_runner.MAX_RUNNING_JOBS))
+    batch = {}
+    for country, rows in parts.items():
+        params = {**settings, "digest": data_ingest.ingest_frame(rows), "country": country,
+                  "output_root": workspace.runs_dir(cust, country), "workers": per_run}
+        cached = run_cache.reusable_run(params)
+        if cached:
+            batch[country] = {"run_dir": cached}
+            continue
+        try:
+            workspace.check_quota(cust, country)
+        except workspace.QuotaExceeded as e:
+            batch[country] = {"error": str(e)}
+            continue
+        batch[country] = {"job": job_runner.submit("model", params, owner=cust)}
+    return batch
+
+
+def batch_status(batch):
+    # Current state of each country: done with a run folder, still queued/running, or failed
+    status = {}
+    for country, entry in batch.items():
+        if "run_dir" in entry:
+            status[country] = ("done", entry["run_dir"])
+        elif "error" in entry:
+            status[country] = ("failed", entry["error"])
+        else:
+            job = job_runner.get_job(entry["job"])
+            status[country] = (job["status"], job["result"] if job["status"] == "done" else job["error"])
+    return status
+
+
+def run_summary(run_dir):
+    """Best model and totals of one run, from its Pareto exports."""
+    hyper = pd.read_csv(os.path.join(run_dir, "pareto_hyperparameters.csv"))
+    decomp = pd.read_csv(os.path.join(run_dir, "pareto_aggregated.csv"))
+    # Exports are ranked best first
+    best = hyper.iloc[0]
+    media = decomp[(decomp["solID"] == best["solID"]) & decomp["inflexion"].notna()]
+    total_spend, total_effect = media["total_spend"].sum(), media["xDecompAgg"].sum()
+    collect = robyn_export.input_collect(run_dir)
+    return {
+        "run": os.path.basename(run_dir),
+        "solID": best["solID"],
+        "nrmse": best["nrmse"],
+        "decomp.rssd": best["decomp.rssd"],
+        "rsq_train": best["rsq_train"],
+        "window_start": robyn_export.scalar(collect["window_start"]),
+        "window_end": robyn_export.scalar(collect["window_end"]),
+        "days": robyn_export.scalar(collect["rollingWindowLength"]),
+        "total_spend": total_spend,
+        "total_effect": total_effect,
+        "roi_total": total_effect / total_spend if total_spend else float("nan"),
+        "top_channel": media.loc[media["effect_share"].idxmax(), "rn"] if not media.empty else None,
+    }
+
+
+def comparison(batch):
+    """Cross-country table of a batch; finished runs are also indexed in the run catalog."""
+    rows = []
+    for country, (status, result) in batch_status(batch).items():
+        row = {"country": country, "status": status}
+        if status == "done" and result:
+            run_catalog.refresh(os.path.dirname(result))
+            row.update(run_summary(result))
+        rows.append(row)
+    return pd.DataFrame(rows).reindex(columns=COMPARISON_COLUMNS)
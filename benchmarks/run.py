@@ -0,0 +1,248 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import allocator
+import collinearity
+import data_ingest
+import data_schema
+import features
+import model_fit
+import pareto
+import transforms
+from benchmarks import synthetic
+
+# Benchmarks of the hot paths: upload parsing, validation, features, the
+# adstock/Hill transforms, candidate fits, Pareto ranking and allocation. Each
+# benchmark has a setup, which builds its inputs from the synthetic upload and
+# is not timed, and a timed function. Results are written as JSON and compared
+# with a baseline: when even the fastest round is slower than the baseline's
+# median by more than the benchmark's threshold, it is a regression and the
+# run exits with status 1. Comparing the fastest round with a typical one keeps
+# load on a shared machine from failing runs.
+#
+#   python -m benchmarks.run                      compare with benchmarks/baseline.json
+#   python -m benchmarks.run --size large         ~100MB CSV upload (3650 days x 40 countries)
+#   python -m benchmarks.run --update-baseline    record the current timings as the baseline
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+SIZES = {
+    "small": {"days": 365, "countries": 2},
+    "default": {"days": 730, "countries": 6},
+    "large": {"days": 3650, "countries": 40},
+}
+# Allowed slowdown against the baseline; noisy benchmarks get more room in the baseline file
+THRESHOLD = 1.3
+MIN_ROUNDS = 5
+MAX_ROUNDS = 50
+MAX_SECONDS = 2.0
+FIT_SAMPLES = model_fit.BATCH_SIZE
+PARETO_CANDIDATES = 10000
+ALLOCATION_SCENARIOS = 20
+
+
+def _upload(size, seed=0):
+    return synthetic.raw_data(size["days"], size["countries"], seed=seed)
+
+
+def _one_country(df):
+    return df[df[data_schema.COUNTRY_COLUMN] == df[data_schema.COUNTRY_COLUMN].iloc[0]]
+
+
+def _fit_inputs(df):
+    inputs = model_fit.prepare_inputs(df, data_schema.CHANNELS, country=df[data_schema.COUNTRY_COLUMN].iloc[0])
+    bounds = model_fit.load_hyperparameter_bounds()
+    samples = model_fit.sample_hyperparameters(bounds, data_schema.CHANNELS, FIT_SAMPLES, np.random.default_rng(0))
+    return inputs, samples
+
+
+def setup_parse_csv(df):
+    return ("upload.csv", synthetic.upload_bytes(df, "csv"))
+
+
+def setup_parse_excel(df):
+    # Excel uploads are one country; writing a whole large upload as xlsx takes minutes
+    return ("upload.xlsx", synthetic.upload_bytes(_one_country(df), "xlsx"))
+
+
+def setup_features(df):
+    derived = [name for name in features.FEATURES if name in df.columns]
+    return (df.drop(columns=derived),)
+
+
+def setup_collinearity(df):
+    return (df, df[data_schema.COUNTRY_COLUMN].iloc[0])
+
+
+def setup_transforms(df):
+    inputs, samples = _fit_inputs(df)
+    return (inputs["spend"], samples["thetas"], samples["alphas"], samples["gammas"])
+
+
+def setup_fit_batch(df):
+    inputs, samples = _fit_inputs(df)
+    return (inputs["spend"], inputs["context"], inputs["y"], samples)
+
+
+def setup_pareto(df):
+    return (synthetic.candidates(PARETO_CANDIDATES),)
+
+
+def setup_allocation(df):
+    curves = synthetic.curves()
+    init = np.array([synthetic.MEAN_SPEND[c[:-5]] for c in curves["channels"]])
+    # A sweep of total budgets around the historical spend, solved as one batch
+    budgets = init.sum() * np.linspace(0.5, 2.0, ALLOCATION_SCENARIOS)
+    lower = np.broadcast_to(init * 0.5, (ALLOCATION_SCENARIOS, len(init)))
+    upper = np.broadcast_to(init * 3.0, (ALLOCATION_SCENARIOS, len(init)))
+    return (curves, init, lower, upper, budgets)
+
+
+def setup_allocate(df):
+    curves = synthetic.curves()
+    raw = _one_country(df)
+    constraints = {channel: {"lower_bound": 0.7, "upper_bound": 1.5} for channel in curves["channels"]}
+    return (curves, raw, data_schema.DATE_COLUMN, constraints)
+
+
+BENCHMARKS = {
+    "parse_csv": (setup_parse_csv, data_ingest.parse_upload),
+    "parse_excel": (setup_parse_excel, data_ingest.parse_upload),
+    "validate": (lambda df: (df,), data_schema.validate),
+    "features": (setup_features, features.build_features),
+    "collinearity": (setup_collinearity, collinearity.diagnose),
+    "adstock_hill": (setup_transforms, transforms.transform_media),
+    "fit_batch": (setup_fit_batch, model_fit.fit_batch),
+    "pareto_rank": (setup_pareto, pareto.rank_candidates),
+    "maximize_response": (setup_allocation, allocator.maximize_response),
+    "allocate": (setup_allocate, allocator.allocate),
+}
+# Work items per call, for per-item timings in the results
+ITEMS = {"adstock_hill": FIT_SAMPLES, "fit_batch": FIT_SAMPLES, "maximize_response": ALLOCATION_SCENARIOS}
+
+
+def time_call(fn, args, min_rounds=MIN_ROUNDS, max_rounds=MAX_ROUNDS, max_seconds=MAX_SECONDS):
+    """Timings in seconds of repeated calls of fn(*args), after one untimed warm-up call."""
+    fn(*args)
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < max_rounds and (len(timings) < min_rounds or time.perf_counter() - started < max_seconds):
+        t = time.perf_counter()
+        fn(*args)
+        timings.append(time.perf_counter() - t)
+    return timings
+
+
+def run(size="default", only=None):
+    """Run the benchmarks (all, or the names in `only`) on a synthetic upload of the given size."""
+    df = _upload(SIZES[size])
+    results = {}
+    for name, (setup, fn) in BENCHMARKS.items():
+        if only and name not in only:
+            continue
+        timings = time_call(fn, setup(df))
+        results[name] = {
+            "min": min(timings),
+            "median": statistics.median(timings),
+            "mean": statistics.fmean(timings),
+            "rounds": len(timings),
+        }
+        if name in ITEMS:
+            results[name]["median_per_item"] = results[name]["median"] / ITEMS[name]
+        print(f"{name:<20} min {results[name]['min'] * 1000:10.2f} ms  median {results[name]['median'] * 1000:10.2f} ms  "
+              f"({len(timings)} rounds)")
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "size": size,
+        "rows": len(df),
+        "machine": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "benchmarks": results,
+    }
+
+
+def compare(results, baseline):
+    """Regressions of `results` against `baseline`: {name: (min, baseline median, ratio, threshold)}."""
+    if baseline.get("size") != results["size"]:
+        return {}
+    regressions = {}
+    for name, result in results["benchmarks"].items():
+        reference = baseline["benchmarks"].get(name)
+        if reference is None:
+            continue
+        threshold = reference.get("threshold", baseline.get("threshold", THRESHOLD))
+        ratio = result["min"] / reference["median"]
+        result["baseline_ratio"] = ratio
+        if ratio > threshold:
+            regressions[name] = (result["min"], reference["median"], ratio, threshold)
+    return regressions
+
+
+def _write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as json_file:
+        json.dump(data, json_file, indent=2)
+    os.replace(tmp_path, path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the ingestion, transform, fit and allocation hot paths.")
+    parser.add_argument("--size", choices=list(SIZES), default="default")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="run only these benchmarks")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--output", help="results file (default: benchmarks/results/<size>-<time>.json)")
+    parser.add_argument("--update-baseline", action="store_true", help="store the results as the new baseline")
+    args = parser.parse_args(argv)
+
+    results = run(args.size, args.only)
+    output = args.output or os.path.join(RESULTS_DIR, f"{args.size}-{datetime.now():%Y%m%d%H%M%S}.json")
+
+    if args.update_baseline:
+        baseline = {"size": args.size, "threshold": THRESHOLD, **{k: results[k] for k in ("created", "machine")},
+                    "benchmarks": {name: {"min": result["min"], "median": result["median"]} for name, result in results["benchmarks"].items()}}
+        if os.path.exists(args.baseline):
+            # Keep hand-tuned per-benchmark thresholds
+            with open(args.baseline) as baseline_file:
+                previous = json.load(baseline_file)["benchmarks"]
+            for name, entry in baseline["benchmarks"].items():
+                if "threshold" in previous.get(name, {}):
+                    entry["threshold"] = previous[name]["threshold"]
+        _write_json(args.baseline, baseline)
+        print(f"Baseline written to {args.baseline}")
+        regressions = {}
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(results, baseline)
+        if baseline.get("size") != args.size:
+            print(f"Baseline is for size '{baseline.get('size')}', not compared")
+    else:
+        regressions = {}
+        print(f"No baseline at {args.baseline}, not compared")
+
+    results["regressions"] = sorted(regressions)
+    _write_json(output, results)
+    print(f"Results written to {output}")
+    for name, (fastest, reference, ratio, threshold) in regressions.items():
+        print(f"REGRESSION {name}: {fastest * 1000:.2f} ms vs {reference * 1000:.2f} ms "
+              f"({ratio:.2f}x, threshold {threshold:.2f}x)")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+import data_schema
+import features
+import transforms
+
+# Synthetic uploads shaped like the notebook's Extras.raw_data: one row per
+# (country, day) with spend, impressions and clicks for all 13 channels, the
+# funnel columns and the derived context variables. Sales respond to adstocked,
+# saturated spend, so the fitter and allocator see realistic curves.
+COUNTRIES = ["uk", "de", "fr", "it", "es", "nl", "se", "pl"]
+START_DATE = "2022-01-01"
+# Mean daily spend per channel, roughly the UK upload's
+MEAN_SPEND = dict(zip(data_schema.CHANNELS, [1950, 700, 1200, 70, 370, 120, 1730, 425, 410, 425, 15, 20, 40]))
+ZERO_SHARE = 0.03
+
+
+def country_names(n):
+    # The EU5 + UK names first, then numbered ones
+    return COUNTRIES[:n] + [f"c{i:03d}" for i in range(len(COUNTRIES), n)]
+
+
+def raw_data(days=730, countries=1, seed=0):
+    """Frame of `days` days x 13 channels x `countries` countries, in the upload's column layout."""
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(START_DATE, periods=days, freq="D")
+    frames = []
+    for country in country_names(countries):
+        mean = np.array([MEAN_SPEND[channel] for channel in data_schema.CHANNELS])
+        spend = rng.lognormal(np.log(mean)[:, np.newaxis] - 0.18, 0.6, size=(len(mean), days))
+        spend[rng.uniform(size=spend.shape) < ZERO_SHARE] = 0
+        theta = rng.uniform(0.0, 0.4, size=len(mean))
+        alpha = rng.uniform(0.8, 2.5, size=len(mean))
+        gamma = rng.uniform(0.3, 0.8, size=len(mean))
+        saturated, _ = transforms.transform_media(spend, theta[np.newaxis], alpha[np.newaxis], gamma[np.newaxis])
+        weekly = 1 + 0.1 * np.sin(2 * np.pi * np.arange(days) / 7)
+        sales = 150000 * weekly + (rng.uniform(5000, 30000, size=len(mean)) @ saturated[0]) + rng.normal(0, 8000, days)
+        sales = np.maximum(sales, 1000)
+        orders = np.round(sales / rng.normal(25, 3, days))
+        dpv = np.round(orders / rng.normal(0.2, 0.03, days).clip(0.05))
+        frame = {
+            "country": country,
+            "date": dates,
+            "dpv": dpv,
+            "atc": np.round(dpv * rng.normal(0.37, 0.05, days).clip(0.05)),
+            "orders": orders,
+            "snss": np.round(rng.normal(6000, 1800, days).clip(1)),
+            "total_product_sales": sales.round(2),
+            "ntb_total_product_sales": (sales * rng.normal(0.14, 0.03, days).clip(0.01)).round(2),
+            "total_units_sold": np.round(orders * 1.9),
+        }
+        for i, channel in enumerate(data_schema.CHANNELS):
+            frame[f"{channel}_cost"] = spend[i]
+            frame[f"{channel}_impressions"] = np.round(spend[i] * rng.lognormal(np.log(200), 0.2, days))
+            frame[f"{channel}_clicks"] = np.round(spend[i] * rng.lognormal(np.log(0.8), 0.2, days))
+        frame["event_date_utc"] = dates
+        frame["start_date_per"] = dates
+        frames.append(pd.DataFrame(frame))
+    df = pd.concat(frames, ignore_index=True)
+    df["country"] = df["country"].astype("category")
+    return features.build_features(df)
+
+
+def upload_bytes(df, fmt="csv"):
+    """The frame serialized as an uploaded file would be."""
+    buffer = io.BytesIO()
+    if fmt == "csv":
+        df.to_csv(buffer, index=False, date_format="%Y-%m-%d")
+    else:
+        df.to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+
+def candidates(n, seed=0):
+    # A candidate table with the two Pareto objectives, traded off like fitted models
+    rng = np.random.default_rng(seed)
+    nrmse = rng.uniform(0.05, 0.4, n)
+    return pd.DataFrame({
+        "solID": [f"1_{i // 100 + 1}_{i % 100 + 1}" for i in range(n)],
+        "nrmse": nrmse,
+        "decomp.rssd": 0.02 / nrmse + rng.gamma(2.0, 0.05, n),
+    })
+
+
+def curves(n_channels=len(data_schema.CHANNELS), seed=0):
+    # Response curve parameters of one model, in response_curves' layout
+    rng = np.random.default_rng(seed)
+    channels = [f"{channel}_cost" for channel in data_schema.CHANNELS[:n_channels]]
+    return {
+        "solID": "1_1_1",
+        "channels": channels,
+        "coef": rng.uniform(5000, 30000, n_channels),
+        "inflexion": np.array([MEAN_SPEND[c[:-5]] for c in channels]) * rng.uniform(0.5, 2.0, n_channels),
+        "alpha": rng.uniform(0.8, 2.5, n_channels),
+        "theta": rng.uniform(0.0, 0.4, n_channels),
+    }
@@ -1,70 +1,86 @@
-
 import streamlit as st
 import os
+import altair as alt
 import pandas as pd
-from datetime import datetime
-from PIL import Image
-import json
-import matplotlib.pyplot as plt
 
+import response_curves
 
-def run_budget_allocate():
- 
-    # Assuming the CSV file path is defined
-    csv_path = os.path.join("5_228_6_max_response_reallocated.csv")
+# Chart every 8th point of the 1024-point cached curves; plenty for a line and keeps the spec small
+CURVE_EVERY = 8
 
-    if os.path.exists(csv_path):
-        budget_results = pd.read_csv(csv_path)
+@st.cache_data(max_entries=32)
+def load_results(csv_path, mtime):
+    # Cached per file version; mtime is part of the key so a rewritten result is picked up
+    return pd.read_csv(csv_path)
 
-        # Streamlit section to show charts
-        st.write("---")
-        st.title("Budget Allocation Results - Charts")
 
-        # 1. Budget Allocation vs. Response Curve
-        st.subheader("Budget Allocation vs. Response Curve for Channels")
-        fig1, ax1 = plt.subplots(figsize=(10, 6))
-        for channel in budget_results['channels'].unique():
-            channel_data = budget_results[budget_results['channels'] == channel]
-            ax1.plot(channel_data['constr_low'], channel_data['optmResponseUnitUnbound'], label=channel)
+@st.cache_data(max_entries=32)
+def allocation_chart_specs(csv_path, mtime, run_dir=None):
+    """Vega-Lite specs of the four result charts, built once per results file version."""
+    budget_results = load_results(csv_path, mtime)
+    points = budget_results[['channels', 'initSpendUnit', 'initResponseUnit', 'optmSpendUnit', 'optmResponseUnit']]
 
-        ax1.set_xlabel('Budget Allocation')
-        ax1.set_ylabel('Response Curve')
-        ax1.set_title('Budget Allocation vs. Response Curve for Channels')
-        ax1.legend()
-        ax1.grid()
-        st.pyplot(fig1)
+    # 1. The fitted daily response curve of every channel, up to its widest (unbounded) constraint
+    curves = None
+    if run_dir:
+        try:
+            curves = response_curves.curve_table(run_dir, budget_results['solID'].iloc[0],
+                                                 (budget_results['date_min'].iloc[0], budget_results['date_max'].iloc[0]))
+        except (FileNotFoundError, KeyError):
+            curves = None
+    if curves is not None:
+        limits = budget_results.set_index('channels').reindex(curves['channels'])
+        curve_data = response_curves.curve_frame(
+            curves, 1.1 * limits[['constr_up_unb_abs', 'optmSpendUnitUnbound']].max(axis=1).fillna(0), every=CURVE_EVERY)
+        curve_data = curve_data.rename(columns={'channel': 'channels'})
+    else:
+        # No fitted curve for this run: connect the initial and optimised points
+        curve_data = pd.concat([
+            points[['channels', 'initSpendUnit', 'initResponseUnit']].set_axis(['channels', 'spend', 'response'], axis=1),
+            points[['channels', 'optmSpendUnit', 'optmResponseUnit']].set_axis(['channels', 'spend', 'response'], axis=1),
+        ])
+    color = alt.Color('channels:N', title='Channel')
+    curve_chart = alt.layer(
+        alt.Chart(curve_data).mark_line().encode(x=alt.X('spend:Q', title='Daily Spend'),
+                                                 y=alt.Y('response:Q', title='Daily Response'), color=color),
+        alt.Chart(points).mark_point(shape='circle', filled=True, size=60).encode(
+            x='initSpendUnit:Q', y='initResponseUnit:Q', color=color,
+            tooltip=['channels', alt.Tooltip('initSpendUnit:Q', title='Initial spend', format=',.0f')]),
+        alt.Chart(points).mark_point(shape='cross', filled=True, size=80).encode(
+            x='optmSpendUnit:Q', y='optmResponseUnit:Q', color=color,
+            tooltip=['channels', alt.Tooltip('optmSpendUnit:Q', title='Optimised spend', format=',.0f')]),
+    ).properties(title='Budget Allocation vs. Response Curve for Channels (dot = initial, cross = optimised)')
 
-        # 2. Channel Contribution to Total Revenue (Decomposition)
-        st.subheader("Channel Contribution to Total Revenue")
-        fig2, ax2 = plt.subplots(figsize=(10, 6))
-        ax2.bar(budget_results['channels'], budget_results['optmResponseUnitTotalUnbound'], color='skyblue')
-        ax2.set_xlabel('Channels')
-        ax2.set_ylabel('Total Response Contribution')
-        ax2.set_title('Channel Contribution to Total Revenue')
-        plt.xticks(rotation=45)
-        ax2.grid(axis='y')
-        st.pyplot(fig2)
+    def bar_chart(column, title, y_title, bar_color):
+        return alt.Chart(budget_results[['channels', column]]).mark_bar(color=bar_color).encode(
+            x=alt.X('channels:N', title='Channels', sort=None), y=alt.Y(f'{column}:Q', title=y_title),
+            tooltip=['channels', alt.Tooltip(f'{column}:Q', format=',.2f')],
+        ).properties(title=title)
 
+    return {
+        "Budget Allocation vs. Response Curve for Channels": curve_chart.interactive().to_dict(),
+        # 2. Channel Contribution to Total Revenue (Decomposition)
+        "Channel Contribution to Total Revenue": bar_chart(
+            'optmResponseUnitUnbound', 'Channel Contribution to Total Revenue', 'Daily Response Contribution', 'skyblue').to_dict(),
         # 3. Media Efficiency Ratio (ROI by Channel)
-        st.subheader("ROI by Channel")
-        fig3, ax3 = plt.subplots(figsize=(10, 6))
-        ax3.bar(budget_results['channels'], budget_results['optmRoiUnitUnbound'], color='lightgreen')
-        ax3.set_xlabel('Channels')
-        ax3.set_ylabel('ROI (Return on Investment)')
-        ax3.set_title('ROI by Channel')
-        plt.xticks(rotation=45)
-        ax3.grid(axis='y')
-        st.pyplot(fig3)
-
+        "ROI by Channel": bar_chart('optmRoiUnitUnbound', 'ROI by Channel', 'ROI (Return on Investment)', 'lightgreen').to_dict(),
         # 4. Incrementality Analysis by Channel
-        st.subheader("Incrementality Analysis by Channel")
-        fig4, ax4 = plt.subplots(figsize=(10, 6))
-        ax4.bar(budget_results['channels'], budget_results['optmResponseUnitLiftUnbound'], color='coral')
-        ax4.set_xlabel('Channels')
-        ax4.set_ylabel('Incremental Response')
-        ax4.set_title('Incrementality Analysis by Channel')
-        plt.xticks(rotation=45)
-        ax4.grid(axis='y')
-        st.pyplot(fig4)
+        "Incrementality Analysis by Channel": bar_chart(
+            'optmResponseUnitLiftUnbound', 'Incrementality Analysis by Channel', 'Incremental Response', 'coral').to_dict(),
+    }
+
+
+def run_budget_allocate(csv_path=os.path.join("5_228_6_max_response_reallocated.csv"), run_dir=None):
+
+    if os.path.exists(csv_path):
+        # Data and chart specs are memoized per file version, so reruns only re-send the specs
+        specs = allocation_chart_specs(csv_path, os.path.getmtime(csv_path), run_dir)
+
+        # Streamlit section to show charts
+        st.write("---")
+        st.title("Budget Allocation Results - Charts")
+        for title, spec in specs.items():
+            st.subheader(title)
+            st.vega_lite_chart(spec, use_container_width=True)
     else:
         st.error(f"The results file '{csv_path}' does not exist.")
@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+
+import data_schema
+import model_fit
+import perf
+
+# Multicollinearity diagnostics of the regressors before a model run. One pass
+# over the standardized design gives the whole correlation matrix, and the
+# VIFs are the diagonal of its inverse, so no auxiliary regression per
+# variable is fitted. VIFs cover the regressors the fitter uses (spends and
+# context variables); exposure columns are only correlated against them, to
+# catch channels whose spend and impressions/clicks move together.
+VIF_THRESHOLD = 10.0
+CORR_THRESHOLD = 0.9
+# Eigenvalues of the correlation matrix below this share of the largest count as zero
+SINGULAR_TOLERANCE = 1e-10
+
+
+def _channel(column):
+    for suffix in ("_cost", "_impressions", "_clicks"):
+        if column.endswith(suffix):
+            return column[:-len(suffix)]
+    return None
+
+
+def _kind(a, b):
+    # Spend vs exposure of one channel, two different channels, or a context variable involved
+    if _channel(a) is None or _channel(b) is None:
+        return "context"
+    return "same channel" if _channel(a) == _channel(b) else "across channels"
+
+
+def correlation(values):
+    """Correlation matrix of the columns of `values`, from one Gram matrix of the standardized columns."""
+    centered = values - values.mean(axis=0)
+    scale = np.sqrt((centered ** 2).sum(axis=0))
+    standardized = centered / np.where(scale > 0, scale, 1.0)
+    return standardized.T @ standardized
+
+
+def vif(corr):
+    """Variance inflation factors: the diagonal of the inverse correlation matrix, inf for exactly collinear columns."""
+    eigenvalues, eigenvectors = np.linalg.eigh(corr)
+    zero = eigenvalues <= SINGULAR_TOLERANCE * max(eigenvalues.max(), 1.0)
+    out = (eigenvectors[:, ~zero] ** 2 / eigenvalues[~zero]).sum(axis=1)
+    # Columns with weight on a null direction are a linear combination of the others
+    out[(eigenvectors[:, zero] ** 2).sum(axis=1) > np.sqrt(SINGULAR_TOLERANCE)] = np.inf
+    return out
+
+
+@perf.timed("collinearity")
+def diagnose(df, country=None, channels=data_schema.CHANNELS, context_vars=model_fit.CONTEXT_VARS):
+    """Correlation matrix, VIFs and collinear pairs of the candidate regressors of one country.
+
+    Returns `correlation` (frame), `vif` (frame of VIFs over spends and context
+    variables), `pairs` (column pairs with |r| >= CORR_THRESHOLD) and
+    `constant` (columns with no variation, left out).
+    """
+    if data_schema.DEP_VAR in df.columns and data_schema.DATE_COLUMN in df.columns:
+        rows = model_fit.model_rows(df, country)
+    else:
+        # Uploads that fail validation are still diagnosed, over all their rows
+        rows = df if country is None else df[df[data_schema.COUNTRY_COLUMN].astype("string") == str(country)]
+    spends = [f"{channel}_cost" for channel in channels]
+    exposures = [f"{channel}_{data_schema.EXPOSURE_METRIC[channel]}" for channel in channels]
+    regressors = [col for col in spends + list(context_vars) if col in rows.columns]
+    columns = regressors + [col for col in exposures if col in rows.columns]
+
+    block = rows[columns].apply(pd.to_numeric, errors="coerce").astype("float64")
+    # Same imputation as the fitter: missing values take the column mean
+    block = block.fillna(block.mean()).fillna(0)
+    constant = [col for col in columns if block[col].nunique() <= 1]
+    columns = [col for col in columns if col not in constant]
+    regressors = [col for col in regressors if col not in constant]
+
+    corr = correlation(block[columns].to_numpy())
+    n = len(regressors)
+    vifs = vif(corr[:n, :n]) if n else np.array([])
+
+    upper = np.triu(np.abs(corr) >= CORR_THRESHOLD, k=1)
+    first, second = np.nonzero(upper)
+    pairs = pd.DataFrame({
+        "column_a": [columns[i] for i in first],
+        "column_b": [columns[j] for j in second],
+        "correlation": corr[first, second],
+    })
+    pairs["kind"] = [_kind(a, b) for a, b in zip(pairs["column_a"], pairs["column_b"])]
+    return {
+        "correlation": pd.DataFrame(corr, index=columns, columns=columns),
+        "vif": pd.DataFrame({"vif": vifs, "flagged": vifs >= VIF_THRESHOLD}, index=pd.Index(regressors, name="column")),
+        "pairs": pairs.sort_values("correlation", key=np.abs, ascending=False, ignore_index=True),
+        "constant": constant,
+    }
@@ -0,0 +1,160 @@
+import hashlib
+import io
+import os
+import time
+from functools import lru_cache
+
+import pandas as pd
+
+import perf
+
+# Parsed uploads are stored as content-addressed Parquet files so reruns and
+# later pages never re-parse the original CSV/Excel file.
+CACHE_DIR = os.environ.get("ROBYN_INGEST_CACHE", "./.robyn_cache/uploads")
+MAX_CACHE_BYTES = 2 * 1024 ** 3
+MAX_CACHE_ENTRIES = 50
+
+# Column typing rules, matched by column name
+FLOAT_SUFFIXES = ("_cost", "_impressions", "_clicks")
+CATEGORY_COLUMNS = ("country",)
+DATE_COLUMNS = ("date", "event_date_utc", "start_date_per")
+DATE_FORMATS = ("%Y-%m-%d", "%m/%d/%Y", "%d/%m/%Y")
+
+
+def file_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def cache_path(digest):
+    return os.path.join(CACHE_DIR, f"{digest}.parquet")
+
+
+def column_dtypes(columns):
+    # Explicit dtypes for the known column families, everything else is inferred
+    dtypes = {}
+    for col in columns:
+        if col.endswith(FLOAT_SUFFIXES):
+            dtypes[col] = "float64"
+        elif col in CATEGORY_COLUMNS:
+            dtypes[col] = "category"
+    return dtypes
+
+
+def parse_dates(series):
+    # Try the known formats first; a fixed format is much faster than inference
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    values = series.astype("string")
+    for fmt in DATE_FORMATS:
+        parsed = pd.to_datetime(values, format=fmt, errors="coerce")
+        if parsed.notna().sum() == values.notna().sum():
+            return parsed
+    return pd.to_datetime(values, errors="coerce")
+
+
+@perf.timed("parse upload")
+def parse_upload(name, data):
+    buffer = io.BytesIO(data)
+    if name.endswith('.csv'):
+        header = pd.read_csv(io.BytesIO(data), nrows=0).columns
+        try:
+            df = pd.read_csv(buffer, dtype=column_dtypes(header), engine="pyarrow")
+        except (ImportError, ValueError):
+            buffer.seek(0)
+            df = pd.read_csv(buffer, dtype=column_dtypes(header), low_memory=False)
+    elif name.endswith('.xlsx'):
+        df = pd.read_excel(buffer)
+        df = df.astype(column_dtypes(df.columns))
+    else:
+        raise ValueError(f"Unsupported file type: {name}")
+
+    for col in DATE_COLUMNS:
+        if col in df.columns:
+            df[col] = parse_dates(df[col])
+    return df
+
+
+def map_columns(df, mapping):
+    """Copy of `df` with upload columns renamed onto schema names; `mapping` is {schema name: upload column}.
+
+    Mapped columns get the dtypes and date parsing of their new names, as if the upload had used them.
+    """
+    sources = list(mapping.values())
+    if len(set(sources)) < len(sources):
+        raise ValueError("Each upload column can be mapped to one field only")
+    unknown = [source for source in sources if source not in df.columns]
+    if unknown:
+        raise ValueError(f"Columns not in the upload: {', '.join(unknown)}")
+    df = df.drop(columns=[col for col in mapping if col in df.columns and col not in sources])
+    df = df.rename(columns={source: target for target, source in mapping.items()})
+    df = df.astype(column_dtypes(mapping))
+    for col in DATE_COLUMNS:
+        if col in mapping:
+            df[col] = parse_dates(df[col])
+    return df
+
+
+def evict_cache(keep=None):
+    # LRU eviction: entries are touched on every hit, so oldest mtime goes first
+    if not os.path.isdir(CACHE_DIR):
+        return
+    entries = []
+    for f in os.listdir(CACHE_DIR):
+        if f.endswith('.parquet'):
+            stat = os.stat(os.path.join(CACHE_DIR, f))
+            entries.append((stat.st_mtime, stat.st_size, f))
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    while entries and (total > MAX_CACHE_BYTES or len(entries) > MAX_CACHE_ENTRIES):
+        _, size, f = entries.pop(0)
+        if keep and f == os.path.basename(cache_path(keep)):
+            continue
+        os.remove(os.path.join(CACHE_DIR, f))
+        total -= size
+
+
+def ingest_upload(name, data):
+    """Parse an uploaded file once and return the digest of its cached copy."""
+    digest = file_digest(data)
+    path = cache_path(digest)
+    if os.path.exists(path):
+        os.utime(path, (time.time(), time.time()))
+        perf.count("upload cache hits")
+        return digest
+
+    perf.count("upload cache misses")
+    df = parse_upload(name, data)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    evict_cache(keep=digest)
+    return digest
+
+
+def ingest_frame(df):
+    """Cache a derived frame, e.g. one country of an upload, like an upload; returns its digest."""
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, index=False)
+    data = buffer.getvalue()
+    digest = file_digest(data)
+    path = cache_path(digest)
+    if not os.path.exists(path):
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as parquet_file:
+            parquet_file.write(data)
+        os.replace(tmp_path, path)
+        evict_cache(keep=digest)
+    return digest
+
+
+@lru_cache(maxsize=8)
+@perf.timed("load cached upload")
+def load_frame(digest):
+    """Load a previously ingested upload. The returned frame is shared, do not mutate it."""
+    path = cache_path(digest)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No cached upload for digest {digest}")
+    os.utime(path, (time.time(), time.time()))
+    return pd.read_parquet(path)
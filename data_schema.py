@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+
+import data_ingest
+import perf
+
+# Declarative schema for Robyn uploads. Every page that needs the channel list
+# or the required columns should read it from here.
+CHANNELS = [
+    "dsp_recruit", "dsp_conversion", "dsp_awareness",
+    "sd_recruit", "sp_auto", "sb_defend",
+    "sp_recruit", "sp_attack", "sp_defend",
+    "sb_recruit", "sd_defend", "sb_attack",
+    "sd_attack"
+]
+
+# DSP and SD recruit are bought on impressions, everything else on clicks
+EXPOSURE_METRIC = {
+    channel: "impressions" if channel.startswith("dsp_") or channel == "sd_recruit" else "clicks"
+    for channel in CHANNELS
+}
+
+SPEND_COLUMNS = [f"{channel}_cost" for channel in CHANNELS]
+EXPOSURE_COLUMNS = [f"{channel}_{EXPOSURE_METRIC[channel]}" for channel in CHANNELS]
+DEP_VAR = "total_product_sales"
+DATE_COLUMN = "date"
+COUNTRY_COLUMN = "country"
+
+SCHEMA = {
+    **{col: {"type": "spend", "min": 0, "max_nan_ratio": 0.05} for col in SPEND_COLUMNS},
+    **{col: {"type": "exposure", "min": 0, "max_nan_ratio": 0.05} for col in EXPOSURE_COLUMNS},
+    DEP_VAR: {"type": "target", "min": 0, "max_nan_ratio": 0.0},
+    COUNTRY_COLUMN: {"type": "country"},
+    DATE_COLUMN: {"type": "date", "max_gap_days": 1},
+}
+
+REQUIRED_COLUMNS = list(SCHEMA)
+NUMERIC_TYPES = ("spend", "exposure", "target")
+
+
+def _issue(rule, column, count, detail, severity="error"):
+    return {"rule": rule, "column": column, "count": int(count), "detail": detail, "severity": severity}
+
+
+@perf.timed("validate")
+def validate(df, schema=SCHEMA):
+    """Run every schema rule over the frame and return a structured report.
+
+    The report holds `ok`, `missing_columns`, the list of `issues` (one dict per
+    failed rule) and a per-column `summary` frame.
+    """
+    issues = []
+    missing_columns = [col for col in schema if col not in df.columns]
+    for col in missing_columns:
+        issues.append(_issue("missing_column", col, 1, "Required column is missing"))
+
+    # Numeric rules: one matrix, every check column-wise
+    numeric_cols = [col for col, spec in schema.items() if spec["type"] in NUMERIC_TYPES and col in df.columns]
+    summary = pd.DataFrame(index=pd.Index(numeric_cols, name="column"))
+    if numeric_cols:
+        block = df[numeric_cols]
+        original_nan = block.isna().to_numpy().sum(axis=0)
+        non_numeric = [col for col in numeric_cols if not pd.api.types.is_numeric_dtype(block[col])]
+        if non_numeric:
+            block = block.assign(**{col: pd.to_numeric(block[col], errors="coerce") for col in non_numeric})
+        values = block.to_numpy(dtype="float64", na_value=np.nan)
+        nan_mask = np.isnan(values)
+        nan_ratio = nan_mask.mean(axis=0) if len(values) else np.zeros(len(numeric_cols))
+        mins = np.array([schema[col].get("min", -np.inf) for col in numeric_cols])
+        negatives = (values < mins).sum(axis=0)
+        max_nan = np.array([schema[col].get("max_nan_ratio", 1.0) for col in numeric_cols])
+
+        summary["nan_ratio"] = nan_ratio
+        summary["below_min"] = negatives
+        summary["min"] = np.nanmin(np.where(nan_mask, np.inf, values), axis=0) if len(values) else np.nan
+        summary["max"] = np.nanmax(np.where(nan_mask, -np.inf, values), axis=0) if len(values) else np.nan
+
+        for i, col in enumerate(numeric_cols):
+            if col in non_numeric:
+                # NaNs introduced by coercion are values that were not numbers at all
+                issues.append(_issue("type", col, nan_mask[:, i].sum() - original_nan[i],
+                                     f"Column is {df[col].dtype}, expected numeric values"))
+            if negatives[i]:
+                issues.append(_issue("non_negative", col, negatives[i], f"Values below {mins[i]:g}"))
+            if nan_ratio[i] > max_nan[i]:
+                issues.append(_issue("nan_ratio", col, nan_mask[:, i].sum(),
+                                     f"{nan_ratio[i]:.1%} missing (max {max_nan[i]:.0%})",
+                                     severity="warning" if max_nan[i] > 0 else "error"))
+
+    # Date rules: parse once, then duplicates and gaps per country
+    date_specs = [col for col, spec in schema.items() if spec["type"] == "date" and col in df.columns]
+    country_col = next((col for col, spec in schema.items() if spec["type"] == "country" and col in df.columns), None)
+    for col in date_specs:
+        dates = data_ingest.parse_dates(df[col])
+        unparsed = dates.isna().sum() - df[col].isna().sum()
+        if unparsed:
+            issues.append(_issue("type", col, unparsed, "Values could not be parsed as dates"))
+
+        keys = pd.DataFrame({"country": df[country_col].astype("string") if country_col else "", "date": dates})
+        duplicated = keys.duplicated().sum()
+        if duplicated:
+            issues.append(_issue("duplicate", f"{country_col}, {col}" if country_col else col, duplicated,
+                                 "Duplicate (country, date) rows"))
+
+        keys = keys.dropna().drop_duplicates().sort_values(["country", "date"])
+        gaps = keys.groupby("country", sort=False)["date"].diff().dt.days
+        max_gap = schema[col].get("max_gap_days", 1)
+        n_gaps = (gaps > max_gap).sum()
+        if n_gaps:
+            issues.append(_issue("date_gap", col, n_gaps,
+                                 f"Gaps longer than {max_gap} day(s), largest is {int(gaps.max())} days",
+                                 severity="warning"))
+
+    return {
+        "ok": not any(issue["severity"] == "error" for issue in issues),
+        "missing_columns": missing_columns,
+        "issues": issues,
+        "summary": summary,
+    }
@@ -0,0 +1,239 @@
+import glob
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+import data_ingest
+import data_schema
+import perf
+
+# Declarative feature pipeline for the context variables the R notebook
+# derives before modelling. Features are computed in order, so a lag can read a
+# ratio defined above it. Every rule is one vectorized column operation over
+# the whole upload sorted by (country, date); lags shift within each country.
+# Values already present in the upload win: derived values only fill missing
+# columns and missing cells.
+#
+#   ratio     numerator / denominator, NaN where the denominator is 0
+#   lag       `source` shifted by `periods` rows within each country (one row
+#             per day in a complete daily upload; gaps in the dates are not filled)
+#   calendar  a part of the date: "day_name" (Sunday, ...) or "day"
+#   event     True on the dates of an event calendar for the row's country
+#             (see EVENT_CALENDARS and calendar_gaps)
+FEATURES = {
+    "conversion_rate": {"type": "ratio", "numerator": "orders", "denominator": "dpv"},
+    "orders_per_dpv": {"type": "ratio", "numerator": "orders", "denominator": "dpv"},
+    "atc_per_dpv": {"type": "ratio", "numerator": "atc", "denominator": "dpv"},
+    "AOV": {"type": "ratio", "numerator": "total_product_sales", "denominator": "orders"},
+    "NTB_order_rate": {"type": "ratio", "numerator": "ntb_total_product_sales", "denominator": "total_product_sales"},
+    "AOV_lag1": {"type": "lag", "source": "AOV", "periods": 1},
+    "conversion_rate_lag1": {"type": "lag", "source": "conversion_rate", "periods": 1},
+    "atc_per_dpv_lag1": {"type": "lag", "source": "atc_per_dpv", "periods": 1},
+    "snss_lag1": {"type": "lag", "source": "snss", "periods": 1},
+    "ntb_total_product_sales_lag1": {"type": "lag", "source": "ntb_total_product_sales", "periods": 1},
+    "day_of_week": {"type": "calendar", "part": "day_name"},
+    "day_of_month": {"type": "calendar", "part": "day"},
+    "is_amazon_sale": {"type": "event", "calendar": "amazon_sale"},
+}
+
+# Event calendars by name: a CSV of country,event_date[,event] rows, like the
+# notebook's eu5_amazon_sales_dates.csv. Rows of country "all" (the notebook's
+# Prime Day / Black Friday lists) are used for countries with no rows of their own.
+EVENT_CALENDARS = {"amazon_sale": os.environ.get("ROBYN_AMAZON_SALES_DATES", "eu5_amazon_sales_dates.csv")}
+ALL_COUNTRIES = "all"
+# An upload running this many days past the last date of its calendar is warned about
+CALENDAR_GRACE_DAYS = 60
+
+# Bump when a feature definition changes, so cached outputs are recomputed
+FEATURE_VERSION = 1
+# Cached outputs checked as the base of an incremental update
+MAX_BASES = 10
+
+
+def _sources(spec):
+    return [spec[key] for key in ("numerator", "denominator", "source") if key in spec]
+
+
+def _ratio(df, spec, country, events):
+    denominator = df[spec["denominator"]].astype("float64")
+    return df[spec["numerator"]].astype("float64") / denominator.where(denominator != 0)
+
+
+def _lag(df, spec, country, events):
+    return df[spec["source"]].groupby(country, observed=True, sort=False).shift(spec["periods"])
+
+
+def _calendar(df, spec, country, events):
+    dates = df[data_schema.DATE_COLUMN]
+    return dates.dt.day_name() if spec["part"] == "day_name" else getattr(dates.dt, spec["part"])
+
+
+def load_events(calendars=EVENT_CALENDARS):
+    """Event dates by calendar and country, {calendar: {country: [dates]}}; empty for a missing calendar file."""
+    events = {}
+    for name, path in calendars.items():
+        if not os.path.exists(path):
+            events[name] = {}
+            continue
+        frame = pd.read_csv(path, usecols=["country", "event_date"], dtype=str).dropna()
+        frame["country"] = frame["country"].str.strip().str.lower()
+        frame["event_date"] = pd.to_datetime(frame["event_date"]).dt.strftime("%Y-%m-%d")
+        events[name] = {country: sorted(set(dates)) for country, dates in frame.groupby("country")["event_date"]}
+    return events
+
+
+def _country_dates(calendar, country):
+    return calendar.get(str(country).lower(), calendar.get(ALL_COUNTRIES, []))
+
+
+def _event(df, spec, country, events):
+    calendar = events.get(spec["calendar"], {})
+    countries = country.astype(str).unique()
+    days = [(c, d) for c in countries for d in _country_dates(calendar, c)]
+    dates = pd.MultiIndex.from_arrays([[c for c, _ in days], pd.to_datetime([d for _, d in days])])
+    rows = pd.MultiIndex.from_arrays([country.astype(str), df[data_schema.DATE_COLUMN].dt.normalize()])
+    return pd.Series(rows.isin(dates), index=df.index)
+
+
+def calendar_gaps(df, features=FEATURES, events=None, calendars=EVENT_CALENDARS):
+    """Warnings for the event features an upload leaves to a calendar that is missing or does not cover it."""
+    events = load_events(calendars) if events is None else events
+    date, country = data_schema.DATE_COLUMN, data_schema.COUNTRY_COLUMN
+    if date not in df.columns or country not in df.columns:
+        return []
+    messages = []
+    for name, spec in features.items():
+        if spec["type"] != "event":
+            continue
+        # Only the rows the calendar has to fill in
+        rows = df if name not in df.columns else df[df[name].isna()]
+        calendar = events.get(spec["calendar"], {})
+        source = calendars.get(spec["calendar"], spec["calendar"])
+        for value, dates in rows.groupby(rows[country].astype(str), sort=True)[date]:
+            if value.lower() not in calendar:
+                fallback = "its generic dates are used" if ALL_COUNTRIES in calendar else f"{name} is False on every date"
+                messages.append(f"{source} has no dates for country '{value}'; {fallback}.")
+            days = _country_dates(calendar, value)
+            if days and dates.max() > pd.Timestamp(days[-1]) + pd.Timedelta(days=CALENDAR_GRACE_DAYS):
+                messages.append(f"{source} ends on {days[-1]} for country '{value}' but the upload runs to "
+                                f"{dates.max().date()}; later events are not flagged in {name}.")
+    return messages
+
+
+RULES = {"ratio": _ratio, "lag": _lag, "calendar": _calendar, "event": _event}
+
+
+def max_lag(features=FEATURES):
+    return max([spec["periods"] for spec in features.values() if spec["type"] == "lag"], default=0)
+
+
+def _sorted(df):
+    return df.sort_values([data_schema.COUNTRY_COLUMN, data_schema.DATE_COLUMN], kind="stable").reset_index(drop=True)
+
+
+@perf.timed("features")
+def build_features(df, features=FEATURES, events=None):
+    """Upload sorted by (country, date) with every feature whose source columns exist added or filled in."""
+    events = load_events() if events is None else events
+    df = _sorted(df)
+    country = df[data_schema.COUNTRY_COLUMN]
+    for name, spec in features.items():
+        if any(col not in df.columns for col in _sources(spec)):
+            continue
+        derived = RULES[spec["type"]](df, spec, country, events)
+        if name not in df.columns:
+            df[name] = derived
+        elif df[name].isna().any():
+            df[name] = df[name].fillna(derived)
+    return df
+
+
+def _input_hash(df):
+    hashed = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    return hashlib.sha256(json.dumps(list(df.columns)).encode() + hashed.tobytes()).hexdigest()
+
+
+def _events_hash(events):
+    return hashlib.sha256(json.dumps(events, sort_keys=True).encode()).hexdigest()
+
+
+def _index_path(digest):
+    return os.path.join(data_ingest.CACHE_DIR, f"{digest}.features.json")
+
+
+def _read_index(path, events_hash):
+    try:
+        with open(path) as index_file:
+            entry = json.load(index_file)
+    except (OSError, ValueError):
+        return None
+    if (entry.get("version") != FEATURE_VERSION or entry.get("events") != events_hash
+            or not os.path.exists(data_ingest.cache_path(entry["features"]))):
+        # Outdated definitions or event calendars, or the output was evicted from the upload cache
+        return None
+    return entry
+
+
+def _write_index(digest, entry):
+    path = _index_path(digest)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as index_file:
+        json.dump(entry, index_file)
+    os.replace(tmp_path, path)
+
+
+def _append(df, base_rows, base, events):
+    # Only the appended dates are computed, with the last max_lag rows of each country as lag history
+    date = data_schema.DATE_COLUMN
+    new = df[df[date] > base_rows[date].max()]
+    history = base_rows.groupby(data_schema.COUNTRY_COLUMN, observed=True, sort=False).tail(max_lag())
+    added = build_features(pd.concat([history, new], ignore_index=True), events=events)
+    added = added[added[date] > base_rows[date].max()]
+    out = _sorted(pd.concat([base, added], ignore_index=True))
+    out[data_schema.COUNTRY_COLUMN] = out[data_schema.COUNTRY_COLUMN].astype(df[data_schema.COUNTRY_COLUMN].dtype)
+    return out
+
+
+def _find_base(df, events_hash):
+    # A cached output whose input is exactly this upload's rows up to the base's last date
+    date = data_schema.DATE_COLUMN
+    paths = sorted(glob.glob(_index_path("*")), key=os.path.getmtime, reverse=True)[:MAX_BASES]
+    for path in paths:
+        entry = _read_index(path, events_hash)
+        if entry is None or entry["columns"] != list(df.columns):
+            continue
+        prefix = df[df[date] <= pd.Timestamp(entry["last_date"])]
+        if len(prefix) == entry["rows"] < len(df) and _input_hash(prefix) == entry["input_hash"]:
+            return entry, prefix
+    return None, None
+
+
+def with_features(digest):
+    """Digest of the cached upload `digest` with its features; cached, and updated incrementally for appended dates."""
+    events = load_events()
+    events_hash = _events_hash(events)
+    entry = _read_index(_index_path(digest), events_hash)
+    if entry is not None:
+        return entry["features"]
+    df = data_ingest.load_frame(digest)
+    if data_schema.DATE_COLUMN not in df.columns or data_schema.COUNTRY_COLUMN not in df.columns:
+        return digest
+    df = _sorted(df)
+    base, base_rows = _find_base(df, events_hash)
+    if base is not None:
+        featured = _append(df, base_rows, data_ingest.load_frame(base["features"]), events)
+    else:
+        featured = build_features(df, events=events)
+    features_digest = data_ingest.ingest_frame(featured)
+    _write_index(digest, {
+        "version": FEATURE_VERSION,
+        "events": events_hash,
+        "features": features_digest,
+        "columns": list(df.columns),
+        "rows": len(df),
+        "last_date": df[data_schema.DATE_COLUMN].max().isoformat(),
+        "input_hash": _input_hash(df),
+    })
+    return features_digest
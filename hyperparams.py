@@ -1,6 +1,8 @@
 import streamlit as st
 import numpy as np
 import pandas as pd
+import data_ingest
+import data_schema
 
 # Initialize session state for page navigation if it does not already exist
 if 'page' not in st.session_state:
@@ -26,7 +28,7 @@ if st.session_state['page'] == 'upload_page':
             # Display required fields and descriptions
             st.header("Required Fields and Field Descriptions")
             st.markdown("""
-            - **Date Field**: `event_date_utc`  
+            - **Date Field**: `date`  
               Format: YYYY-MM-DD. This field must be present and in a date format. It’s the timestamp for each record.
             - **Spend Fields** (must be numerical values):
               - `dsp_recruit_cost` (DSP Recruit)
@@ -37,24 +39,32 @@ if st.session_state['page'] == 'upload_page':
             st.subheader("Data Preview")
             st.write(data.head())
 
-            # Field Mapping and Manual Overrides
+            # Field Mapping: upload columns to use for the required columns the upload names differently
             st.subheader("Field Mapping and Manual Overrides")
+            unmapped = [col for col in data_schema.REQUIRED_COLUMNS if col not in data.columns]
+            extra = [col for col in data.columns if col not in data_schema.REQUIRED_COLUMNS]
             with st.form("field_mapping"):
-                col1, col2 = st.columns(2)
-                event_date_col = col1.selectbox("Map event_date_utc", data.columns, key='event_date')
-                dsp_recruit_col = col2.selectbox("Map dsp_recruit_cost", data.columns, key='dsp_recruit')
-                submit_button = st.form_submit_button(label="Add Row")
+                columns = st.columns(2)
+                mapping = {col: columns[i % 2].selectbox(f"Map {col}", [None] + extra, key=f"map_{col}")
+                           for i, col in enumerate(unmapped)}
+                submit_button = st.form_submit_button(label="Submit Field Mapping")
+            if submit_button:
+                st.session_state['field_mapping'] = {col: source for col, source in mapping.items() if source}
+            # A mapping saved for an earlier upload only applies where its columns still exist
+            mapping = {col: source for col, source in st.session_state.get('field_mapping', {}).items()
+                       if source in data.columns}
+            data = data_ingest.map_columns(data, mapping)
 
             # Validation Button
             st.subheader("Submission Button")
             if st.button("Validate Data"):
-                required_columns = [event_date_col, dsp_recruit_col]
-                missing_columns = [col for col in required_columns if col not in data.columns]
-                
-                if len(missing_columns) == 0:
+                report = data_schema.validate(data)
+
+                if report['ok']:
                     st.success("Data successfully validated!")
                 else:
-                    st.error(f"Missing columns: {', '.join(missing_columns)}")
+                    st.error(f"Validation failed: {', '.join(issue['column'] for issue in report['issues'] if issue['severity'] == 'error')}")
+                st.dataframe(pd.DataFrame(report['issues']))
 
             # Proceed to Hyperparameter Adjustment Page
             if st.button("Proceed to Hyperparameter Adjustment"):
@@ -0,0 +1,68 @@
+import hashlib
+import os
+
+from PIL import Image
+
+import perf
+
+# Downscaled WebP copies of the run images. A model one-pager is a ~2MB,
+# 6800x7600 PNG; pages show the preview and only load the original on demand.
+# Cached files are keyed by (path, mtime, preview width), so a rewritten image
+# or a new width gets a new copy and stale ones age out through LRU eviction.
+CACHE_DIR = os.environ.get("ROBYN_IMAGE_CACHE", "./.robyn_cache/images")
+MAX_CACHE_BYTES = 512 * 1024 ** 2
+PREVIEW_WIDTH = 1600
+WEBP_QUALITY = 80
+
+
+def cache_path(path, width=PREVIEW_WIDTH):
+    stat = os.stat(path)
+    key = hashlib.sha1(f"{os.path.abspath(path)}|{stat.st_mtime_ns}|{width}".encode()).hexdigest()
+    return os.path.join(CACHE_DIR, f"{key}.webp")
+
+
+def preview(path):
+    """Path of the WebP preview of the image at `path`, generated on first use."""
+    target = cache_path(path)
+    if os.path.exists(target):
+        os.utime(target)
+        return target
+    _generate(path, target)
+    return target
+
+
+@perf.timed("image decode")
+def _generate(path, target):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with Image.open(path) as image:
+        image.load()
+        image.thumbnail((PREVIEW_WIDTH, PREVIEW_WIDTH * 4), Image.LANCZOS)
+        tmp_path = f"{target}.{os.getpid()}.tmp"
+        image.save(tmp_path, "WEBP", quality=WEBP_QUALITY, method=4)
+    os.replace(tmp_path, target)
+    evict_cache(keep=target)
+
+
+def pregenerate(paths):
+    # Warm the cache for a run's images, e.g. right after the run is indexed
+    for path in paths:
+        preview(path)
+
+
+def evict_cache(keep=None):
+    # LRU eviction: entries are touched on every hit, so oldest mtime goes first
+    if not os.path.isdir(CACHE_DIR):
+        return
+    entries = []
+    for f in os.listdir(CACHE_DIR):
+        if f.endswith(".webp"):
+            stat = os.stat(os.path.join(CACHE_DIR, f))
+            entries.append((stat.st_mtime, stat.st_size, f))
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    while entries and total > MAX_CACHE_BYTES:
+        _, size, f = entries.pop(0)
+        if keep and f == os.path.basename(keep):
+            continue
+        os.remove(os.path.join(CACHE_DIR, f))
+        total -= size
@@ -0,0 +1,257 @@
+import json
+import os
+import shutil
+import signal
+import sqlite3
+import subprocess
+import sys
+import time
+import traceback
+import uuid
+from contextlib import closing
+
+import allocator
+import data_ingest
+import image_cache
+import model_fit
+import perf
+import run_cache
+import run_catalog
+import workspace
+
+# Long model and allocation runs are executed by detached worker processes
+# (`python job_runner.py <job_id>`), so they survive Streamlit reruns and
+# several analysts can queue work on the same server. The SQLite job table is
+# the only state shared between the app and the workers.
+DB_PATH = os.environ.get("ROBYN_JOB_DB", "./.robyn_cache/jobs.sqlite")
+MAX_RUNNING_JOBS = int(os.environ.get("ROBYN_MAX_RUNNING_JOBS", "2"))
+PROGRESS_INTERVAL = 1.0
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def connect(db_path=DB_PATH):
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            owner TEXT,
+            status TEXT NOT NULL,
+            params TEXT NOT NULL,
+            progress REAL NOT NULL DEFAULT 0,
+            message TEXT,
+            result TEXT,
+            error TEXT,
+            pid INTEGER,
+            cancel_requested INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL
+        )
+    """)
+    return conn
+
+
+def submit(kind, params, owner=None, db_path=DB_PATH):
+    """Queue a job and start its worker process; returns the job id."""
+    if kind not in JOB_KINDS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    job_id = uuid.uuid4().hex[:12]
+    with closing(connect(db_path)) as conn:
+        # The row only becomes visible with its pid: list_jobs in another session would
+        # otherwise see a queued job without a live worker and mark it failed. The
+        # worker's claim waits for this transaction.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("INSERT INTO jobs (id, kind, owner, status, params, created_at) VALUES (?, ?, ?, 'queued', ?, ?)",
+                         (job_id, kind, owner, json.dumps(params), time.time()))
+            process = subprocess.Popen([sys.executable, os.path.abspath(__file__), job_id],
+                                       env={**os.environ, "ROBYN_JOB_DB": os.path.abspath(db_path)},
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+            conn.execute("UPDATE jobs SET pid = ? WHERE id = ?", (process.pid, job_id))
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+    return job_id
+
+
+def _alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    # Reap our own children so finished workers don't linger as zombies
+    try:
+        finished, _ = os.waitpid(pid, os.WNOHANG)
+        return finished == 0
+    except ChildProcessError:
+        return True
+
+
+def get_job(job_id, db_path=DB_PATH):
+    with closing(connect(db_path)) as conn:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return _with_eta(dict(row)) if row else None
+
+
+def list_jobs(owner=None, limit=20, db_path=DB_PATH):
+    with closing(connect(db_path)) as conn:
+        # Workers that died without reporting (killed, machine restart) are marked failed
+        for row in conn.execute("SELECT id, pid FROM jobs WHERE status IN ('queued', 'running')").fetchall():
+            if not _alive(row["pid"]):
+                conn.execute("UPDATE jobs SET status = 'failed', error = 'Worker process exited unexpectedly', "
+                             "finished_at = ? WHERE id = ? AND status IN ('queued', 'running')", (time.time(), row["id"]))
+        if owner is None:
+            rows = conn.execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+        else:
+            rows = conn.execute("SELECT * FROM jobs WHERE owner = ? ORDER BY created_at DESC LIMIT ?",
+                                (owner, limit)).fetchall()
+    return [_with_eta(dict(row)) for row in rows]
+
+
+def _with_eta(job):
+    job["params"] = json.loads(job["params"])
+    job["eta_s"] = None
+    if job["status"] == "running" and job["started_at"] and 0 < job["progress"] < 1:
+        elapsed = time.time() - job["started_at"]
+        job["eta_s"] = elapsed / job["progress"] * (1 - job["progress"])
+    return job
+
+
+def cancel(job_id, force=False, db_path=DB_PATH):
+    """Ask a job to stop at its next progress update; `force` also terminates the worker process."""
+    with closing(connect(db_path)) as conn:
+        conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+        row = conn.execute("SELECT pid, status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row and (row["status"] == "queued" or force):
+            if _alive(row["pid"]):
+                os.killpg(row["pid"], signal.SIGTERM)
+            conn.execute("UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status IN ('queued', 'running')",
+                         (time.time(), job_id))
+
+
+def _claim(conn, job_id):
+    # Wait for a free slot, then move the job to running in one write transaction
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT status, cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row["status"] != "queued" or row["cancel_requested"]:
+            conn.execute("COMMIT")
+            return False
+        running = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'running'").fetchone()[0]
+        if running < MAX_RUNNING_JOBS:
+            conn.execute("UPDATE jobs SET status = 'running', started_at = ?, pid = ? WHERE id = ?",
+                         (time.time(), os.getpid(), job_id))
+            conn.execute("COMMIT")
+            return True
+        conn.execute("COMMIT")
+        time.sleep(2)
+
+
+def _progress_reporter(conn, job_id):
+    last_update = [0.0]
+
+    def report(done, total, message=None):
+        now = time.time()
+        if now - last_update[0] < PROGRESS_INTERVAL and done < total:
+            return
+        last_update[0] = now
+        conn.execute("UPDATE jobs SET progress = ?, message = ? WHERE id = ?",
+                     (done / total if total else 0.0, message, job_id))
+        if conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]:
+            raise JobCancelled()
+    return report
+
+
+def run_model_job(params, report):
+    # An identical run queued earlier may have finished while this one waited
+    cached = run_cache.reusable_run(params)
+    if cached:
+        report(1, 1, "Reused the results of an identical run")
+        return cached
+    run_dir = model_fit.run_model(
+        data_ingest.load_frame(params["digest"]),
+        {channel: {name: tuple(values) for name, values in ranges.items()} for channel, ranges in params["bounds"].items()},
+        iterations=params["iterations"],
+        trials=params["trials"],
+        ts_validation=params.get("ts_validation", False),
+        seed=params.get("seed", 123),
+        country=params.get("country"),
+        output_root=params.get("output_root", "./mars-pne_uk"),
+        workers=params.get("workers", 1),
+        progress=lambda done, total: report(done, total, f"Fitted {done} of {total} candidates"),
+        refresh=params.get("refresh"),
+        cv_scheme=params.get("cv_scheme", "expanding"),
+        cv_folds=params.get("cv_folds"),
+        strategy=params.get("strategy", "random"),
+        early_stop=params.get("early_stop", False),
+        profiler=params.get("profiler", perf.DEFAULT_PROFILER),
+    )
+    run_cache.store(run_cache.fingerprint(params), run_dir)
+    return run_dir
+
+
+def run_allocation_job(params, report):
+    # Allocation results live in the run of the model they were computed for: <run>/allocations/<model>/
+    run_dir = params["run_dir"]
+    model_dir = run_catalog.allocation_dir(run_dir, params["model"])
+    os.makedirs(model_dir, exist_ok=True)
+    with workspace.atomic_open(os.path.join(model_dir, "allocation_params.json"), "w") as json_file:
+        json.dump(params, json_file, indent=4)
+    if os.path.exists(os.path.join(run_dir, "pareto_aggregated.csv")):
+        csv_path = allocator.run_allocation(run_dir, params, model_dir)
+    else:
+        # Runs exported by R have no fitted curves here; show the allocator output shipped with them
+        csv_path = os.path.join(model_dir, "5_228_6_max_response_reallocated.csv")
+        shutil.copyfile(params.get("results_csv", "5_228_6_max_response_reallocated.csv"), csv_path)
+    report(1, 1, "Allocation results written")
+    return csv_path
+
+
+def run_preview_job(params, report):
+    paths = params["paths"]
+    for done, path in enumerate(paths, start=1):
+        if os.path.exists(path):
+            image_cache.pregenerate([path])
+        report(done, len(paths), f"Generated previews for {done} of {len(paths)} images")
+    return None
+
+
+JOB_KINDS = {
+    "model": run_model_job,
+    "allocate": run_allocation_job,
+    "previews": run_preview_job,
+}
+
+
+def work(job_id, db_path=DB_PATH):
+    conn = connect(db_path)
+    if not _claim(conn, job_id):
+        return
+    job = conn.execute("SELECT kind, params FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    try:
+        result = JOB_KINDS[job["kind"]](json.loads(job["params"]), _progress_reporter(conn, job_id))
+        conn.execute("UPDATE jobs SET status = 'done', progress = 1, result = ?, finished_at = ? WHERE id = ?",
+                     (result, time.time(), job_id))
+    except JobCancelled:
+        conn.execute("UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ?", (time.time(), job_id))
+    except Exception as e:
+        conn.execute("UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+                     (f"{e}\n{traceback.format_exc()}", time.time(), job_id))
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    work(sys.argv[1])
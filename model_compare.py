@@ -0,0 +1,97 @@
+import altair as alt
+import numpy as np
+import pandas as pd
+
+import response_curves
+
+# Side-by-side comparison of a run's candidate models from its exported
+# decomposition (pareto_aggregated.csv) and fit metrics
+# (pareto_hyperparameters.csv). Everything is computed on (models x channels)
+# arrays, so comparing 20+ models costs about as much as comparing two.
+FIT_METRICS = ["robynPareto", "nrmse", "nrmse_val", "nrmse_test", "decomp.rssd", "rsq_train", "lambda"]
+CHANNEL_VALUES = ["spend_share", "effect_share", "roi_total", "xDecompAgg", "mean_spend"]
+CURVE_POINTS = 60
+CURVE_SPEND_MULT = 3
+
+
+def channel_matrix(decomp, sol_ids, value):
+    # (models x channels) table of one decomposition column, rows in `sol_ids` order
+    media = decomp[decomp["inflexion"].notna()]
+    return media.pivot(index="solID", columns="rn", values=value).reindex(sol_ids)
+
+
+def compare_channels(decomp, sol_ids, baseline=None):
+    """Per model and channel: spend/effect share, ROI and contribution, with deltas against `baseline`."""
+    baseline = baseline or sol_ids[0]
+    base_row = list(sol_ids).index(baseline)
+    tables = {value: channel_matrix(decomp, sol_ids, value) for value in CHANNEL_VALUES}
+    channels = tables["effect_share"].columns
+    index = pd.MultiIndex.from_product([sol_ids, channels], names=["solID", "channel"])
+    columns = {}
+    for value, table in tables.items():
+        values = table.reindex(columns=channels).to_numpy(dtype="float64")
+        columns[value] = values.ravel()
+        columns[f"{value}_delta"] = (values - values[base_row]).ravel()
+    return pd.DataFrame(columns, index=index).reset_index()
+
+
+def compare_curves(decomp, hyper, sol_ids, baseline=None, n_points=CURVE_POINTS):
+    """Response curves of every model and channel on a shared daily spend grid.
+
+    The grid runs from 0 to CURVE_SPEND_MULT times the channel's historical
+    mean daily spend. `response_delta` is the difference to the baseline
+    model's curve at the same spend.
+    """
+    baseline = baseline or sol_ids[0]
+    stacked = response_curves.stack_curves([response_curves.model_curves(decomp, hyper, sol_id) for sol_id in sol_ids])
+    channels = stacked["channels"]
+    mean_spend = channel_matrix(decomp, sol_ids, "mean_spend").reindex(columns=channels).max().to_numpy(dtype="float64")
+    # (points, models, channels) in one evaluation
+    grid = np.linspace(0, 1, n_points)[:, np.newaxis, np.newaxis] * CURVE_SPEND_MULT * mean_spend
+    grid = np.broadcast_to(grid, (n_points, len(sol_ids), len(channels)))
+    curves = response_curves.response(stacked, grid)
+    marginal = response_curves.marginal_response(stacked, grid)
+    delta = curves - curves[:, [list(sol_ids).index(baseline)], :]
+    index = pd.MultiIndex.from_product([range(n_points), sol_ids, channels], names=["point", "solID", "channel"])
+    return pd.DataFrame({
+        "spend": grid.ravel(),
+        "response": curves.ravel(),
+        "marginal_roi": marginal.ravel(),
+        "response_delta": delta.ravel(),
+    }, index=index).reset_index().drop(columns="point")
+
+
+def compare_fit(hyper, sol_ids):
+    return hyper.loc[list(sol_ids), [m for m in FIT_METRICS if m in hyper]].reset_index()
+
+
+def contribution_chart(channels_table):
+    return alt.Chart(channels_table).mark_bar().encode(
+        x=alt.X("effect_share:Q", title="Effect share", axis=alt.Axis(format="%")),
+        y=alt.Y("channel:N", title=None),
+        yOffset="solID:N",
+        color="solID:N",
+        tooltip=["solID", "channel", alt.Tooltip("effect_share:Q", format=".1%"),
+                 alt.Tooltip("spend_share:Q", format=".1%"), alt.Tooltip("effect_share_delta:Q", format="+.1%")],
+    )
+
+
+def roi_chart(channels_table):
+    return alt.Chart(channels_table).mark_rect().encode(
+        x=alt.X("solID:N", title="Model"),
+        y=alt.Y("channel:N", title=None),
+        color=alt.Color("roi_total:Q", title="ROI", scale=alt.Scale(scheme="viridis")),
+        tooltip=["solID", "channel", alt.Tooltip("roi_total:Q", format=".2f"),
+                 alt.Tooltip("roi_total_delta:Q", format="+.2f")],
+    )
+
+
+def curves_chart(curves_table, channel):
+    data = curves_table[curves_table["channel"] == channel]
+    return alt.Chart(data).mark_line().encode(
+        x=alt.X("spend:Q", title="Daily spend"),
+        y=alt.Y("response:Q", title="Daily response"),
+        color="solID:N",
+        tooltip=["solID", alt.Tooltip("spend:Q", format=",.0f"), alt.Tooltip("response:Q", format=",.0f"),
+                 alt.Tooltip("marginal_roi:Q", format=".2f"), alt.Tooltip("response_delta:Q", format="+,.0f")],
+    ).interactive()
@@ -1,17 +1,70 @@
 import streamlit as st
 import os
+import numpy as np
 import pandas as pd
 from datetime import datetime
-from PIL import Image
 import json
 import matplotlib.pyplot as plt
 import streamlit as st
+import allocator
 import budget_allocate
+import data_schema
+import image_cache
+import job_runner
+import model_compare
+import pareto
+import perf
+import response_curves
+import robyn_export
+import run_catalog
+import workspace
+
+
+@st.cache_data
+def load_pareto_models(path, mtime):
+    # Cached per file version; mtime is part of the key so a new export is picked up
+    return pareto.pareto_models(pd.read_csv(path))
+
+
+@st.cache_data
+def load_results_table(path, mtime):
+    return pd.read_csv(path)
+
+
+@st.cache_data
+def run_scenario_sweep(run_dir, sol_ids, budgets, preset_names, date_range, mtime):
+    # One batched solve for every model x preset x budget; mtime keys the cache to the run's exports
+    raw, date_var = response_curves.load_raw_data(run_dir)
+    curves_list = [response_curves.load_model_curves(run_dir, sol_id) for sol_id in sol_ids]
+    presets = {name: allocator.CONSTRAINT_PRESETS[name] for name in preset_names}
+    return allocator.sweep(curves_list, raw, date_var, list(budgets), presets, list(date_range))
+
+
+@st.cache_data
+def load_comparison(run_dir, sol_ids, baseline, mtime):
+    # Exports are read once per file version; reruns only re-render the charts
+    decomp, hyper = response_curves.load_model_exports(run_dir)
+    return (model_compare.compare_fit(hyper, sol_ids),
+            model_compare.compare_channels(decomp, sol_ids, baseline),
+            model_compare.compare_curves(decomp, hyper, sol_ids, baseline))
+
+
+def show_image(file_path, caption, key):
+    # The downscaled WebP preview by default, the original PNG only when asked for
+    if st.checkbox("Full resolution", key=f"full_{key}"):
+        st.image(file_path, caption=caption, use_column_width=True)
+    else:
+        st.image(image_cache.preview(file_path), caption=caption, use_column_width=True)
+
 
 def run_model_display():
     st.write("This is the model display page")
-    # Set the root directory where the plots are stored
-    root_dir = "./mars-pne_uk"
+    # Runs are stored in the workspace of the selected customer and country
+    try:
+        root_dir = workspace.runs_dir(st.session_state.get('cust'), st.session_state.get('country_filtered'))
+    except ValueError:
+        st.info("Select a customer and upload data for a country to see its model runs.")
+        return
 
     # Title for the app
     st.title("Robyn Model Output Charts Viewer")
@@ -32,7 +85,11 @@ def run_model_display():
         st.write("---")
         st.title("Budget Allocation Results")
         allocation_params = st.session_state.allocation_params
-        csv_path = os.path.join(root_dir, allocation_params['model'], "5_228_6_max_response_reallocated.csv")
+        run_catalog.refresh(root_dir)
+        run, model = allocation_params['run'], allocation_params['model']
+        results = run_catalog.allocation_results(root_dir, run, model)
+        csv_path = results[0] if results else os.path.join(run_catalog.allocation_dir(os.path.join(root_dir, run), model),
+                                                           allocator.results_csv_name(model))
         if os.path.exists(csv_path):
             results_df = pd.read_csv(csv_path)
             st.dataframe(results_df)
@@ -53,22 +110,14 @@ def run_model_display():
         if not os.path.exists(root_dir):
             st.error(f"The directory '{root_dir}' does not exist. Please check the path.")
         else:
-            sub_dirs = [f for f in os.listdir(root_dir) if os.path.isdir(os.path.join(root_dir, f))]
-
-            # Extract the datetime part from the folder names and sort by it
-            folders_with_dates = []
-            for folder in sub_dirs:
-                try:
-                    # Extract timestamp from the folder name
-                    timestamp_str = folder.split('_')[1]
-                    timestamp = datetime.strptime(timestamp_str, "%Y%m%d%H%M")
-                    folders_with_dates.append((folder, timestamp))
-                except ValueError:
-                    # Skip folders that do not match the expected format
-                    continue
-
-            # Sort folders by datetime in descending order (latest first)
-            folders_with_dates.sort(key=lambda x: x[1], reverse=True)
+            # Runs come from the catalog, which only rescans folders whose mtime changed
+            new_folders = run_catalog.refresh(root_dir)
+            new_images = [os.path.join(root_dir, folder, f) for folder in new_folders
+                          for kind in ("chart", "model") for f in run_catalog.artifacts(root_dir, folder, kind=kind)]
+            if new_images:
+                # Pre-generate previews of newly indexed runs in the background
+                job_runner.submit("previews", {"paths": new_images}, owner=st.session_state.get('cust'))
+            folders_with_dates = run_catalog.list_runs(root_dir)
 
             # Create a displayable label with date and time
             sorted_folders = [f"{folder} (Run on: {timestamp.strftime('%Y-%m-%d %H:%M')})" for folder, timestamp in folders_with_dates]
@@ -81,26 +130,54 @@ def run_model_display():
                 st.session_state.selected_folder = selected_folder
 
                 folder_path = os.path.join(root_dir, selected_folder)
-                available_files = [f for f in os.listdir(folder_path) if f.endswith(('.png', '.jpg'))]
-
-                # Filter only the relevant chart images
-                chart_files = [
-                    "hypersampling.png",
-                    "pareto_front.png",
-                    "prophet_decomp.png",
-                    "ROAS_convergence1.png",
-                    "ROAS_convergence2.png",
-                    "ROAS_convergence3.png"
-                ]
+                if robyn_export.EXPORT_FILE in run_catalog.artifacts(root_dir, selected_folder, kind="export"):
+                    # Only the small sections are parsed here, not the embedded raw data
+                    inputs, models = robyn_export.input_collect(folder_path), robyn_export.models_collect(folder_path)
+                    st.caption(f"Window {robyn_export.scalar(inputs.get('window_start'))} to "
+                               f"{robyn_export.scalar(inputs.get('window_end'))} · "
+                               f"{robyn_export.scalar(models.get('iterations'))} iterations x "
+                               f"{robyn_export.scalar(models.get('trials'))} trials · "
+                               f"{len(inputs.get('paid_media_spends', []))} paid media channels")
+                    for message in models.get('conv_msg', []):
+                        st.caption(message)
+                convergence_path = os.path.join(folder_path, "convergence.csv")
+                if os.path.exists(convergence_path):
+                    with st.expander("Convergence"):
+                        # Median and best objective of each generation of candidates, one line per trial
+                        convergence = load_results_table(convergence_path, os.path.getmtime(convergence_path))
+                        for column, title in (("nrmse_median", "NRMSE (median)"), ("decomp_rssd_median", "DECOMP.RSSD (median)")):
+                            st.caption(title)
+                            st.line_chart(convergence.pivot(index="iterNG", columns="trial", values=column))
+                run_perf = perf.load(folder_path)
+                if run_perf:
+                    with st.expander("Run Performance"):
+                        # Stage timings the run recorded in perf.json, slowest first
+                        st.caption(f"{run_perf['wall_s'] / 60:.2f} min · memory high-water mark "
+                                   f"{run_perf['peak_rss_mb']:.0f} MB · " +
+                                   ", ".join(f"{name}: {value}" for name, value in run_perf['counters'].items()))
+                        st.dataframe(perf.stage_frame(run_perf['stages']))
+                        profiles = [f for f in ("profile.txt", "profile.html") if os.path.exists(os.path.join(folder_path, f))]
+                        for profile in profiles:
+                            with open(os.path.join(folder_path, profile), "rb") as profile_file:
+                                st.download_button(f"Download {profile}", profile_file.read(), file_name=profile,
+                                                   key=f"profile_{selected_folder}_{profile}")
+                chart_files = [f for f in run_catalog.CHART_FILES
+                               if f in run_catalog.artifacts(root_dir, selected_folder, kind="chart")]
 
-                # Intersect with available files to ensure the listed files are present
-                chart_files = [f for f in chart_files if f in available_files]
+                # Model one-pagers (<solID>.png), oldest first
+                model_run_files = [f"{model}.png" for model in run_catalog.model_ids(root_dir, selected_folder)]
 
-                # Filter model run images (files that match the format *_*_* and end with .png)
-                model_run_files = [f for f in available_files if f not in chart_files and f.count('_') == 2 and f.endswith('.png')]
-
-                # Sort model run files by modified time in ascending order (oldest first)
-                model_run_files.sort(key=lambda x: os.path.getmtime(os.path.join(folder_path, x)))
+                # When the run exported its Pareto candidates, offer them best first instead
+                pareto_path = os.path.join(folder_path, "pareto_hyperparameters.csv")
+                pareto_df = load_pareto_models(pareto_path, os.path.getmtime(pareto_path)) if os.path.exists(pareto_path) else None
+                model_labels = {}
+                if pareto_df is not None and not pareto_df.empty:
+                    model_run_files = list(pareto_df['solID'])
+                    model_labels = {
+                        sol_id: f"{sol_id} (front {front}, NRMSE {nrmse:.4f}, DECOMP.RSSD {rssd:.4f})"
+                        for sol_id, front, nrmse, rssd in zip(pareto_df['solID'], pareto_df['robynPareto'],
+                                                              pareto_df['nrmse'], pareto_df['decomp.rssd'])
+                    }
 
                 # Allow user to select a chart, default to pareto_front if available
                 if chart_files:
@@ -110,21 +187,24 @@ def run_model_display():
                         # Display the selected chart with full name in caption
                         try:
                             file_path = os.path.join(folder_path, selected_chart)
-                            image = Image.open(file_path)
-                            st.image(image, caption=f"{selected_chart}", use_column_width=True)
+                            show_image(file_path, selected_chart, "chart")
                         except Exception as e:
                             st.error(f"Error loading image {selected_chart}: {str(e)}")
 
                 # Allow user to select a model run, default to the oldest one
                 if model_run_files:
-                    selected_model_run = st.selectbox("Select a Model Run to View", model_run_files, index=0)
+                    selected_model_run = st.selectbox("Select a Model Run to View", model_run_files, index=0,
+                                                      format_func=lambda model: model_labels.get(model, model))
                     if selected_model_run:
-                        try:
-                            file_path = os.path.join(folder_path, selected_model_run)
-                            image = Image.open(file_path)
-                            st.image(image, caption=f"{selected_model_run}", use_column_width=True)
-                        except Exception as e:
-                            st.error(f"Error loading model run image {selected_model_run}: {str(e)}")
+                        image_file = selected_model_run if selected_model_run.endswith('.png') else f"{selected_model_run}.png"
+                        if os.path.exists(os.path.join(folder_path, image_file)):
+                            try:
+                                file_path = os.path.join(folder_path, image_file)
+                                show_image(file_path, image_file, "model")
+                            except Exception as e:
+                                st.error(f"Error loading model run image {image_file}: {str(e)}")
+                        if pareto_df is not None:
+                            st.dataframe(pareto_df[pareto_df['solID'] == selected_model_run])
 
                         # Add a checkbox to apply the selected model
                         if st.session_state.selected_model is None:
@@ -138,13 +218,7 @@ def run_model_display():
                             st.header("Budget Allocator using selected Model")
                             st.subheader("Channel Constraints")
                             channel_constraints = {}
-                            channels = [
-                                "dsp_recruit_cost", "dsp_conversion_cost", "dsp_awareness_cost",
-                                "sd_recruit_cost", "sp_auto_cost", "sb_defend_cost",
-                                "sp_recruit_cost", "sp_attack_cost", "sp_defend_cost",
-                                "sb_recruit_cost", "sd_defend_cost", "sb_attack_cost",
-                                "sd_attack_cost"
-                            ]
+                            channels = data_schema.SPEND_COLUMNS
 
                             for channel in channels:
                                 col1, col2 = st.columns(2)
@@ -171,12 +245,85 @@ def run_model_display():
                                     }
 
 
-                                    # Export parameters to a JSON file
-                                    json_file_path = os.path.join("allocation_params.json")
-                                    with open(json_file_path, 'w') as json_file:
+                                    # Export parameters to a JSON file in the workspace
+                                    json_file_path = workspace.config_path(st.session_state.get('cust'), st.session_state.get('country_filtered'),
+                                                                           "allocation_params.json")
+                                    with workspace.atomic_open(json_file_path, 'w') as json_file:
                                         json.dump(parameters, json_file, indent=4)
                                     st.success(f"Parameters exported to {json_file_path}")
-                                    budget_allocate.run_budget_allocate()
 
-                                    # Display the results immediately after exporting
+                                    # Run the allocator in a background job and show its results once it is done
+                                    st.session_state.allocation_job = job_runner.submit(
+                                        "allocate", {**parameters, "output_root": root_dir, "run_dir": folder_path},
+                                        owner=st.session_state.get('cust'))
+                                    st.session_state.allocation_params = {**parameters, "run": selected_folder}
+
+                            allocation_job = job_runner.get_job(st.session_state.allocation_job) if st.session_state.get('allocation_job') else None
+                            if (allocation_job and allocation_job['params']['model'] == st.session_state.selected_model
+                                    and allocation_job['params'].get('run_dir') == folder_path):
+                                if allocation_job['status'] == 'done':
+                                    results_df = pd.read_csv(allocation_job['result'])
+                                    # The optimizer keeps every channel inside its bounds, so an out-of-range budget is clipped
+                                    requested = allocation_job['params'].get('total_budget')
+                                    if requested and "optmSpendTotal" in results_df and abs(results_df["optmSpendTotal"].iloc[0] - requested) > 0.01 * requested:
+                                        st.warning(f"Total budget {requested:,.0f} is outside what the channel constraints allow; "
+                                                   f"allocated {results_df['optmSpendTotal'].iloc[0]:,.0f} instead.")
+                                    budget_allocate.run_budget_allocate(allocation_job['result'], allocation_job['params'].get('run_dir'))
+                                elif allocation_job['status'] in ('queued', 'running'):
+                                    st.progress(allocation_job['progress'], text=f"Budget allocator {allocation_job['status']}...")
+                                    st.button("Refresh Allocation Status")
+                                else:
+                                    st.error(f"Budget allocator {allocation_job['status']}: {allocation_job['error'] or ''}")
                                     
+
+                # Side-by-side comparison computed from the exported decomposition instead of images
+                if pareto_df is not None and not pareto_df.empty:
+                    with st.expander("Compare Models"):
+                        compare_models = st.multiselect("Models to compare", list(pareto_df['solID']),
+                                                        default=list(pareto_df['solID'][:5]), key="compare_models")
+                        if compare_models:
+                            baseline = st.selectbox("Baseline model", compare_models, index=0)
+                            fit_table, channels_table, curves_table = load_comparison(
+                                folder_path, tuple(compare_models), baseline, os.path.getmtime(pareto_path))
+                            st.dataframe(fit_table)
+                            st.subheader("Channel contribution")
+                            st.altair_chart(model_compare.contribution_chart(channels_table), use_container_width=True)
+                            st.subheader("ROI by channel")
+                            st.altair_chart(model_compare.roi_chart(channels_table), use_container_width=True)
+                            st.subheader("Response curves")
+                            curve_channel = st.selectbox("Channel", sorted(channels_table['channel'].unique()))
+                            st.altair_chart(model_compare.curves_chart(curves_table, curve_channel), use_container_width=True)
+                            st.dataframe(channels_table[channels_table['solID'] != baseline])
+
+                # Scenario mode: many budgets x constraint presets x models in one batched run
+                if pareto_df is not None and not pareto_df.empty:
+                    with st.expander("Budget Scenario Sweep"):
+                        sweep_models = st.multiselect("Models", list(pareto_df['solID']), default=list(pareto_df['solID'][:3]))
+                        sweep_presets = st.multiselect("Constraint presets (lower-upper)", list(allocator.CONSTRAINT_PRESETS),
+                                                       default=["0.5-1.5", "1.0-2.0", "1.5-3.0"])
+                        col1, col2, col3 = st.columns(3)
+                        with col1:
+                            budget_min = st.number_input("Lowest Total Budget", value=3500000, step=100000)
+                        with col2:
+                            budget_max = st.number_input("Highest Total Budget", value=10500000, step=100000)
+                        with col3:
+                            budget_steps = st.number_input("Budget Steps", min_value=2, max_value=50, value=10)
+                        sweep_dates = st.date_input("Sweep Date Range", [datetime(2024, 1, 1), datetime(2024, 3, 31)])
+                        if st.button("Run Scenario Sweep") and sweep_models and sweep_presets:
+                            budgets = tuple(float(b) for b in np.linspace(budget_min, budget_max, int(budget_steps)))
+                            try:
+                                st.session_state.scenario_sweep = run_scenario_sweep(
+                                    folder_path, tuple(sweep_models), budgets, tuple(sweep_presets),
+                                    tuple(d.strftime("%Y-%m-%d") for d in sweep_dates), os.path.getmtime(pareto_path))
+                            except (FileNotFoundError, KeyError, ValueError) as e:
+                                st.error(f"Scenario sweep failed: {e}")
+                        if st.session_state.get('scenario_sweep'):
+                            sweep_table, frontier = st.session_state.scenario_sweep
+                            if not frontier['feasible'].all():
+                                st.warning("Some budgets are outside what their constraint preset allows and were clipped.")
+                            frontier_chart = frontier.assign(scenario=frontier['solID'] + " / " + frontier['preset'])
+                            st.line_chart(frontier_chart, x="allocated_budget", y="optmResponseTotal", color="scenario")
+                            st.dataframe(frontier)
+                            st.dataframe(sweep_table)
+                            st.download_button("Download Scenario Table", sweep_table.to_csv(index=False),
+                                               file_name=f"{selected_folder}_scenario_sweep.csv")
@@ -0,0 +1,485 @@
+import csv
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import Ridge
+
+import data_schema
+import parallel_run
+import pareto
+import perf
+import search
+import transforms
+import time_series_cv
+import workspace
+
+HYPERPARAMETER_CONFIG = "hyperparameter_config.csv"
+MODEL_PARAMS = "model_params.csv"
+CONTEXT_VARS = ["is_amazon_sale", "snss", "ntb_total_product_sales_lag1"]
+HYPER_NAMES = ["alphas", "gammas", "thetas"]
+LAMBDA_RANGE = (1e-3, 10.0)
+BATCH_SIZE = 100
+
+
+def load_hyperparameter_bounds(path=HYPERPARAMETER_CONFIG):
+    """Read the ranges saved by the "Save Hyperparameters" button into {channel: {name: (min, max)}}."""
+    bounds = {}
+    with open(path, newline='') as csvfile:
+        for row in csv.DictReader(csvfile):
+            channel, name = row["Variable Name"].rsplit("_", 1)
+            bounds.setdefault(channel, {})[name] = (float(row["Min Value"]), float(row["Max Value"]))
+    return bounds
+
+
+def load_model_params(path=MODEL_PARAMS):
+    with open(path, newline='') as csvfile:
+        values = {row["parameter"]: row["Value"] for row in csv.DictReader(csvfile)}
+    return {
+        "iterations": int(values.get("iterations", 1000)),
+        "trials": int(values.get("trials", 5)),
+        "ts_validation": str(values.get("ts_validation", "False")).lower() == "true",
+        "cv_scheme": values.get("cv_scheme", "expanding"),
+        "cv_folds": int(values.get("cv_folds", time_series_cv.FOLDS)),
+        "search_strategy": values.get("search_strategy", "random"),
+        "early_stop": str(values.get("early_stop", "False")).lower() == "true",
+        "country": values.get("country"),
+        "cust": values.get("cust"),
+    }
+
+
+def model_rows(df, country=None):
+    # The rows of one country that have a dependent variable, in date order
+    if country is not None and data_schema.COUNTRY_COLUMN in df.columns:
+        df = df[df[data_schema.COUNTRY_COLUMN].astype("string") == str(country)]
+    return df.dropna(subset=[data_schema.DEP_VAR]).sort_values(data_schema.DATE_COLUMN).reset_index(drop=True)
+
+
+def prepare_inputs(df, channels, country=None, context_vars=CONTEXT_VARS):
+    """Turn the uploaded frame into the arrays the fitter works on."""
+    df = model_rows(df, country)
+    if df.empty:
+        raise ValueError(f"No rows to model for country '{country}'")
+
+    spend_cols = [f"{channel}_cost" for channel in channels]
+    context_vars = [col for col in context_vars if col in df.columns]
+    context = df[context_vars].astype("float64")
+    return {
+        "frame": df,
+        "channels": list(channels),
+        "spend_cols": spend_cols,
+        "context_vars": context_vars,
+        "dates": pd.to_datetime(df[data_schema.DATE_COLUMN]).to_numpy(),
+        "spend": df[spend_cols].fillna(0).to_numpy(dtype="float64").T,
+        # Same imputation as the R notebook: missing context values take the column mean
+        "context": context.fillna(context.mean()).fillna(0).to_numpy(),
+        "y": df[data_schema.DEP_VAR].to_numpy(dtype="float64"),
+    }
+
+
+def sample_hyperparameters(bounds, channels, n, rng):
+    """Uniform samples inside each channel's ranges, as (n, n_channels) arrays per hyperparameter."""
+    samples = {}
+    for name in HYPER_NAMES:
+        low = np.array([bounds[channel][name][0] for channel in channels])
+        high = np.array([bounds[channel][name][1] for channel in channels])
+        samples[name] = rng.uniform(low, high, size=(n, len(channels)))
+    samples["lambdas"] = np.exp(rng.uniform(*np.log(LAMBDA_RANGE), size=n))
+    return samples
+
+
+def unit_to_samples(unit, bounds, channels):
+    # Map search points in the unit cube onto the ranges: one column per channel and hyperparameter, then lambda
+    samples = {}
+    for i, name in enumerate(HYPER_NAMES):
+        low = np.array([bounds[channel][name][0] for channel in channels])
+        high = np.array([bounds[channel][name][1] for channel in channels])
+        samples[name] = low + unit[:, i * len(channels):(i + 1) * len(channels)] * (high - low)
+    log_low, log_high = np.log(LAMBDA_RANGE)
+    samples["lambdas"] = np.exp(log_low + unit[:, -1] * (log_high - log_low))
+    return samples
+
+
+def nrmse(y, y_pred):
+    return np.sqrt(np.mean((y - y_pred) ** 2, axis=-1)) / (y.max(axis=-1) - y.min(axis=-1))
+
+
+def decomp_rssd(effect, spend_total):
+    # Distance between each channel's share of effect and its share of spend
+    effect_share = effect / np.where(effect.sum(axis=-1, keepdims=True) == 0, 1, effect.sum(axis=-1, keepdims=True))
+    spend_share = spend_total / spend_total.sum()
+    return np.sqrt(np.sum((effect_share - spend_share) ** 2, axis=-1))
+
+
+def fit_ridge(X, y, lambda_, n_media):
+    """Ridge fit with non-negative media coefficients and unconstrained context coefficients.
+
+    Columns are scaled to unit variance so one lambda range suits every design.
+    Context columns enter twice with opposite signs; under the positivity
+    constraint this is equivalent to leaving their coefficient free.
+    """
+    x_std = X.std(axis=0)
+    x_std[x_std == 0] = 1.0
+    y_std = y.std() or 1.0
+    X_s = X / x_std
+    design = np.hstack([X_s, -X_s[:, n_media:]])
+    model = Ridge(alpha=lambda_, positive=True).fit(design, y / y_std)
+    coef_s = model.coef_[:X.shape[1]].copy()
+    coef_s[n_media:] -= model.coef_[X.shape[1]:]
+    return coef_s * y_std / x_std, model.intercept_ * y_std
+
+
+def fit_batch(spend, context, y, samples, train_rows=None, start=0, folds=None):
+    """Transform and fit every candidate in `samples`; returns per-candidate metric and coefficient arrays.
+
+    Only rows from `start` on are fitted; earlier days just carry adstock into the window.
+    Rows from `train_rows` on are held out as the test set, and `folds`
+    (see time_series_cv.splits) are validated on the same transformed design.
+    """
+    saturated, inflexion = transforms.transform_media(spend, samples["thetas"], samples["alphas"], samples["gammas"])
+    n, n_media, n_days = saturated.shape
+    train = slice(start, n_days) if train_rows is None else slice(start, train_rows)
+    coefs = np.zeros((n, n_media + context.shape[1]))
+    intercepts = np.zeros(n)
+    predictions = np.zeros((n, n_days))
+    for i in range(n):
+        X = np.hstack([saturated[i].T, context])
+        coefs[i], intercepts[i] = fit_ridge(X[train], y[train], samples["lambdas"][i], n_media)
+        predictions[i] = X @ coefs[i] + intercepts[i]
+
+    media_effect = np.einsum("nct,nc->nc", saturated[:, :, start:], coefs[:, :n_media])
+    train_effect = np.einsum("nct,nc->nc", saturated[:, :, train], coefs[:, :n_media])
+    residual = y[train] - predictions[:, train]
+    result = {
+        "coefs": coefs,
+        "intercepts": intercepts,
+        "inflexion": inflexion,
+        "media_effect": media_effect,
+        "nrmse": nrmse(y[train], predictions[:, train]),
+        "decomp_rssd": decomp_rssd(train_effect, spend[:, train].sum(axis=1)),
+        "rsq_train": 1 - (residual ** 2).sum(axis=1) / ((y[train] - y[train].mean()) ** 2).sum(),
+    }
+    if folds:
+        X = time_series_cv.design(saturated, context)
+        fold_coefs, fold_intercepts = time_series_cv.fit_folds(X, y, samples["lambdas"], n_media, folds)
+        result["nrmse_val_folds"] = time_series_cv.fold_nrmse(X, y, fold_coefs, fold_intercepts, folds)
+        result["nrmse_val"] = result["nrmse_val_folds"].mean(axis=1)
+    if train_rows is not None:
+        result["nrmse_test"] = nrmse(y[train_rows:], predictions[:, train_rows:])
+    return result
+
+
+def candidates_to_frames(inputs, samples, fitted, sol_ids, trial, start=0):
+    """Flatten one fitted batch into the hyperparameter table and the long decomposition table."""
+    channels, spend_cols = inputs["channels"], inputs["spend_cols"]
+    hyper = pd.DataFrame({
+        "solID": sol_ids,
+        "trial": trial,
+        "nrmse": fitted["nrmse"],
+        "decomp.rssd": fitted["decomp_rssd"],
+        "rsq_train": fitted["rsq_train"],
+        "lambda": samples["lambdas"],
+    })
+    for metric in ("nrmse_val", "nrmse_test"):
+        if metric in fitted:
+            hyper[metric] = fitted[metric]
+    if "nrmse_val_folds" in fitted:
+        for k in range(fitted["nrmse_val_folds"].shape[1]):
+            hyper[f"nrmse_val_fold{k + 1}"] = fitted["nrmse_val_folds"][:, k]
+    for name in HYPER_NAMES:
+        for j, col in enumerate(spend_cols):
+            hyper[f"{col}_{name}"] = samples[name][:, j]
+
+    n, n_media = len(sol_ids), len(channels)
+    spend = inputs["spend"][:, start:]
+    spend_total = spend.sum(axis=1)
+    effect_total = fitted["media_effect"].sum(axis=1, keepdims=True)
+    rn = spend_cols + inputs["context_vars"]
+    decomp = pd.DataFrame({
+        "solID": np.repeat(sol_ids, len(rn)),
+        "rn": np.tile(rn, n),
+        "coef": fitted["coefs"].ravel(),
+    })
+    media_rows = np.tile(np.arange(len(rn)) < n_media, n)
+    decomp.loc[media_rows, "xDecompAgg"] = fitted["media_effect"].ravel()
+    decomp.loc[media_rows, "total_spend"] = np.tile(spend_total, n)
+    decomp.loc[media_rows, "mean_spend"] = np.tile(spend.mean(axis=1), n)
+    decomp.loc[media_rows, "spend_share"] = np.tile(spend_total / spend_total.sum(), n)
+    decomp.loc[media_rows, "effect_share"] = (fitted["media_effect"] / np.where(effect_total == 0, 1, effect_total)).ravel()
+    decomp.loc[media_rows, "roi_total"] = (fitted["media_effect"] / np.where(spend_total == 0, np.nan, spend_total)).ravel()
+    decomp.loc[media_rows, "inflexion"] = fitted["inflexion"].ravel()
+    intercept = pd.DataFrame({"solID": sol_ids, "rn": "(Intercept)", "coef": fitted["intercepts"]})
+    return hyper, pd.concat([decomp, intercept], ignore_index=True)
+
+
+def run_batch(inputs, bounds, trial, batch, n, seed=123, train_rows=None, start=0, folds=None):
+    """Sample and fit one batch of candidates; the batch has its own random stream so results don't depend on scheduling."""
+    rng = np.random.default_rng([seed, trial, batch])
+    samples = sample_hyperparameters(bounds, inputs["channels"], n, rng)
+    fitted = fit_batch(inputs["spend"], inputs["context"], inputs["y"], samples, train_rows, start, folds)
+    # Robyn style model IDs: trial_batch_candidate
+    sol_ids = [f"{trial}_{batch}_{k}" for k in range(1, n + 1)]
+    hyper, decomp = candidates_to_frames(inputs, samples, fitted, sol_ids, trial, start)
+    hyper.insert(2, "iterNG", batch)
+    return hyper, decomp
+
+
+def screen_candidates(inputs, samples, keep, start=0, train_end=None, rungs=search.SCREEN_RUNGS, factor=search.SCREEN_FACTOR):
+    """Successive halving: indices of the `keep` best candidates after `rungs` rounds of cheap fits.
+
+    Every round fits the survivors with the closed-form ridge of
+    time_series_cv, stopped after a growing number of solver sweeps, and keeps
+    the best 1/factor of them. The transforms are computed once.
+    """
+    rows = slice(start, train_end or len(inputs["y"]))
+    n_media = len(inputs["channels"])
+    saturated, _ = transforms.transform_media(inputs["spend"], samples["thetas"], samples["alphas"], samples["gammas"])
+    X = time_series_cv.design(saturated, inputs["context"])
+    y, spend_total = inputs["y"][rows], inputs["spend"][:, rows].sum(axis=1)
+    survivors = np.arange(len(samples["lambdas"]))
+    for rung in range(rungs):
+        coefs, intercepts = time_series_cv.fit_folds(X[survivors], inputs["y"], samples["lambdas"][survivors], n_media,
+                                                     [(rows.start, rows.stop, rows.stop)], search.SCREEN_SWEEPS * factor ** rung)
+        pred = np.einsum("ntp,np->nt", X[survivors, rows], coefs[:, 0]) + intercepts[:, :1]
+        effect = np.einsum("nct,nc->nc", saturated[survivors, :, rows], coefs[:, 0, :n_media])
+        scores = search.score(nrmse(y, pred), decomp_rssd(effect, spend_total))
+        n_keep = keep if rung == rungs - 1 else max(keep, len(survivors) // factor)
+        survivors = survivors[np.argsort(scores, kind="stable")[:n_keep]]
+    return survivors
+
+
+def run_search_trial(inputs, bounds, trial, iterations, seed=123, train_rows=None, start=0, folds=None,
+                     strategy="random", early_stop=True, batch_size=BATCH_SIZE, report=None):
+    """One trial of a search strategy (see search.py), fitted generation by generation.
+
+    Stops before `iterations` candidates once the trial has converged, when `early_stop` is set.
+    `report(fitted, total)` is called after every generation.
+    """
+    rng = np.random.default_rng([seed, trial])
+    channels = inputs["channels"]
+    state = search.start(strategy, len(HYPER_NAMES) * len(channels) + 1, batch_size)
+    screen = search.STRATEGIES[strategy]["screen"]
+    hypers, decomps = [], []
+    for generation, first in enumerate(range(0, iterations, batch_size), start=1):
+        n = min(batch_size, iterations - first)
+        unit = search.ask(state, n * search.SCREEN_FACTOR ** screen, rng)
+        samples = unit_to_samples(unit, bounds, channels)
+        if screen:
+            kept = screen_candidates(inputs, samples, n, start, train_rows, screen)
+            unit, samples = unit[kept], {name: values[kept] for name, values in samples.items()}
+        fitted = fit_batch(inputs["spend"], inputs["context"], inputs["y"], samples, train_rows, start, folds)
+        sol_ids = [f"{trial}_{generation}_{k}" for k in range(1, n + 1)]
+        hyper, decomp = candidates_to_frames(inputs, samples, fitted, sol_ids, trial, start)
+        hyper.insert(2, "iterNG", generation)
+        hypers.append(hyper)
+        decomps.append(decomp)
+        search.tell(state, unit, search.score(fitted.get("nrmse_val", fitted["nrmse"]), fitted["decomp_rssd"]))
+        stop = early_stop and search.converged(state)
+        if report:
+            # A trial that stops early has fitted all it will
+            report(first + n, first + n if stop else iterations)
+        if stop:
+            break
+    return pd.concat(hypers, ignore_index=True), pd.concat(decomps, ignore_index=True)
+
+
+def batch_tasks(bounds, iterations, trials, seed=123, train_rows=None, batch_size=BATCH_SIZE, start=0, folds=None):
+    return [
+        {"bounds": bounds, "trial": trial, "batch": batch, "n": min(batch_size, iterations - first),
+         "seed": seed, "train_rows": train_rows, "start": start, "folds": folds}
+        for trial in range(1, trials + 1)
+        for batch, first in enumerate(range(0, iterations, batch_size), start=1)
+    ]
+
+
+def sequential_trials(strategy="random", early_stop=False):
+    # Plain random search splits trials into independent batches; other searches run each trial as one task
+    return strategy != "random" or early_stop
+
+
+def max_workers(iterations, trials, strategy="random", early_stop=False, batch_size=BATCH_SIZE):
+    """Most worker processes a run can use: one per trial for sequential searches, else one per batch."""
+    return trials if sequential_trials(strategy, early_stop) else trials * -(-iterations // batch_size)
+
+
+def run_trials(inputs, bounds, iterations, trials, seed=123, ts_validation=False, workers=1, progress=None, start=0,
+               cv_scheme="expanding", cv_folds=None, strategy="random", early_stop=False):
+    """Fit every batch of every trial, on `workers` processes; returns the hyperparameter and decomposition tables.
+
+    With `ts_validation` every candidate is also cross-validated on `cv_folds`
+    date folds and tested on the last days, which the main fit leaves out.
+    Plain random search fits independent batches; other strategies and early
+    stopping run each trial as one sequential task.
+    """
+    folds, train_rows = None, None
+    if ts_validation:
+        folds, train_rows = validation_folds(len(inputs["y"]), start, cv_scheme, cv_folds)
+    task_fn = run_batch
+    tasks = batch_tasks(bounds, iterations, trials, seed, train_rows, start=start, folds=folds)
+    sizes = [task["n"] for task in tasks]
+    if sequential_trials(strategy, early_stop):
+        task_fn = run_search_trial
+        tasks = [{"bounds": bounds, "trial": trial, "iterations": iterations, "seed": seed, "train_rows": train_rows,
+                  "start": start, "folds": folds, "strategy": strategy, "early_stop": early_stop}
+                 for trial in range(1, trials + 1)]
+        sizes = [iterations] * trials
+    arrays = {key: inputs[key] for key in ("spend", "context", "y")}
+    static = {key: inputs[key] for key in ("channels", "spend_cols", "context_vars")}
+    # Progress counts candidates; search trials report after every generation
+    results = parallel_run.run_tasks(task_fn, arrays, static, tasks, workers, progress, sizes,
+                                     reports=task_fn is run_search_trial)
+    return (pd.concat([hyper for hyper, _ in results], ignore_index=True),
+            pd.concat([decomp for _, decomp in results], ignore_index=True))
+
+
+def validation_folds(n_days, start=0, cv_scheme="expanding", cv_folds=None):
+    return time_series_cv.splits(n_days, cv_folds or time_series_cv.FOLDS, cv_scheme, start)
+
+
+def worker_scaling(inputs, bounds, iterations, trials, worker_counts, seed=123):
+    """Wall time and speedup of the same run on each worker count, to size machines."""
+    return parallel_run.scaling_report(
+        lambda workers: run_trials(inputs, bounds, iterations, trials, seed, workers=workers), worker_counts)
+
+
+def model_export(inputs, bounds, settings, run_time, start=0):
+    # Same layout as Robyn's RobynModel-models.json, so Python and R runs are read the same way
+    frame = inputs["frame"].copy()
+    for col in frame.columns:
+        if pd.api.types.is_datetime64_any_dtype(frame[col]):
+            frame[col] = frame[col].dt.strftime("%Y-%m-%d")
+    dates = pd.to_datetime(inputs["dates"])
+    window = dates[start:]
+    refresh = settings.get("refresh") or {}
+    return {
+        "InputCollect": {
+            "date_var": [data_schema.DATE_COLUMN],
+            "dayInterval": [1],
+            "intervalType": ["day"],
+            "dep_var": [data_schema.DEP_VAR],
+            "dep_var_type": ["revenue"],
+            "context_vars": inputs["context_vars"],
+            "paid_media_spends": inputs["spend_cols"],
+            "paid_media_vars": [data_schema.EXPOSURE_COLUMNS[data_schema.CHANNELS.index(c)] for c in inputs["channels"]],
+            "window_start": [window.min().strftime("%Y-%m-%d")],
+            "window_end": [window.max().strftime("%Y-%m-%d")],
+            "rollingWindowLength": [len(window)],
+            "refreshAddedStart": [refresh.get("added_start", window.min().strftime("%Y-%m-%d"))],
+            "totalObservations": [len(dates)],
+            "adstock": ["geometric"],
+            "hyperparameters": {
+                f"{channel}_cost_{name}": list(bounds[channel][name])
+                for channel in inputs["channels"] for name in HYPER_NAMES
+            },
+        },
+        "ModelsCollect": {
+            "ts_validation": [settings["ts_validation"]],
+            "train_timestamp": [settings["train_timestamp"]],
+            "run_time": [f"{run_time / 60:.2f} min"],
+            "total_iters": [settings["iterations"] * settings["trials"]],
+            "iterations": [settings["iterations"]],
+            "trials": [settings["trials"]],
+            "seed": [settings["seed"]],
+            "cores": [settings["cores"]],
+            "pareto_fronts": [settings["pareto_fronts"]],
+            "nevergrad_algo": [settings.get("strategy", "random")],
+            "early_stop": [settings.get("early_stop", False)],
+            "iterations_run": [settings.get("iterations_run")],
+            "conv_msg": settings.get("conv_msg", []),
+            "cv_scheme": [settings.get("cv_scheme") if settings["ts_validation"] else None],
+            "ts_folds": [
+                {"train_start": str(dates[a].date()), "train_end": str(dates[b - 1].date()), "val_end": str(dates[v - 1].date())}
+                for a, b, v in settings.get("folds") or []
+            ],
+            "refresh": [bool(refresh)],
+            "refresh_base": [refresh.get("base_run")],
+            "refresh_model": [refresh.get("sol_id")],
+        },
+        "Extras": {"raw_data": json.loads(frame.to_json(orient="records"))},
+    }
+
+
+def new_run_dir(output_root, tag="py"):
+    # Folder names carry the start minute, which the viewer parses; a suffix keeps runs in the same minute apart
+    base = os.path.join(output_root, f"Robyn_{datetime.now().strftime('%Y%m%d%H%M')}_{tag}")
+    run_dir, n = base, 1
+    while True:
+        try:
+            os.makedirs(run_dir)
+            return run_dir
+        except FileExistsError:
+            n += 1
+            run_dir = f"{base}_{n}"
+
+
+def run_model(df, bounds, iterations, trials, ts_validation=False, seed=123, country=None,
+              output_root="./mars-pne_uk", workers=1, pareto_fronts=3, progress=None, refresh=None,
+              cv_scheme="expanding", cv_folds=None, strategy="random", early_stop=False, profiler=perf.DEFAULT_PROFILER):
+    """Fit every trial and write the run folder; returns its path.
+
+    `refresh` (see model_refresh.plan_refresh) fits only the rolling window
+    starting at refresh["window_start"], with the narrowed `bounds` of a refresh.
+    Stage timings are written to perf.json, and with a `profiler` (see
+    perf.PROFILERS) a profile of the whole run is written next to it.
+    """
+    with perf.recording(profiler=profiler):
+        started = time.time()
+        channels = [channel for channel in data_schema.CHANNELS
+                    if channel in bounds and f"{channel}_cost" in df.columns]
+        with perf.stage("prepare inputs"):
+            inputs = prepare_inputs(df, channels, country)
+        start = 0
+        if refresh:
+            start = int(np.searchsorted(inputs["dates"], np.datetime64(refresh["window_start"])))
+
+        with perf.stage("fit trials"):
+            # More workers than tasks would sit idle
+            workers = min(workers, max_workers(iterations, trials, strategy, early_stop))
+            all_hyper, all_decomp = run_trials(inputs, bounds, iterations, trials, seed, ts_validation, workers,
+                                               progress, start, cv_scheme, cv_folds, strategy, early_stop)
+        perf.count("candidates fitted", len(all_hyper))
+
+        # Everything is written to a hidden staging folder first and published in one rename
+        staging = workspace.staging_dir(output_root)
+        try:
+            # Score spread per trial and generation, the data behind Robyn's convergence plots
+            history = all_hyper.groupby(["trial", "iterNG"]).agg(
+                candidates=("solID", "size"), nrmse_median=("nrmse", "median"), nrmse_min=("nrmse", "min"),
+                decomp_rssd_median=("decomp.rssd", "median"), decomp_rssd_min=("decomp.rssd", "min")).reset_index()
+            history.to_csv(os.path.join(staging, "convergence.csv"), index=False)
+
+            with perf.stage("pareto ranking"):
+                all_hyper = pareto.rank_candidates(all_hyper, max_fronts=pareto_fronts)
+            with perf.stage("write tables"):
+                all_hyper.to_csv(os.path.join(staging, "all_hyperparameters.csv"), index=False)
+                all_decomp.to_parquet(os.path.join(staging, "all_aggregated.parquet"), index=False)
+
+                # Robyn's pareto exports: the candidates on fronts 1..pareto_fronts, best first
+                pareto_hyper = all_hyper[all_hyper["robynPareto"] > 0]
+                pareto_hyper.to_csv(os.path.join(staging, "pareto_hyperparameters.csv"), index=False)
+                pareto_decomp = all_decomp[all_decomp["solID"].isin(pareto_hyper["solID"])]
+                pareto_decomp.merge(pareto_hyper[["solID", "robynPareto"]], on="solID").to_csv(
+                    os.path.join(staging, "pareto_aggregated.csv"), index=False)
+
+            settings = {
+                "iterations": iterations, "trials": trials, "ts_validation": ts_validation, "seed": seed,
+                "cores": workers, "pareto_fronts": pareto_fronts, "refresh": refresh, "cv_scheme": cv_scheme,
+                "strategy": strategy, "early_stop": early_stop, "iterations_run": len(all_hyper),
+                "conv_msg": search.conv_msg(all_hyper),
+                "folds": validation_folds(len(inputs["y"]), start, cv_scheme, cv_folds)[0] if ts_validation else None,
+                "train_timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            }
+            with perf.stage("write export json"), open(os.path.join(staging, "RobynModel-models.json"), "w") as json_file:
+                json.dump(model_export(inputs, bounds, settings, time.time() - started, start), json_file)
+            perf.record("run total", time.time() - started)
+            perf.finish(staging)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        run_dir = new_run_dir(output_root, "refresh" if refresh else "py")
+        workspace.publish_dir(staging, run_dir)
+        return run_dir
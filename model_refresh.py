@@ -0,0 +1,90 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import data_schema
+import model_fit
+import robyn_export
+import run_catalog
+
+# Refresh runs: when new days of data arrive, start from an earlier run of the
+# same series instead of a full rebuild. The hyperparameters of the model the
+# analyst selected in that run become priors: every range is narrowed around
+# the selected value, and only the rolling window ending at the new last date
+# is refitted, with a fraction of the full run's iterations. Earlier days
+# still carry adstock into the window.
+REFRESH_WIDTH = 0.3
+REFRESH_SHARE = 0.1
+
+
+def base_run(runs_root, dates):
+    """Latest fitted run in `runs_root` whose window ends inside `dates`, before its last day; None if there is none."""
+    dates = pd.DatetimeIndex(dates)
+    if dates.empty:
+        return None
+    run_catalog.refresh(runs_root)
+    for name, _ in run_catalog.list_runs(runs_root):
+        run_dir = os.path.join(runs_root, name)
+        if not os.path.exists(os.path.join(run_dir, "pareto_hyperparameters.csv")):
+            # R runs have no exported candidates to start from
+            continue
+        try:
+            window_end = pd.Timestamp(robyn_export.scalar(robyn_export.input_collect(run_dir)["window_end"]))
+        except (FileNotFoundError, KeyError, ValueError):
+            continue
+        if dates.min() <= window_end < dates.max():
+            return run_dir
+    return None
+
+
+def selected_model(run_dir):
+    """The run's model the analyst last ran the allocator for, else its best ranked candidate."""
+    hyper = pd.read_csv(os.path.join(run_dir, "pareto_hyperparameters.csv"))
+    # Only allocations recorded in this run: the same solIDs recur in every run
+    runs_root, run = os.path.split(os.path.abspath(run_dir))
+    run_catalog.refresh(runs_root)
+    allocated = [model for model in run_catalog.allocated_models(runs_root, run) if model in set(hyper["solID"])]
+    if allocated:
+        return allocated[0], hyper.set_index("solID")
+    return hyper["solID"].iloc[0], hyper.set_index("solID")
+
+
+def prior_bounds(bounds, priors, width=REFRESH_WIDTH):
+    """Ranges narrowed to `width` of their span around each prior value, kept inside the original range."""
+    narrowed = {}
+    for channel, ranges in bounds.items():
+        narrowed[channel] = {}
+        for name, (low, high) in ranges.items():
+            value = priors.get(channel, {}).get(name)
+            if value is None or np.isnan(value):
+                narrowed[channel][name] = (low, high)
+                continue
+            half = (high - low) * width / 2
+            narrowed[channel][name] = (float(max(low, value - half)), float(min(high, value + half)))
+    return narrowed
+
+
+def plan_refresh(runs_root, df, bounds, iterations, country=None):
+    """Settings of a refresh run of `df` from the latest earlier run in `runs_root`, or None when there is nothing to refresh."""
+    dates = pd.to_datetime(model_fit.model_rows(df, country)[data_schema.DATE_COLUMN])
+    run_dir = base_run(runs_root, dates)
+    if run_dir is None:
+        return None
+    collect = robyn_export.input_collect(run_dir)
+    window_end = pd.Timestamp(robyn_export.scalar(collect["window_end"]))
+    window_length = int(robyn_export.scalar(collect["rollingWindowLength"]))
+    sol_id, hyper = selected_model(run_dir)
+    priors = {channel: {name: hyper.loc[sol_id].get(f"{channel}_cost_{name}", np.nan) for name in model_fit.HYPER_NAMES}
+              for channel in bounds}
+    # Same window length as the base run, moved forward to the new last day
+    window_dates = dates.iloc[-window_length:]
+    return {
+        "base_run": os.path.basename(run_dir),
+        "sol_id": sol_id,
+        "window_start": window_dates.min().strftime("%Y-%m-%d"),
+        "window_end": window_dates.max().strftime("%Y-%m-%d"),
+        "added_start": dates[dates > window_end].min().strftime("%Y-%m-%d"),
+        "bounds": prior_bounds(bounds, priors),
+        "iterations": max(model_fit.BATCH_SIZE, int(iterations * REFRESH_SHARE)),
+    }
@@ -0,0 +1,152 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+# Worker processes attach to the shared input arrays once, in the pool
+# initializer, so each task only pickles a few integers instead of the data.
+# Progress goes through a shared (n_tasks, 2) table of done and total work
+# units, which tasks can update while they run and the parent polls. A shared
+# stop flag lets reporting tasks end early once the run has failed or been
+# cancelled, instead of finishing work nobody will read.
+PROGRESS_POLL_S = 0.5
+
+_worker_inputs = None
+_worker_progress = None
+_worker_stop = None
+_worker_segments = []
+
+
+def default_workers():
+    return os.cpu_count() or 1
+
+
+def share_arrays(arrays):
+    """Copy arrays into shared memory blocks; returns the blocks and the specs workers attach with."""
+    segments, specs = [], {}
+    for key, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[...] = array
+        segments.append(segment)
+        specs[key] = (segment.name, array.shape, array.dtype.str)
+    return segments, specs
+
+
+def _attach_array(spec):
+    name, shape, dtype = spec
+    segment = shared_memory.SharedMemory(name=name)
+    _worker_segments.append(segment)
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=segment.buf)
+
+
+class TaskStopped(Exception):
+    pass
+
+
+def _attach(specs, static, control_specs):
+    global _worker_inputs, _worker_progress, _worker_stop
+    _worker_inputs = dict(static)
+    for key, spec in specs.items():
+        _worker_inputs[key] = _attach_array(spec)
+    _worker_progress = _attach_array(control_specs["progress"])
+    _worker_stop = _attach_array(control_specs["stop"])
+
+
+def _reporter(counters, index, on_update=None, stop=None):
+    # Per-task callback: `done` of `total` work units; a task that stops early lowers its total
+    def report(done, total):
+        if stop is not None and stop[0]:
+            raise TaskStopped()
+        counters[index] = (done, total)
+        if on_update:
+            on_update()
+    return report
+
+
+def _run_task(task_fn, index, task, reports):
+    if reports:
+        task = {**task, "report": _reporter(_worker_progress, index, stop=_worker_stop)}
+    return task_fn(_worker_inputs, **task)
+
+
+def run_tasks(task_fn, arrays, static, tasks, workers=None, progress=None, sizes=None, reports=False):
+    """Run `task_fn(inputs, **task)` for every task on a process pool.
+
+    `arrays` are shared with the workers through shared memory, `static` is
+    small metadata pickled once per worker. Results come back in task order.
+    `progress(done, total)` counts work units: `sizes` per task (1 each by
+    default), and with `reports` every task also gets a `report(done, total)`
+    callback to update its own units while it runs. At most one process per
+    task is started.
+    """
+    workers = min(workers or default_workers(), max(len(tasks), 1))
+    counters = np.zeros((len(tasks), 2), dtype=np.int64)
+    counters[:, 1] = sizes if sizes is not None else 1
+
+    def report_progress():
+        if progress:
+            progress(int(counters[:, 0].sum()), int(counters[:, 1].sum()))
+
+    if workers <= 1:
+        inputs = {**static, **arrays}
+        results = []
+        for index, task in enumerate(tasks):
+            if reports:
+                task = {**task, "report": _reporter(counters, index, report_progress)}
+            results.append(task_fn(inputs, **task))
+            counters[index, 0] = counters[index, 1]
+            report_progress()
+        return results
+
+    segments, specs = share_arrays(arrays)
+    control_segments, control_specs = share_arrays({"progress": counters, "stop": np.zeros(1, dtype=bool)})
+    counters = np.ndarray(counters.shape, dtype=counters.dtype, buffer=control_segments[0].buf)
+    stop = np.ndarray(1, dtype=bool, buffer=control_segments[1].buf)
+    results = [None] * len(tasks)
+    try:
+        # spawn rather than fork: the Streamlit server is multi-threaded
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_attach, initargs=(specs, static, control_specs)) as pool:
+            futures = {pool.submit(_run_task, task_fn, index, task, reports): index for index, task in enumerate(tasks)}
+            pending, reported = set(futures), None
+            try:
+                while pending:
+                    finished, pending = wait(pending, timeout=PROGRESS_POLL_S, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        index = futures[future]
+                        results[index] = future.result()
+                        counters[index, 0] = counters[index, 1]
+                    if (counters[:, 0].sum(), counters[:, 1].sum()) != reported:
+                        reported = (counters[:, 0].sum(), counters[:, 1].sum())
+                        report_progress()
+            except BaseException:
+                # A failed task or a cancelled job: drop the queued tasks and stop the running ones
+                stop[0] = True
+                for future in futures:
+                    future.cancel()
+                raise
+    finally:
+        # The views into the control blocks have to go before the blocks are closed
+        del counters, stop
+        for segment in segments + control_segments:
+            segment.close()
+            segment.unlink()
+    return results
+
+
+def scaling_report(run_fn, worker_counts):
+    """Time `run_fn(workers)` for each worker count and report the speedup against the first one."""
+    rows = []
+    for workers in worker_counts:
+        started = time.perf_counter()
+        run_fn(workers)
+        rows.append({"workers": workers, "wall_time_s": time.perf_counter() - started})
+    report = pd.DataFrame(rows)
+    report["speedup"] = report["wall_time_s"].iloc[0] / report["wall_time_s"]
+    report["efficiency"] = report["speedup"] * report["workers"].iloc[0] / report["workers"]
+    return report
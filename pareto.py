@@ -0,0 +1,133 @@
+from bisect import bisect_right
+
+import numpy as np
+
+# Multi-objective ranking of candidate models, all objectives minimised.
+# Front numbers follow Robyn's `robynPareto` column: 1 is the best front,
+# candidates beyond `max_fronts` get 0.
+OBJECTIVES = ["nrmse", "decomp.rssd"]
+CHUNK_SIZE = 1024
+
+
+def _fronts_2d(points):
+    # Sweep in (f1, f2) order: a point joins the first front whose last f2 is
+    # larger than its own. Those last values increase with the front number, so
+    # the right front is found by bisection, O(n log n) for all fronts at once.
+    order = np.lexsort((points[:, 1], points[:, 0]))
+    fronts = np.empty(len(points), dtype=np.int64)
+    last_f2 = []
+    for i, f2 in zip(order, points[order, 1]):
+        k = bisect_right(last_f2, f2)
+        if k == len(last_f2):
+            last_f2.append(f2)
+        else:
+            last_f2[k] = f2
+        fronts[i] = k + 1
+    return fronts
+
+
+def _dominated_by(front, points):
+    # True for each point that some front member is <= on every objective and < on one
+    dominated = np.zeros(len(points), dtype=bool)
+    for start in range(0, len(front), CHUNK_SIZE):
+        block = front[start:start + CHUNK_SIZE, None, :]
+        le = (block <= points[None, :, :]).all(axis=2)
+        lt = (block < points[None, :, :]).any(axis=2)
+        dominated |= (le & lt).any(axis=0)
+    return dominated
+
+
+def _first_front(points):
+    # In lexicographic order a point can only be dominated by points before it,
+    # so chunks are checked against the front found so far and within themselves.
+    order = np.lexsort(points.T[::-1])
+    front = np.empty((0, points.shape[1]))
+    keep = []
+    for start in range(0, len(order), CHUNK_SIZE):
+        idx = order[start:start + CHUNK_SIZE]
+        # Most points are dominated by the front already found; dominance is
+        # transitive, so only the survivors need the pairwise check
+        if len(front):
+            idx = idx[~_dominated_by(front, points[idx])]
+        chunk = points[idx]
+        earlier = np.triu(np.ones((len(idx), len(idx)), dtype=bool), k=1)
+        le = (chunk[:, None, :] <= chunk[None, :, :]).all(axis=2)
+        lt = (chunk[:, None, :] < chunk[None, :, :]).any(axis=2)
+        dominated = (le & lt & earlier).any(axis=0)
+        keep.append(idx[~dominated])
+        front = np.vstack([front, chunk[~dominated]])
+    return np.concatenate(keep) if keep else np.array([], dtype=np.int64)
+
+
+def nondominated_fronts(objectives, max_fronts=None):
+    """Front number (1..k) of every row of an (n, m) objective array; 0 beyond `max_fronts`."""
+    points = np.asarray(objectives, dtype="float64")
+    # Candidates with a missing objective can't be compared and stay unranked
+    valid = ~np.isnan(points).any(axis=1)
+    fronts = np.zeros(len(points), dtype=np.int64)
+    valid_idx = np.flatnonzero(valid)
+    if not len(valid_idx):
+        return fronts
+
+    if points.shape[1] == 2:
+        # Identical points share a front, so rank the unique ones and map back
+        unique, inverse = np.unique(points[valid], axis=0, return_inverse=True)
+        ranked = _fronts_2d(unique)[inverse.ravel()]
+        if max_fronts:
+            ranked[ranked > max_fronts] = 0
+        fronts[valid_idx] = ranked
+        return fronts
+
+    remaining = valid_idx
+    front_no = 1
+    while len(remaining) and (not max_fronts or front_no <= max_fronts):
+        members = remaining[_first_front(points[remaining])]
+        fronts[members] = front_no
+        remaining = np.setdiff1d(remaining, members, assume_unique=True)
+        front_no += 1
+    return fronts
+
+
+def crowding_distance(objectives, fronts):
+    """NSGA-II crowding distance within each front; boundary points get infinity."""
+    points = np.asarray(objectives, dtype="float64")
+    distance = np.zeros(len(points))
+    for front_no in np.unique(fronts[fronts > 0]):
+        idx = np.flatnonzero(fronts == front_no)
+        if len(idx) <= 2:
+            distance[idx] = np.inf
+            continue
+        values = points[idx]
+        order = np.argsort(values, axis=0)
+        sorted_values = np.take_along_axis(values, order, axis=0)
+        span = sorted_values[-1] - sorted_values[0]
+        span[span == 0] = 1.0
+        gaps = np.zeros_like(values)
+        gaps[1:-1] = (sorted_values[2:] - sorted_values[:-2]) / span
+        gaps[[0, -1]] = np.inf
+        per_objective = np.zeros_like(values)
+        np.put_along_axis(per_objective, order, gaps, axis=0)
+        distance[idx] = per_objective.sum(axis=1)
+    return distance
+
+
+def rank_candidates(candidates, objectives=None, max_fronts=3):
+    """Add `robynPareto` and `crowding_distance` to a candidate table and sort it best first.
+
+    MAPE is used as a third objective when the table has it (calibrated runs).
+    """
+    if objectives is None:
+        objectives = OBJECTIVES + (["mape"] if "mape" in candidates and candidates["mape"].notna().any() else [])
+    values = candidates[objectives].to_numpy(dtype="float64")
+    fronts = nondominated_fronts(values, max_fronts)
+    ranked = candidates.assign(robynPareto=fronts, crowding_distance=crowding_distance(values, fronts))
+    ranked = ranked.assign(_front_order=np.where(fronts > 0, fronts, np.iinfo(np.int64).max))
+    ranked = ranked.sort_values(["_front_order", "crowding_distance", objectives[0]],
+                                ascending=[True, False, True], kind="stable")
+    return ranked.drop(columns="_front_order").reset_index(drop=True)
+
+
+def pareto_models(candidates, objectives=None, max_fronts=3):
+    # Only the candidates on fronts 1..max_fronts, best first
+    ranked = rank_candidates(candidates, objectives, max_fronts)
+    return ranked[ranked["robynPareto"] > 0].reset_index(drop=True)
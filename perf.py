@@ -0,0 +1,190 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+import pandas as pd
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+# Lightweight instrumentation of the pipeline stages. Code marks a stage with
+# `with perf.stage("parse upload"):` or @perf.timed(...) and counts events
+# with perf.count(); both go to the recorder active in the current thread, and
+# cost nothing when there is none. The app keeps one recorder per session;
+# model runs keep their own and write it to perf.json in the run folder,
+# optionally with a cProfile or pyinstrument capture of the whole run. Memory
+# is only reported per recorder: the process high-water mark never goes down,
+# so sampling it per stage says nothing about the stage.
+PERF_FILE = "perf.json"
+PROFILERS = ("cprofile", "pyinstrument")
+DEFAULT_PROFILER = os.environ.get("ROBYN_PROFILE") or None
+PROFILE_TOP = 40
+
+_local = threading.local()
+
+
+def new_recorder():
+    return {"started": time.time(), "stages": {}, "counters": {}}
+
+
+def current():
+    return getattr(_local, "recorder", None)
+
+
+def activate(recorder):
+    """Make `recorder` the one stages and counters of this thread go to (None to stop recording)."""
+    _local.recorder = recorder
+
+
+@contextmanager
+def recording(recorder=None, profiler=None):
+    """A recorder active for the duration of the block, e.g. one model run, optionally with a profiler running."""
+    recorder = recorder if recorder is not None else new_recorder()
+    previous = current()
+    activate(recorder)
+    recorder["capture"] = start_profiler(profiler)
+    try:
+        yield recorder
+    finally:
+        # Still running when the block failed before finish()
+        stop_profiler(recorder.pop("capture"))
+        activate(previous)
+
+
+def peak_rss_mb():
+    """Memory high-water mark of this process and of its finished child processes, in MB."""
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    unit = 1 if sys.platform == "darwin" else 1024
+    peaks = [resource.getrusage(who).ru_maxrss for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+    return max(peaks) * unit / 1024 ** 2
+
+
+def record(name, seconds):
+    recorder = current()
+    if recorder is None:
+        return
+    entry = recorder["stages"].setdefault(name, {"calls": 0, "total_s": 0.0, "max_s": 0.0})
+    entry["calls"] += 1
+    entry["total_s"] += seconds
+    entry["max_s"] = max(entry["max_s"], seconds)
+
+
+@contextmanager
+def stage(name):
+    """Time the block as one call of stage `name`."""
+    if current() is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
+
+
+def timed(name):
+    """Decorator: every call of the function is one call of stage `name`."""
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count(name, n=1):
+    recorder = current()
+    if recorder is not None:
+        recorder["counters"][name] = recorder["counters"].get(name, 0) + n
+
+
+def summary(recorder):
+    # JSON-ready totals of a recorder, slowest stage first
+    return {
+        "wall_s": time.time() - recorder["started"],
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": dict(sorted(recorder["stages"].items(), key=lambda item: -item[1]["total_s"])),
+        "counters": dict(recorder["counters"]),
+    }
+
+
+def stage_frame(stages):
+    """Table of stage timings (from a recorder or a perf.json), slowest first."""
+    frame = pd.DataFrame.from_dict(stages, orient="index", columns=["calls", "total_s", "max_s"])
+    frame.index.name = "stage"
+    frame["mean_s"] = frame["total_s"] / frame["calls"].clip(lower=1)
+    return frame.sort_values("total_s", ascending=False)
+
+
+def write(recorder, directory):
+    path = os.path.join(directory, PERF_FILE)
+    with open(path, "w") as json_file:
+        json.dump(summary(recorder), json_file, indent=2)
+    return path
+
+
+def finish(directory):
+    """Write the active recorder to `directory`, with its profile when a profiler is running."""
+    recorder = current()
+    if recorder is None:
+        return
+    stop_profiler(recorder.get("capture"), directory)
+    write(recorder, directory)
+
+
+def load(directory):
+    """The perf.json of a run folder, or None when the run has none."""
+    path = os.path.join(directory, PERF_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as json_file:
+        return json.load(json_file)
+
+
+def available_profilers():
+    return [name for name in PROFILERS if name != "pyinstrument" or pyinstrument is not None]
+
+
+def start_profiler(profiler):
+    """Start a cProfile or pyinstrument capture; None when `profiler` is empty or not installed."""
+    if profiler == "cprofile":
+        capture = cProfile.Profile()
+        capture.enable()
+    elif profiler == "pyinstrument" and pyinstrument is not None:
+        capture = pyinstrument.Profiler()
+        capture.start()
+    else:
+        return None
+    return {"profiler": profiler, "capture": capture, "running": True}
+
+
+def stop_profiler(capture, directory=None):
+    """Stop a capture and write it to `directory`, if given: profile.prof and profile.txt, or profile.html."""
+    if capture is None or not capture["running"]:
+        return
+    capture["running"] = False
+    profiler, capture = capture["profiler"], capture["capture"]
+    if profiler == "cprofile":
+        capture.disable()
+        if directory:
+            capture.dump_stats(os.path.join(directory, "profile.prof"))
+            text = io.StringIO()
+            pstats.Stats(capture, stream=text).sort_stats("cumulative").print_stats(PROFILE_TOP)
+            with open(os.path.join(directory, "profile.txt"), "w") as text_file:
+                text_file.write(text.getvalue())
+    else:
+        capture.stop()
+        if directory:
+            with open(os.path.join(directory, "profile.html"), "w") as html_file:
+                html_file.write(capture.output_html())
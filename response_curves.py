@@ -0,0 +1,188 @@
+import os
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+import robyn_export
+import transforms
+
+# Fitted response curves of a run's models. Daily spend x on a channel is
+# assumed to be kept up long enough for the geometric adstock to reach its
+# steady state x / (1 - theta), so the daily response is
+# coef * hill(x / (1 - theta)). Curve parameter arrays are (..., n_channels).
+#
+# The curve service evaluates each channel once on a dense spend grid per
+# (model, channel, date window) and keeps the arrays in an LRU cache. The
+# allocator's search and the allocation charts interpolate those same arrays.
+GRID_POINTS = 1024
+# The grid reaches past the widest unbounded constraint (upper 3.0 -> 7x the window's spend)
+GRID_SPEND_MULT = 8
+CACHE_SIZE = 512
+EXPORT_FILES = ("pareto_aggregated.csv", "pareto_hyperparameters.csv")
+
+
+def _export_key(run_dir):
+    # Cache key of a run's exports: path plus the mtimes of the files the curves come from
+    paths = [os.path.join(run_dir, f) for f in EXPORT_FILES]
+    if not all(os.path.exists(path) for path in paths):
+        raise FileNotFoundError(f"Run '{run_dir}' has no fitted model exports")
+    return os.path.abspath(run_dir), tuple(os.stat(path).st_mtime_ns for path in paths)
+
+
+@lru_cache(maxsize=16)
+def _load_exports(run_dir, mtimes):
+    aggregated_path, hyper_path = (os.path.join(run_dir, f) for f in EXPORT_FILES)
+    return pd.read_csv(aggregated_path), pd.read_csv(hyper_path).set_index("solID")
+
+
+def load_model_exports(run_dir):
+    """The run's pareto_aggregated and pareto_hyperparameters tables; shared, don't mutate them."""
+    return _load_exports(*_export_key(run_dir))
+
+
+def model_curves(decomp, hyper, sol_id):
+    """Coefficients and Hill/adstock parameters of every paid media channel of one model."""
+    decomp = decomp[(decomp["solID"] == sol_id) & decomp["inflexion"].notna()].set_index("rn")
+    if sol_id not in hyper.index or decomp.empty:
+        raise KeyError(f"Model {sol_id} not found")
+    channels = list(decomp.index)
+    return {
+        "solID": sol_id,
+        "channels": channels,
+        "coef": decomp["coef"].to_numpy(dtype="float64"),
+        "inflexion": decomp["inflexion"].to_numpy(dtype="float64"),
+        "alpha": hyper.loc[sol_id, [f"{c}_alphas" for c in channels]].to_numpy(dtype="float64"),
+        "theta": hyper.loc[sol_id, [f"{c}_thetas" for c in channels]].to_numpy(dtype="float64"),
+    }
+
+
+def load_model_curves(run_dir, sol_id):
+    return model_curves(*load_model_exports(run_dir), sol_id)
+
+
+def load_raw_data(run_dir):
+    date_var = robyn_export.date_var(run_dir)
+    return robyn_export.raw_data(run_dir).sort_values(date_var), date_var
+
+
+def response(curves, spend):
+    """Daily response of each channel at daily spend `spend`."""
+    adstocked = transforms.steady_state_adstock(spend, curves["theta"])
+    return curves["coef"] * transforms.hill_saturation(adstocked[..., np.newaxis], curves["alpha"], curves["inflexion"])[..., 0]
+
+
+def marginal_response(curves, spend):
+    # Analytic derivative of `response` with respect to daily spend
+    adstocked = transforms.steady_state_adstock(spend, curves["theta"])
+    slope = transforms.hill_derivative(adstocked[..., np.newaxis], curves["alpha"], curves["inflexion"])[..., 0]
+    return curves["coef"] * slope / (1 - curves["theta"])
+
+
+def window_spend(raw, date_var, date_range=None):
+    # Rows in the date range, falling back to all data when the range is empty
+    window = raw
+    if date_range:
+        start, end = pd.to_datetime(date_range[0]), pd.to_datetime(date_range[-1])
+        window = raw[(raw[date_var] >= start) & (raw[date_var] <= end)]
+        if window.empty:
+            window = raw
+    return window
+
+
+def stack_curves(curves_list):
+    """Stack several models' curves on a leading axis, aligned on the union of their channels.
+
+    A channel a model doesn't use gets a zero coefficient, so it never draws budget.
+    """
+    channels = sorted({c for curves in curves_list for c in curves["channels"]})
+    stacked = {"solID": [curves["solID"] for curves in curves_list], "channels": channels}
+    defaults = {"coef": 0.0, "inflexion": 1.0, "alpha": 1.0, "theta": 0.0}
+    for key, default in defaults.items():
+        values = np.full((len(curves_list), len(channels)), default)
+        for i, curves in enumerate(curves_list):
+            values[i, [channels.index(c) for c in curves["channels"]]] = curves[key]
+        stacked[key] = values
+    return stacked
+
+
+@lru_cache(maxsize=64)
+def _mean_spend(run_dir, date_range):
+    # Mean daily spend of every column in the window, and over all data for inactive channels
+    raw, date_var = load_raw_data(run_dir)
+    numeric = raw.select_dtypes("number").fillna(0)
+    window = numeric.loc[window_spend(raw, date_var, date_range).index]
+    return window.mean().where(window.mean() > 0, numeric.mean())
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _model_curves(run_dir, mtimes, sol_id):
+    return model_curves(*_load_exports(run_dir, mtimes), sol_id)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _channel_curve(run_dir, mtimes, sol_id, channel, date_range):
+    curves = _model_curves(run_dir, mtimes, sol_id)
+    i = curves["channels"].index(channel)
+    params = {key: curves[key][i] for key in ["coef", "inflexion", "alpha", "theta"]}
+    mean_spend = _mean_spend(run_dir, date_range).get(channel, 0) or 1.0
+    spend = np.linspace(0.0, GRID_SPEND_MULT * mean_spend, GRID_POINTS)
+    arrays = spend, response(params, spend), marginal_response(params, spend)
+    for array in arrays:
+        array.setflags(write=False)
+    return arrays
+
+
+def channel_curve(run_dir, sol_id, channel, date_range=None):
+    """Daily spend grid, response and marginal ROI of one channel, from the cache."""
+    spend, values, marginal = _channel_curve(*_export_key(run_dir), sol_id, channel,
+                                             tuple(date_range) if date_range else None)
+    return {"spend": spend, "response": values, "marginal": marginal}
+
+
+def curve_table(run_dir, sol_id, date_range=None):
+    """All paid media curves of one model as (channels, points) arrays, assembled from cached channels."""
+    key = _export_key(run_dir)
+    channels = _model_curves(*key, sol_id)["channels"]
+    window = tuple(date_range) if date_range else None
+    spend, values, marginal = (np.stack(arrays) for arrays in
+                               zip(*[_channel_curve(*key, sol_id, channel, window) for channel in channels]))
+    return {"solID": sol_id, "channels": channels, "spend": spend, "response": values, "marginal": marginal,
+            "step": spend[:, 1] - spend[:, 0]}
+
+
+def _interpolate(table, key, spend):
+    # Linear interpolation on each channel's uniform grid; (..., n_channels) in and out.
+    # Spend beyond the grid is clamped to its last point.
+    values = table[key]
+    n_channels, n_points = values.shape
+    position = np.clip(np.asarray(spend, dtype="float64") / table["step"], 0, n_points - 1)
+    low = np.minimum(position.astype(np.int64), n_points - 2)
+    flat = low + np.arange(n_channels) * n_points
+    frac = position - low
+    return values.ravel()[flat] * (1 - frac) + values.ravel()[flat + 1] * frac
+
+
+def table_response(table, spend):
+    return _interpolate(table, "response", spend)
+
+
+def table_marginal(table, spend):
+    return _interpolate(table, "marginal", spend)
+
+
+def curve_frame(table, max_spend=None, every=1):
+    """Tidy channel/spend/response/marginal_roi rows for charts.
+
+    Optionally cut at a per-channel spend and keep only every `every`-th grid point.
+    """
+    spend, values, marginal = (table[key][:, ::every] for key in ["spend", "response", "marginal"])
+    frame = pd.DataFrame({
+        "channel": np.repeat(table["channels"], spend.shape[1]),
+        "spend": spend.ravel(),
+        "response": values.ravel(),
+        "marginal_roi": marginal.ravel(),
+    })
+    if max_spend is not None:
+        frame = frame[frame["spend"] <= np.repeat(np.asarray(max_spend, dtype="float64"), spend.shape[1])]
+    return frame.reset_index(drop=True)
@@ -0,0 +1,109 @@
+import json
+import os
+from functools import lru_cache
+
+import pandas as pd
+
+import data_ingest
+import perf
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# Lazy reader for RobynModel-models.json. The export is ~900KB, almost all
+# of it Extras.raw_data, while most readers only want a few InputCollect or
+# ModelsCollect fields. Sections are parsed on first access and cached per
+# (file, mtime); with ijson installed only the bytes up to the requested
+# section are parsed, otherwise the stdlib decoder stops after it.
+EXPORT_FILE = "RobynModel-models.json"
+SECTIONS = ("InputCollect", "ModelsCollect", "Extras")
+
+
+def export_path(run_dir):
+    return os.path.join(run_dir, EXPORT_FILE)
+
+
+def _key(run_dir):
+    path = os.path.abspath(export_path(run_dir))
+    return path, os.stat(path).st_mtime_ns
+
+
+def _scan_section(path, name):
+    # Decode top-level values in order and stop at the requested one
+    with open(path) as json_file:
+        text = json_file.read()
+    decoder = json.JSONDecoder()
+    pos = text.index("{") + 1
+    while True:
+        pos = text.index('"', pos)
+        key, pos = decoder.raw_decode(text, pos)
+        pos = text.index(":", pos) + 1
+        while text[pos].isspace():
+            pos += 1
+        value, pos = decoder.raw_decode(text, pos)
+        if key == name:
+            return value
+        pos = text.find(",", pos)
+        if pos < 0:
+            raise KeyError(name)
+
+
+@lru_cache(maxsize=256)
+@perf.timed("read export json")
+def _section(path, mtime_ns, name):
+    if ijson is not None:
+        with open(path, "rb") as json_file:
+            for value in ijson.items(json_file, name, use_float=True):
+                return value
+        raise KeyError(name)
+    return _scan_section(path, name)
+
+
+def section(run_dir, name):
+    """One top-level section of a run's export, parsed on first use. Don't mutate the result."""
+    if name not in SECTIONS:
+        raise ValueError(f"Unknown export section: {name}")
+    return _section(*_key(run_dir), name)
+
+
+def input_collect(run_dir):
+    return section(run_dir, "InputCollect")
+
+
+def models_collect(run_dir):
+    return section(run_dir, "ModelsCollect")
+
+
+def scalar(value):
+    # R exports length-1 vectors as one-element lists
+    return value[0] if isinstance(value, list) and len(value) == 1 else value
+
+
+def date_var(run_dir):
+    return scalar(input_collect(run_dir)["date_var"])
+
+
+def _records(path):
+    if ijson is not None:
+        with open(path, "rb") as json_file:
+            yield from ijson.items(json_file, "Extras.raw_data.item", use_float=True)
+    else:
+        yield from _scan_section(path, "Extras")["raw_data"]
+
+
+@lru_cache(maxsize=32)
+def _raw_data(path, mtime_ns):
+    # Typed with the same column rules as uploads
+    frame = pd.DataFrame.from_records(list(_records(path)))
+    frame = frame.astype(data_ingest.column_dtypes(frame.columns))
+    for col in data_ingest.DATE_COLUMNS:
+        if col in frame:
+            frame[col] = data_ingest.parse_dates(frame[col])
+    return frame
+
+
+def raw_data(run_dir):
+    """Extras.raw_data as a typed DataFrame, cached per run; the frame is shared, don't mutate it."""
+    return _raw_data(*_key(run_dir))
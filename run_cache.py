@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from contextlib import closing
+
+import perf
+
+# Completed model runs indexed by a fingerprint of everything that determines
+# their result: the uploaded data, the saved hyperparameter ranges, the run
+# settings and the seed. Submitting the same run again returns the existing
+# run folder instead of fitting it again. Fits are seeded per batch, so the
+# number of worker processes is not part of the fingerprint. Entries not
+# reused for MAX_AGE_DAYS are forgotten; the run folders themselves stay in
+# the workspace, whose quota limits disk use.
+DB_PATH = os.environ.get("ROBYN_RUN_CACHE_DB", "./.robyn_cache/runs.sqlite")
+MAX_AGE_DAYS = float(os.environ.get("ROBYN_RUN_CACHE_DAYS", "30"))
+# Bump when the fitting code changes in a way that changes results
+FIT_VERSION = 2
+RUN_FILES = ["RobynModel-models.json", "pareto_hyperparameters.csv", "pareto_aggregated.csv"]
+
+
+def connect(db_path=DB_PATH):
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    if "size" in [row["name"] for row in conn.execute("PRAGMA table_info(runs)")]:
+        # Index of an older version, with a size-based policy; only the index is rebuilt, not the runs
+        conn.execute("DROP TABLE runs")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS runs (
+            fingerprint TEXT PRIMARY KEY,
+            run_dir TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            used_at REAL NOT NULL
+        )
+    """)
+    return conn
+
+
+def fingerprint(params):
+    """Hash of the model job parameters that determine the fitted result."""
+    key = {
+        "version": FIT_VERSION,
+        "digest": params["digest"],
+        "bounds": {channel: {name: [float(v) for v in values] for name, values in sorted(ranges.items())}
+                   for channel, ranges in sorted(params["bounds"].items())},
+        "iterations": int(params["iterations"]),
+        "trials": int(params["trials"]),
+        "ts_validation": bool(params.get("ts_validation", False)),
+        "seed": int(params.get("seed", 123)),
+        "country": params.get("country"),
+        # Runs are only shared inside one workspace
+        "output_root": os.path.abspath(params.get("output_root", "./mars-pne_uk")),
+    }
+    if key["ts_validation"]:
+        key["cv"] = [params.get("cv_scheme", "expanding"), params.get("cv_folds")]
+    if params.get("strategy", "random") != "random" or params.get("early_stop"):
+        key["search"] = [params.get("strategy", "random"), bool(params.get("early_stop"))]
+    if params.get("refresh"):
+        key["refresh"] = {name: params["refresh"][name] for name in ("base_run", "sol_id", "window_start")}
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def _complete(run_dir):
+    return all(os.path.exists(os.path.join(run_dir, name)) for name in RUN_FILES)
+
+
+def lookup(fp, db_path=DB_PATH):
+    """Run folder of a completed run with this fingerprint, or None."""
+    with closing(connect(db_path)) as conn:
+        row = conn.execute("SELECT run_dir FROM runs WHERE fingerprint = ?", (fp,)).fetchone()
+        if row is None:
+            return None
+        if not _complete(row["run_dir"]):
+            # The run folder was deleted or moved since it was recorded
+            conn.execute("DELETE FROM runs WHERE fingerprint = ?", (fp,))
+            return None
+        conn.execute("UPDATE runs SET used_at = ? WHERE fingerprint = ?", (time.time(), fp))
+        return row["run_dir"]
+
+
+def reusable_run(params, db_path=DB_PATH):
+    """Run folder of an identical completed run for these model job parameters, or None when the job has to fit."""
+    # Re-runs are asked for explicitly, and a cached folder has no profile of the run being profiled
+    if params.get("rerun") or params.get("profiler", perf.DEFAULT_PROFILER):
+        return None
+    return lookup(fingerprint(params), db_path)
+
+
+def store(fp, run_dir, db_path=DB_PATH):
+    now = time.time()
+    with closing(connect(db_path)) as conn:
+        conn.execute("INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?)", (fp, run_dir, now, now))
+    evict(db_path=db_path)
+
+
+def evict(max_age_days=MAX_AGE_DAYS, db_path=DB_PATH):
+    """Forget runs not reused for `max_age_days`, so they are fitted again when next submitted.
+
+    Only index entries are dropped; the run folders stay in the workspace.
+    """
+    with closing(connect(db_path)) as conn:
+        conn.execute("DELETE FROM runs WHERE used_at < ?", (time.time() - max_age_days * 86400,))
@@ -0,0 +1,183 @@
+import os
+import re
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+
+# Index of the run folders under an output root (./mars-pne_uk), so pages can
+# list runs, model one-pagers and exports without walking the filesystem on
+# every rerun. A folder is only rescanned when its mtime changes, which is
+# what adding, removing or renaming a file does. Allocator results are kept
+# per run, in <run>/allocations/<solID>/, because solIDs repeat across runs.
+CATALOG_PATH = os.environ.get("ROBYN_CATALOG_DB", "./.robyn_cache/catalog.sqlite")
+CHART_FILES = [
+    "hypersampling.png",
+    "pareto_front.png",
+    "prophet_decomp.png",
+    "ROAS_convergence1.png",
+    "ROAS_convergence2.png",
+    "ROAS_convergence3.png",
+]
+MODEL_ID = re.compile(r"^\d+_\d+_\d+$")
+ALLOCATIONS_DIR = "allocations"
+EXPORT_FILES = ["RobynModel-models.json", "pareto_hyperparameters.csv", "pareto_aggregated.csv",
+                "all_hyperparameters.csv", "all_aggregated.parquet"]
+
+
+def connect(db_path=CATALOG_PATH):
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS folders (
+            root TEXT NOT NULL,
+            name TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            run_at TEXT,
+            mtime REAL NOT NULL,
+            PRIMARY KEY (root, name)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS artifacts (
+            root TEXT NOT NULL,
+            folder TEXT NOT NULL,
+            file TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            model TEXT,
+            mtime REAL NOT NULL,
+            size INTEGER NOT NULL,
+            PRIMARY KEY (root, folder, file)
+        )
+    """)
+    return conn
+
+
+def allocation_dir(run_dir, model):
+    """Folder of the allocator results of model `model` of the run in `run_dir`."""
+    return os.path.join(run_dir, ALLOCATIONS_DIR, model)
+
+
+def folder_kind(name):
+    # Robyn_<YYYYmmddHHMM>_<tag> folders hold runs; <solID> folders are allocator results of older versions
+    if MODEL_ID.match(name):
+        return "allocation", None
+    try:
+        return "run", datetime.strptime(name.split("_")[1], "%Y%m%d%H%M").isoformat()
+    except (IndexError, ValueError):
+        return "other", None
+
+
+def artifact_kind(file):
+    stem, ext = os.path.splitext(file)
+    if file in CHART_FILES:
+        return "chart", None
+    if ext in (".png", ".jpg") and MODEL_ID.match(stem):
+        return "model", stem
+    if file.endswith("_reallocated.csv") or file == "allocation_params.json":
+        return "allocation", file.split("_max_response")[0] if "_max_response" in file else None
+    if file in EXPORT_FILES:
+        return "export", None
+    if ext in (".png", ".jpg"):
+        return "image", None
+    return "other", None
+
+
+def _scan_folder(conn, root, name, path):
+    rows = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_file():
+                stat = entry.stat()
+                kind, model = artifact_kind(entry.name)
+                rows.append((root, name, entry.name, kind, model, stat.st_mtime, stat.st_size))
+    conn.execute("DELETE FROM artifacts WHERE root = ? AND folder = ?", (root, name))
+    conn.executemany("INSERT INTO artifacts VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+
+def refresh(root, full=False, db_path=CATALOG_PATH):
+    """Bring the catalog of `root` up to date; returns the names of the folders that were rescanned.
+
+    Only folders whose mtime differs from the indexed one are listed again.
+    `full` rescans everything, for files rewritten in place.
+    """
+    root_key = os.path.abspath(root)
+    rescanned = []
+    with closing(connect(db_path)) as conn:
+        known = {row["name"]: row["mtime"] for row in
+                 conn.execute("SELECT name, mtime FROM folders WHERE root = ?", (root_key,))}
+        present = set()
+        if os.path.isdir(root):
+            with os.scandir(root) as entries:
+                folders = [(entry.name, entry.path, entry.stat().st_mtime) for entry in entries if entry.is_dir()]
+            runs = [(name, path) for name, path, _ in folders if folder_kind(name)[0] == "run"]
+            # Allocation folders of each run are indexed as "<run>/allocations/<solID>"
+            for run, path in runs:
+                allocations = os.path.join(path, ALLOCATIONS_DIR)
+                if os.path.isdir(allocations):
+                    with os.scandir(allocations) as entries:
+                        folders += [(f"{run}/{ALLOCATIONS_DIR}/{entry.name}", entry.path, entry.stat().st_mtime)
+                                    for entry in entries if entry.is_dir()]
+            conn.execute("BEGIN")
+            for name, path, mtime in folders:
+                if os.path.basename(name).startswith("."):
+                    # Staging folders of runs that are still being written
+                    continue
+                present.add(name)
+                if not full and known.get(name) == mtime:
+                    continue
+                kind, run_at = ("allocation", None) if f"/{ALLOCATIONS_DIR}/" in name else folder_kind(name)
+                conn.execute("INSERT OR REPLACE INTO folders VALUES (?, ?, ?, ?, ?)", (root_key, name, kind, run_at, mtime))
+                _scan_folder(conn, root_key, name, path)
+                rescanned.append(name)
+            conn.execute("COMMIT")
+        for name in set(known) - present:
+            conn.execute("DELETE FROM folders WHERE root = ? AND name = ?", (root_key, name))
+            conn.execute("DELETE FROM artifacts WHERE root = ? AND folder = ?", (root_key, name))
+    return rescanned
+
+
+def list_runs(root, db_path=CATALOG_PATH):
+    """Run folders of `root` as (name, run_at) pairs, latest first."""
+    with closing(connect(db_path)) as conn:
+        rows = conn.execute("SELECT name, run_at FROM folders WHERE root = ? AND kind = 'run' "
+                            "ORDER BY run_at DESC, name DESC", (os.path.abspath(root),)).fetchall()
+    return [(row["name"], datetime.fromisoformat(row["run_at"])) for row in rows]
+
+
+def artifacts(root, folder, kind=None, db_path=CATALOG_PATH):
+    """File names in one folder, oldest first, optionally only one artifact kind."""
+    query = "SELECT file FROM artifacts WHERE root = ? AND folder = ?"
+    args = [os.path.abspath(root), folder]
+    if kind:
+        query += " AND kind = ?"
+        args.append(kind)
+    with closing(connect(db_path)) as conn:
+        return [row["file"] for row in conn.execute(query + " ORDER BY mtime, file", args)]
+
+
+def model_ids(root, folder, db_path=CATALOG_PATH):
+    # Models with a one-pager image in the run folder, oldest first
+    with closing(connect(db_path)) as conn:
+        rows = conn.execute("SELECT model FROM artifacts WHERE root = ? AND folder = ? AND kind = 'model' "
+                            "ORDER BY mtime, file", (os.path.abspath(root), folder)).fetchall()
+    return [row["model"] for row in rows]
+
+
+def allocated_models(root, run, db_path=CATALOG_PATH):
+    """Models of run folder `run` the allocator was run for, most recent first."""
+    prefix = f"{run}/{ALLOCATIONS_DIR}/"
+    with closing(connect(db_path)) as conn:
+        rows = conn.execute("SELECT name FROM folders WHERE root = ? AND kind = 'allocation' AND substr(name, 1, ?) = ? "
+                            "ORDER BY mtime DESC", (os.path.abspath(root), len(prefix), prefix)).fetchall()
+    return [row["name"][len(prefix):] for row in rows]
+
+
+def allocation_results(root, run, model, db_path=CATALOG_PATH):
+    """Allocator result CSVs saved for a model of run folder `run`, newest first."""
+    folder = f"{run}/{ALLOCATIONS_DIR}/{model}"
+    with closing(connect(db_path)) as conn:
+        rows = conn.execute("SELECT file FROM artifacts WHERE root = ? AND folder = ? AND kind = 'allocation' "
+                            "AND file LIKE '%_reallocated.csv' ORDER BY mtime DESC", (os.path.abspath(root), folder)).fetchall()
+    return [os.path.join(allocation_dir(os.path.join(root, run), model), row["file"]) for row in rows]
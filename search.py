@@ -0,0 +1,164 @@
+import numpy as np
+from scipy.stats import qmc
+
+# Hyperparameter search strategies. A trial runs in generations: the strategy
+# proposes a batch of points in the unit cube (one axis per channel
+# hyperparameter plus lambda), the fitter maps them onto the saved ranges and
+# fits them, and the scores of the fitted candidates are told back, so
+# adaptive strategies sample where the good models are.
+#
+#   random   uniform samples, what the fitter always did
+#   lhs      Latin hypercube samples, an even spread of every dimension
+#   de       TwoPointsDE-style differential evolution
+#   cma      CMA-ES: a Gaussian adapted to the best candidates
+#   halving  successive halving: SCREEN_FACTOR^rungs candidates per slot are
+#            screened with cheap ridge fits of growing accuracy, only the
+#            survivors are fitted in full
+#
+# Trials also stop once the best score has not improved by TOLERANCE for
+# PATIENCE generations.
+MIN_GENERATIONS = 3
+PATIENCE = 5
+TOLERANCE = 0.002
+SCREEN_FACTOR = 2
+SCREEN_RUNGS = 2
+SCREEN_SWEEPS = 10
+DE_WEIGHT = 0.8
+
+
+def score(nrmse, decomp_rssd):
+    # Distance to the origin of the two objectives, the same trade-off Robyn uses to pick models
+    return np.sqrt(np.asarray(nrmse) ** 2 + np.asarray(decomp_rssd) ** 2)
+
+
+def _uniform(state, n, rng):
+    return rng.uniform(size=(n, state["dim"]))
+
+
+def _latin(state, n, rng):
+    return qmc.LatinHypercube(d=state["dim"], seed=rng).random(n)
+
+
+def _keep_best(state, points, scores):
+    # The population of adaptive strategies: the best points seen so far
+    if "population" in state:
+        points = np.vstack([state["population"], points])
+        scores = np.concatenate([state["scores"], scores])
+    best = np.argsort(scores, kind="stable")[:state["size"]]
+    state["population"], state["scores"] = points[best], scores[best]
+
+
+def _de_ask(state, n, rng):
+    if "population" not in state or len(state["population"]) < 4:
+        return _latin(state, n, rng)
+    population = state["population"]
+    parents = population[rng.integers(len(population), size=n)]
+    a, b, c = (population[rng.integers(len(population), size=n)] for _ in range(3))
+    mutants = a + DE_WEIGHT * (b - c)
+    # Two-point crossover: a contiguous block of dimensions comes from the mutant
+    cuts = np.sort(rng.integers(state["dim"] + 1, size=(n, 2)), axis=1)
+    dims = np.arange(state["dim"])
+    block = (dims >= cuts[:, :1]) & (dims < cuts[:, 1:])
+    return np.clip(np.where(block, mutants, parents), 0.0, 1.0)
+
+
+def _cma_start(state):
+    dim = state["dim"]
+    mu = state["size"] // 2
+    weights = np.log(mu + 0.5) - np.log(np.arange(1, mu + 1))
+    weights /= weights.sum()
+    mu_eff = 1 / (weights ** 2).sum()
+    state.update({
+        "mean": np.full(dim, 0.5), "sigma": 0.3, "cov": np.eye(dim),
+        "path_c": np.zeros(dim), "path_s": np.zeros(dim), "weights": weights, "mu_eff": mu_eff,
+        "c_s": (mu_eff + 2) / (dim + mu_eff + 5),
+        "c_c": (4 + mu_eff / dim) / (dim + 4 + 2 * mu_eff / dim),
+        "c_1": 2 / ((dim + 1.3) ** 2 + mu_eff),
+        "chi": np.sqrt(dim) * (1 - 1 / (4 * dim) + 1 / (21 * dim ** 2)),
+    })
+    state["c_mu"] = min(1 - state["c_1"], 2 * (mu_eff - 2 + 1 / mu_eff) / ((dim + 2) ** 2 + mu_eff))
+    state["damps"] = 1 + 2 * max(0, np.sqrt((mu_eff - 1) / (dim + 1)) - 1) + state["c_s"]
+
+
+def _cma_ask(state, n, rng):
+    if "mean" not in state:
+        _cma_start(state)
+    eigenvalues, eigenvectors = np.linalg.eigh(state["cov"])
+    state["sqrt_cov"] = eigenvectors * np.sqrt(np.maximum(eigenvalues, 1e-20))
+    state["inv_sqrt_cov"] = eigenvectors / np.sqrt(np.maximum(eigenvalues, 1e-20)) @ eigenvectors.T
+    steps = rng.standard_normal((n, state["dim"])) @ state["sqrt_cov"].T
+    return np.clip(state["mean"] + state["sigma"] * steps, 0.0, 1.0)
+
+
+def _cma_tell(state, points, scores):
+    _keep_best(state, points, scores)
+    weights = state["weights"][:min(len(state["weights"]), len(points))]
+    weights = weights / weights.sum()
+    best = points[np.argsort(scores, kind="stable")[:len(weights)]]
+    old_mean, sigma = state["mean"], state["sigma"]
+    state["mean"] = weights @ best
+    shift = (state["mean"] - old_mean) / sigma
+    c_s, c_c, mu_eff = state["c_s"], state["c_c"], state["mu_eff"]
+    state["path_s"] = (1 - c_s) * state["path_s"] + np.sqrt(c_s * (2 - c_s) * mu_eff) * state["inv_sqrt_cov"] @ shift
+    state["path_c"] = (1 - c_c) * state["path_c"] + np.sqrt(c_c * (2 - c_c) * mu_eff) * shift
+    steps = (best - old_mean) / sigma
+    state["cov"] = ((1 - state["c_1"] - state["c_mu"]) * state["cov"]
+                    + state["c_1"] * np.outer(state["path_c"], state["path_c"])
+                    + state["c_mu"] * (weights[:, np.newaxis] * steps).T @ steps)
+    state["sigma"] = sigma * np.exp(c_s / state["damps"] * (np.linalg.norm(state["path_s"]) / state["chi"] - 1))
+
+
+def _no_tell(state, points, scores):
+    pass
+
+
+STRATEGIES = {
+    "random": {"ask": _uniform, "tell": _no_tell, "screen": 0},
+    "lhs": {"ask": _latin, "tell": _no_tell, "screen": 0},
+    "de": {"ask": _de_ask, "tell": _keep_best, "screen": 0},
+    "cma": {"ask": _cma_ask, "tell": _cma_tell, "screen": 0},
+    "halving": {"ask": _latin, "tell": _no_tell, "screen": SCREEN_RUNGS},
+}
+
+
+def start(strategy, dim, size):
+    """Search state of one trial over a `dim`-dimensional unit cube; `size` is the generation size."""
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown search strategy: {strategy}")
+    return {"strategy": strategy, "dim": dim, "size": size, "best": []}
+
+
+def ask(state, n, rng):
+    return STRATEGIES[state["strategy"]]["ask"](state, n, rng)
+
+
+def tell(state, points, scores):
+    state["best"].append(min(float(np.min(scores)), state["best"][-1]) if state["best"] else float(np.min(scores)))
+    STRATEGIES[state["strategy"]]["tell"](state, points, scores)
+
+
+def converged(state, patience=PATIENCE, tolerance=TOLERANCE, min_generations=MIN_GENERATIONS):
+    """True once the best score has improved by less than `tolerance` (relative) over the last `patience` generations."""
+    best = state["best"]
+    if len(best) < max(min_generations, patience + 1):
+        return False
+    return best[-patience - 1] - best[-1] <= tolerance * abs(best[-patience - 1])
+
+
+def conv_msg(history):
+    """Robyn-style convergence messages from the candidate table of a run, by generation (iterNG).
+
+    An objective has converged when the spread and the median of its last
+    generation are no larger than in the first one.
+    """
+    messages = []
+    for column, label in (("nrmse", "NRMSE"), ("decomp.rssd", "DECOMP.RSSD")):
+        by_generation = history.groupby("iterNG")[column]
+        first_sd, last_sd = by_generation.std().iloc[[0, -1]]
+        first_med, last_med = by_generation.median().iloc[[0, -1]]
+        last = history["iterNG"].max()
+        ok = last_sd <= first_sd and last_med <= first_med
+        messages.append(f"{label} {'converged' if ok else 'NOT converged'}: "
+                        f"sd@gen{last} {last_sd:.3f} {'<=' if last_sd <= first_sd else '>'} {first_sd:.3f} & "
+                        f"|med@gen{last}| {last_med:.2f} {'<=' if last_med <= first_med else '>'} {first_med:.2f}")
+    return messages
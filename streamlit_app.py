@@ -2,9 +2,30 @@ import streamlit as st
 import numpy as np
 import pandas as pd
 import csv
+import os
+import time
+import batch_run
+import collinearity
+import data_ingest
+import data_schema
+import features
+import job_runner
 import model_display
+import model_fit
+import model_refresh
+import parallel_run
+import perf
+import run_cache
+import search
+import transforms
+import time_series_cv
+import workspace
 
 
+# Stage timings of this session's page reruns, shown in the Performance panel
+perf.activate(st.session_state.setdefault('perf', perf.new_recorder()))
+page_started = time.perf_counter()
+
 # Customer Selection Dropdown
 if 'cust' not in st.session_state:
     st.session_state['cust'] = ''
@@ -33,16 +54,24 @@ if st.session_state['page'] == 'upload_page':
 
     if uploaded_file:
         try:
-            # Load the uploaded file
-            if uploaded_file.name.endswith('.csv'):
-                robyn_df = pd.read_csv(uploaded_file)
-            elif uploaded_file.name.endswith('.xlsx'):
-                robyn_df = pd.read_excel(uploaded_file)
+            # Load the uploaded file, parsing it only the first time it is seen
+            upload_key = (uploaded_file.name, uploaded_file.size, getattr(uploaded_file, 'file_id', None))
+            if st.session_state.get('upload_key') != upload_key:
+                # Derived context variables (ratios, lags, calendar, events) are added once per upload
+                raw_digest = data_ingest.ingest_upload(uploaded_file.name, uploaded_file.getvalue())
+                st.session_state['raw_digest'] = raw_digest
+                st.session_state['upload_digest'] = features.with_features(raw_digest)
+                st.session_state['calendar_warnings'] = features.calendar_gaps(data_ingest.load_frame(raw_digest))
+                st.session_state['upload_key'] = upload_key
+            robyn_df = data_ingest.load_frame(st.session_state['upload_digest'])
+            # Countries the event calendars do not cover get no (or only generic) sale days
+            for message in st.session_state.get('calendar_warnings', []):
+                st.warning(message)
 
             # Display required fields and descriptions
             st.header("Required Fields and Field Descriptions")
             st.markdown("""
-            - **Date Field**: `event_date_utc`  
+            - **Date Field**: `date`  
               Format: YYYY-MM-DD. This field must be present and in a date format. It’s the timestamp for each record.
             - **Spend Fields** (must be numerical values):
               - `dsp_cost` (DSP)
@@ -62,54 +91,68 @@ if st.session_state['page'] == 'upload_page':
                 country_filtered = 'Not specified'
                 st.warning("Country column not found in the dataset.")
 
-            # Field Mapping and Manual Overrides
+            # Field Mapping: upload columns to use for the required columns the upload names differently.
+            # The mapped upload replaces the original, so validation, features and runs all see the schema names.
             st.subheader("Field Mapping and Manual Overrides")
-            with st.form("field_mapping"):
-                col1, col2 = st.columns(2)
-                event_date_col = col1.selectbox("Map event_date_utc", robyn_df.columns, key='event_date')
-                dsp_recruit_col = col2.selectbox("Map dsp_recruit_cost", robyn_df.columns, key='dsp_recruit')
-                submit_button = st.form_submit_button(label="Submit Field Mapping")
+            raw_df = data_ingest.load_frame(st.session_state['raw_digest'])
+            unmapped = [col for col in data_schema.REQUIRED_COLUMNS if col not in raw_df.columns]
+            if not unmapped:
+                st.caption("Every required column is present in the upload.")
+            else:
+                extra = [col for col in raw_df.columns if col not in data_schema.REQUIRED_COLUMNS]
+                with st.form("field_mapping"):
+                    columns = st.columns(2)
+                    mapping = {col: columns[i % 2].selectbox(f"Map {col}", [None] + extra, key=f"map_{col}")
+                               for i, col in enumerate(unmapped)}
+                    submit_button = st.form_submit_button(label="Submit Field Mapping")
+                if submit_button:
+                    try:
+                        mapped = data_ingest.map_columns(raw_df, {col: source for col, source in mapping.items() if source})
+                    except ValueError as e:
+                        st.error(f"Field mapping not applied: {e}")
+                    else:
+                        raw_digest = data_ingest.ingest_frame(mapped)
+                        st.session_state['raw_digest'] = raw_digest
+                        st.session_state['upload_digest'] = features.with_features(raw_digest)
+                        st.session_state['calendar_warnings'] = features.calendar_gaps(mapped)
+                        st.rerun()
 
             # Validation Button
             st.subheader("Submission Button")
             if st.button("Validate Data"):
-                required_columns = [
-                    'dsp_recruit_cost',
-                    'dsp_conversion_cost',
-                    'dsp_awareness_cost',
-                    'sd_recruit_cost',
-                    'sp_auto_cost',
-                    'sb_defend_cost',
-                    'sp_recruit_cost',
-                    'sp_attack_cost',
-                    'sp_defend_cost',
-                    'sb_recruit_cost',
-                    'sd_defend_cost',
-                    'sb_attack_cost',
-                    'sd_attack_cost',
-                    'dsp_recruit_impressions',
-                    'dsp_conversion_impressions',
-                    'dsp_awareness_impressions',
-                    'sd_recruit_impressions',
-                    'sp_auto_clicks',
-                    'sb_defend_clicks',
-                    'sp_recruit_clicks',
-                    'sp_attack_clicks',
-                    'sp_defend_clicks',
-                    'sb_recruit_clicks',
-                    'sd_defend_clicks',
-                    'sb_attack_clicks',
-                    'sd_attack_clicks',
-                    'total_product_sales',
-                    'country',
-                    'date'
-                ]
-                missing_columns = [col for col in required_columns if col not in robyn_df.columns]
-
-                if missing_columns:
-                    st.error(f"Missing required columns: {', '.join(missing_columns)}")
-                else:
-                    st.success("All required columns are present.")
+                report = data_schema.validate(robyn_df)
+                st.session_state['validation_report'] = report
+
+                if report['missing_columns']:
+                    st.error(f"Missing required columns: {', '.join(report['missing_columns'])}")
+                for issue in report['issues']:
+                    if issue['rule'] == 'missing_column':
+                        continue
+                    message = f"{issue['column']}: {issue['detail']} ({issue['count']} rows)"
+                    if issue['severity'] == 'error':
+                        st.error(message)
+                    else:
+                        st.warning(message)
+                if report['ok']:
+                    st.success("All required columns are present and pass validation.")
+                st.dataframe(report['summary'])
+
+            # Multicollinearity of the regressors of the selected country, before any compute is spent on them
+            st.subheader("Multicollinearity Diagnostics")
+            diagnostics = collinearity.diagnose(robyn_df, None if country_filtered == 'Not specified' else country_filtered)
+            flagged = diagnostics['vif'][diagnostics['vif']['flagged']]
+            if not flagged.empty:
+                st.warning(f"VIF of {collinearity.VIF_THRESHOLD:g} or more: " +
+                           ", ".join(f"{col} ({value:.1f})" for col, value in flagged['vif'].items()))
+            if not diagnostics['pairs'].empty:
+                st.warning(f"{len(diagnostics['pairs'])} column pair(s) with |correlation| of "
+                           f"{collinearity.CORR_THRESHOLD:g} or more")
+            if diagnostics['constant']:
+                st.info(f"Columns without variation, left out: {', '.join(diagnostics['constant'])}")
+            with st.expander("VIFs and correlations"):
+                st.dataframe(diagnostics['vif'])
+                st.dataframe(diagnostics['pairs'])
+                st.dataframe(diagnostics['correlation'].round(2))
 
             # Proceed to Hyperparameter Adjustment Page
             if st.button("Proceed to Hyperparameter Adjustment"):
@@ -195,16 +238,29 @@ elif st.session_state['page'] == 'hyperparameter_adjustment':
         }
     }
 
-    # Function to calculate Adstock Curve
-    def calculate_adstock_curve(alpha, scale, length=30):
-        adstock_curve = [scale * (alpha ** i) for i in range(length)]
-        return adstock_curve
-
-    # Function to calculate Response Curve
-    def calculate_response_curve(gamma, scale, length=30):
-        x = np.arange(length)
-        response_curve = scale * (1 - np.exp(-gamma * x))
-        return response_curve
+    # Spend series of the uploaded data, used to draw the previews on the real spend range
+    preview_df = None
+    if 'upload_digest' in st.session_state:
+        try:
+            preview_df = data_ingest.load_frame(st.session_state['upload_digest'])
+            if 'country' in preview_df.columns and st.session_state.get('country_filtered') in set(preview_df['country']):
+                preview_df = preview_df[preview_df['country'] == st.session_state['country_filtered']]
+        except FileNotFoundError:
+            preview_df = None
+
+    # Function to calculate Adstock Curve (geometric decay of a single day of spend)
+    def calculate_adstock_curve(theta, length=30):
+        return transforms.adstock_decay_curve(theta, length)
+
+    # Function to calculate Response Curve (Hill saturation of the adstocked spend)
+    def calculate_response_curve(ad_type, theta, alpha, gamma, length=30):
+        spend_col = f"{ad_type}_cost"
+        if preview_df is not None and spend_col in preview_df.columns:
+            spend = preview_df[spend_col].fillna(0).to_numpy(dtype="float64")
+        else:
+            spend = np.linspace(0, 1, length)
+        grid, response_curve = transforms.response_curve(spend, theta, alpha, gamma, n_points=length)
+        return pd.Series(response_curve, index=np.round(grid, 2))
 
     # Function to display hyperparameter adjustment for each channel
     def hyperparameter_adjustment(ad_type, params):
@@ -212,24 +268,25 @@ elif st.session_state['page'] == 'hyperparameter_adjustment':
         col1, col2, col3 = st.columns([1, 1, 1])
 
         with col1:
-            alpha_range = st.slider(f"{ad_type} Alpha Range (Decay Rate):", 0.1, 3.0, tuple(params["alphas"]), key=f"{ad_type}_alpha_range", help="Alpha controls how quickly the effect of media spend decays over time.")
-            gamma_range = st.slider(f"{ad_type} Gamma Range (Saturation):", 0.0, 1.0, tuple(params["gammas"]), key=f"{ad_type}_gamma_range", help="Gamma controls the level of saturation in the media response curve.")
-            theta_range = st.slider(f"{ad_type} Theta Range:", 0.0, 1.0, tuple(params["thetas"]), key=f"{ad_type}_theta_range", help="Theta modifies the overall strength of the adstock effect.")
+            alpha_range = st.slider(f"{ad_type} Alpha Range (Hill Shape):", 0.1, 3.0, tuple(params["alphas"]), key=f"{ad_type}_alpha_range", help="Alpha controls the shape of the saturation curve: higher values give a more S-shaped response.")
+            gamma_range = st.slider(f"{ad_type} Gamma Range (Saturation):", 0.0, 1.0, tuple(params["gammas"]), key=f"{ad_type}_gamma_range", help="Gamma controls where the media response curve reaches its inflexion point.")
+            theta_range = st.slider(f"{ad_type} Theta Range (Decay Rate):", 0.0, 1.0, tuple(params["thetas"]), key=f"{ad_type}_theta_range", help="Theta is the share of the adstock effect carried over to the next day.")
+
+        alpha_default = (alpha_range[0] + alpha_range[1]) / 2
+        gamma_default = (gamma_range[0] + gamma_range[1]) / 2
+        theta_default = (theta_range[0] + theta_range[1]) / 2
 
         with col2:
             # Display Adstock Curve
-            alpha_default = (alpha_range[0] + alpha_range[1]) / 2
-            scale_default = (theta_range[0] + theta_range[1]) / 2
-            adstock_data = calculate_adstock_curve(alpha_default, scale_default)
+            adstock_data = calculate_adstock_curve(theta_default)
             st.subheader("Adstock Curve")
             st.line_chart(pd.DataFrame(adstock_data, columns=["Adstock Effect"]))
 
         with col3:
             # Display Response Curve
-            gamma_default = (gamma_range[0] + gamma_range[1]) / 2
-            response_data = calculate_response_curve(gamma_default, scale_default)
+            response_data = calculate_response_curve(ad_type, theta_default, alpha_default, gamma_default)
             st.subheader("Response Curve")
-            st.line_chart(pd.DataFrame(response_data, columns=["Media Response"]))
+            st.line_chart(pd.DataFrame({"Media Response": response_data}))
 
         # Save hyperparameters
         hyperparameters[ad_type] = {
@@ -253,6 +310,19 @@ elif st.session_state['page'] == 'hyperparameter_adjustment':
     trials = st.slider("Trials:", 5, 30, 10, help="Number of trials for the hyperparameter tuning.")
     country_filtered = st.session_state['country_filtered']
     ts_validation = st.checkbox("Time Series Validation", value=False, help="Check if you want to use time series validation.")
+    cv_scheme, cv_folds = "expanding", time_series_cv.FOLDS
+    if ts_validation:
+        col1, col2 = st.columns(2)
+        with col1:
+            cv_scheme = st.selectbox("Validation scheme:", time_series_cv.SCHEMES, help="Expanding folds train on all earlier days, rolling folds on a fixed-length window before each validation block.")
+        with col2:
+            cv_folds = st.number_input("Validation folds:", min_value=1, max_value=10, value=time_series_cv.FOLDS, help="Number of consecutive validation blocks; the last days are held out as the test set.")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        search_strategy = st.selectbox("Search strategy:", list(search.STRATEGIES), help="random and lhs sample the ranges evenly; de (differential evolution) and cma (CMA-ES) move towards the best models found so far; halving screens extra candidates with quick fits and fully fits only the best.")
+    with col2:
+        early_stop = st.checkbox("Stop trials early on convergence", value=search_strategy != "random", help="Ends a trial when its best model has not improved for a few generations of candidates.")
 
     # Navigation Buttons
     if st.button("Back"):
@@ -265,6 +335,11 @@ elif st.session_state['page'] == 'hyperparameter_adjustment':
 
     # Save Hyperparameters Button
     if st.button("Save Hyperparameters"):
+        try:
+            workspace.tenant_dir(st.session_state['cust'], country_filtered)
+        except ValueError as e:
+            st.error(str(e))
+            st.stop()
         # Store hyperparameters and model configuration for future use
         st.session_state['hyperparameters'] = hyperparameters
         st.session_state['iterations'] = iterations
@@ -272,8 +347,9 @@ elif st.session_state['page'] == 'hyperparameter_adjustment':
         st.session_state['country_filtered'] = country_filtered
         st.session_state['cust'] = st.session_state['cust']
 
-        # Store hyperparameters, iterations, and trials to a CSV file
-        with open("/workspaces/Robyn/hyperparameter_config.csv", "w", newline='') as csvfile:
+        # Store hyperparameters, iterations, and trials to a CSV file in the customer/country workspace
+        with workspace.atomic_open(workspace.config_path(st.session_state['cust'], country_filtered, "hyperparameter_config.csv"),
+                                   "w", newline='') as csvfile:
             csvwriter = csv.writer(csvfile)
             csvwriter.writerow(["Variable Name", "Min Value", "Max Value"])
             for ad_type, params in hyperparameters.items():
@@ -282,12 +358,17 @@ elif st.session_state['page'] == 'hyperparameter_adjustment':
         st.success("Hyperparameters saved successfully as CSV.")
 
         # Save Iterations, Trials, Country, and Customer to a CSV file
-        with open("/workspaces/Robyn/model_params.csv", "w", newline='') as csvfile:
+        with workspace.atomic_open(workspace.config_path(st.session_state['cust'], country_filtered, "model_params.csv"),
+                                   "w", newline='') as csvfile:
             csvwriter = csv.writer(csvfile)
             csvwriter.writerow(["parameter", "Value"])
             csvwriter.writerow(["iterations", iterations])
             csvwriter.writerow(["trials", trials])
             csvwriter.writerow(["ts_validation", ts_validation])
+            csvwriter.writerow(["cv_scheme", cv_scheme])
+            csvwriter.writerow(["cv_folds", cv_folds])
+            csvwriter.writerow(["search_strategy", search_strategy])
+            csvwriter.writerow(["early_stop", early_stop])
             csvwriter.writerow(["country", country_filtered])
             csvwriter.writerow(["cust", st.session_state['cust']])
 
@@ -295,10 +376,156 @@ elif st.session_state['page'] == 'model_run':
     # Model Run Page
     
     st.title("MetaRobynMMM - Model Run")
-    
+
+    # Fit the model in Python from the uploaded data and the saved hyperparameter ranges
+    can_run = False
+    try:
+        # Settings and runs live in the workspace of the selected customer and country
+        hyperparameter_path = workspace.config_path(st.session_state['cust'], st.session_state.get('country_filtered'), "hyperparameter_config.csv")
+        model_params_path = workspace.config_path(st.session_state['cust'], st.session_state.get('country_filtered'), "model_params.csv")
+    except ValueError:
+        hyperparameter_path = model_params_path = None
+    if 'upload_digest' not in st.session_state:
+        st.info("Upload a dataset to run the model from this page.")
+    elif hyperparameter_path is None:
+        st.info("Select a customer and a country before running the model.")
+    elif not (os.path.exists(hyperparameter_path) and os.path.exists(model_params_path)):
+        st.info("Save the hyperparameters before running the model.")
+    else:
+        can_run = True
+        model_params = model_fit.load_model_params(model_params_path)
+        # Sequential searches fit each trial in one process, so extra workers beyond the trials would sit idle
+        max_workers = min(parallel_run.default_workers(),
+                          model_fit.max_workers(model_params['iterations'], model_params['trials'],
+                                                model_params['search_strategy'], model_params['early_stop']))
+        workers = st.number_input("Worker processes", min_value=1, max_value=max_workers, value=max_workers,
+                                  help="Number of CPU cores used to fit candidates in parallel.")
+        if max_workers < parallel_run.default_workers() and model_fit.sequential_trials(model_params['search_strategy'], model_params['early_stop']):
+            st.caption(f"This search fits each trial in one process, so at most {max_workers} workers are used.")
+
+        rerun = st.checkbox("Re-run even if an identical run exists", value=False,
+                            help="By default a run with the same data, hyperparameters and settings is reused.")
+        profiler = st.selectbox("Profiler", ["none"] + perf.available_profilers(),
+                                help="Writes a profile of the whole run to its folder, next to its stage timings.")
+        profiler = None if profiler == "none" else profiler
+
+        # New days since an earlier run: offer a refresh that starts from that run's selected model
+        runs_root = workspace.runs_dir(st.session_state['cust'], st.session_state['country_filtered'])
+        refresh_plan = model_refresh.plan_refresh(runs_root, data_ingest.load_frame(st.session_state['upload_digest']),
+                                                  model_fit.load_hyperparameter_bounds(hyperparameter_path),
+                                                  model_params['iterations'], model_params['country'])
+        refresh = False
+        if refresh_plan:
+            refresh = st.checkbox(
+                f"Refresh {refresh_plan['base_run']} (model {refresh_plan['sol_id']}) with the data added from {refresh_plan['added_start']}",
+                value=True, help="Refits only the rolling window ending on the last day, searching narrowed ranges "
+                                 "around the selected model's hyperparameters with fewer iterations.")
+            if refresh:
+                st.caption(f"Window {refresh_plan['window_start']} to {refresh_plan['window_end']}, "
+                           f"{refresh_plan['iterations']} iterations x {model_params['trials']} trials.")
+
+    if can_run and st.button("Run Model"):
+        # Runs in a background worker process, so reruns of this page don't interrupt it
+        model_params = model_fit.load_model_params(model_params_path)
+        job_params = {
+            "digest": st.session_state['upload_digest'],
+            "bounds": model_fit.load_hyperparameter_bounds(hyperparameter_path),
+            "iterations": model_params['iterations'],
+            "trials": model_params['trials'],
+            "ts_validation": model_params['ts_validation'],
+            "cv_scheme": model_params['cv_scheme'],
+            "cv_folds": model_params['cv_folds'],
+            "strategy": model_params['search_strategy'],
+            "early_stop": model_params['early_stop'],
+            "country": model_params['country'],
+            "output_root": workspace.runs_dir(st.session_state['cust'], st.session_state['country_filtered']),
+            "workers": workers,
+            "rerun": rerun,
+            "profiler": profiler,
+        }
+        if refresh:
+            job_params.update({
+                "bounds": refresh_plan['bounds'],
+                "iterations": refresh_plan['iterations'],
+                "refresh": {key: refresh_plan[key] for key in ("base_run", "sol_id", "window_start", "added_start")},
+            })
+        # Profiled runs always fit, since a reused run has no profile
+        cached_run = run_cache.reusable_run(job_params)
+        if cached_run:
+            st.success(f"An identical run already exists: results in {cached_run}")
+        else:
+            try:
+                workspace.check_quota(st.session_state['cust'], st.session_state['country_filtered'])
+                job_id = job_runner.submit("model", job_params, owner=st.session_state['cust'])
+                st.success(f"Model run queued as job {job_id}.")
+            except workspace.QuotaExceeded as e:
+                st.error(str(e))
+
+    # Batch mode: one run per country of the upload, with the same settings
+    if can_run:
+        upload_df = data_ingest.load_frame(st.session_state['upload_digest'])
+        countries = upload_df['country'].nunique() if 'country' in upload_df.columns else 0
+        if countries > 1 and st.button(f"Run All {countries} Countries"):
+            model_params = model_fit.load_model_params(model_params_path)
+            st.session_state['batch'] = batch_run.submit_batch(upload_df, st.session_state['cust'], {
+                "bounds": model_fit.load_hyperparameter_bounds(hyperparameter_path),
+                "iterations": model_params['iterations'],
+                "trials": model_params['trials'],
+                "ts_validation": model_params['ts_validation'],
+                "cv_scheme": model_params['cv_scheme'],
+                "cv_folds": model_params['cv_folds'],
+                "strategy": model_params['search_strategy'],
+                "early_stop": model_params['early_stop'],
+                "rerun": rerun,
+                "profiler": profiler,
+            }, workers)
+            st.success(f"Queued model runs for {countries} countries.")
+    if st.session_state.get('batch'):
+        st.subheader("Cross-Country Comparison")
+        st.dataframe(batch_run.comparison(st.session_state['batch']))
+
+    # Background jobs of the current customer
+    jobs = job_runner.list_jobs(owner=st.session_state['cust'])
+    if jobs:
+        st.subheader("Model Runs")
+        # Any button click reruns the page, which re-reads the job table
+        st.button("Refresh Status")
+        for job in jobs:
+            label = f"{job['kind']} job {job['id']} - {job['status']}"
+            if job['status'] in ('queued', 'running'):
+                eta = f", about {job['eta_s'] / 60:.1f} min left" if job['eta_s'] else ""
+                st.progress(job['progress'], text=f"{label}{eta}")
+                if st.button("Cancel", key=f"cancel_{job['id']}"):
+                    job_runner.cancel(job['id'])
+            elif job['status'] == 'done':
+                st.write(f"{label}: results in {job['result']}")
+            elif job['status'] == 'failed':
+                st.error(f"{label}: {(job['error'] or '').splitlines()[0] if job['error'] else ''}")
+            else:
+                st.write(label)
+
+    # Time a short run on increasing worker counts to see how the fit scales on this machine
+    if can_run and st.button("Measure Worker Scaling"):
+        model_params = model_fit.load_model_params(model_params_path)
+        bounds = model_fit.load_hyperparameter_bounds(hyperparameter_path)
+        frame = data_ingest.load_frame(st.session_state['upload_digest'])
+        channels = [channel for channel in data_schema.CHANNELS if channel in bounds and f"{channel}_cost" in frame.columns]
+        inputs = model_fit.prepare_inputs(frame, channels, model_params['country'])
+        worker_counts = sorted({1, 2, 4, workers} & set(range(1, parallel_run.default_workers() + 1)))
+        st.dataframe(model_fit.worker_scaling(inputs, bounds, 500, 2, worker_counts))
+
     model_display.run_model_display()  # Call the function from model_display.py
 
     # Navigation Buttons
     if st.button("Back"):
         st.session_state['page'] = 'hyperparameter_adjustment'
-        st.experimental_set_query_params(page=st.session_state['page'])
\ No newline at end of file
+        st.experimental_set_query_params(page=st.session_state['page'])
+
+# Where the time of this session went: every stage timed since it started, and the reruns of the pages
+perf.record("page rerun", time.perf_counter() - page_started)
+perf.count(f"reruns of {st.session_state['page']}")
+with st.expander("Performance"):
+    session = perf.summary(st.session_state['perf'])
+    st.caption(f"Session {session['wall_s'] / 60:.1f} min · memory high-water mark {session['peak_rss_mb']:.0f} MB")
+    st.dataframe(perf.stage_frame(session['stages']))
+    st.dataframe(pd.Series(session['counters'], name="count"))
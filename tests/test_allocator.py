@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+from scipy.optimize import minimize
+
+import allocator
+import response_curves
+
+
+def _curves(rng, n_channels, alpha_range):
+    return {
+        "coef": rng.uniform(1e3, 1e5, n_channels),
+        "inflexion": rng.uniform(1e3, 1e4, n_channels),
+        "alpha": rng.uniform(*alpha_range, n_channels),
+        "theta": rng.uniform(0, 0.5, n_channels),
+    }
+
+
+def _bounds(rng, n_channels):
+    spend = rng.uniform(500, 5000, n_channels)
+    return spend, 0.5 * spend, 2.5 * spend
+
+
+def _reference_optimum(curves, lower, upper, budget, starts):
+    # Best SLSQP solution over several feasible starting points
+    best = -np.inf
+    for start in starts:
+        result = minimize(lambda x: -response_curves.response(curves, x).sum(), start, method="SLSQP",
+                          bounds=list(zip(lower, upper)),
+                          constraints=[{"type": "eq", "fun": lambda x: x.sum() - budget}],
+                          options={"maxiter": 500, "ftol": 1e-12})
+        x = np.clip(result.x, lower, upper)
+        if abs(x.sum() - budget) <= 1e-6 * budget:
+            best = max(best, response_curves.response(curves, x).sum())
+    return best
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_project_meets_bounds_and_budget(seed):
+    rng = np.random.default_rng(seed)
+    lower = rng.uniform(0, 10, (8, 6))
+    upper = lower + rng.uniform(0.1, 10, (8, 6))
+    budget = lower.sum(axis=-1) + rng.random(8) * (upper - lower).sum(axis=-1)
+    values = rng.normal(5, 10, (8, 6))
+    x = allocator.project(values, lower, upper, budget)
+    assert (x >= lower - 1e-9).all() and (x <= upper + 1e-9).all()
+    np.testing.assert_allclose(x.sum(axis=-1), budget)
+    for i in range(len(x)):
+        reference = minimize(lambda z: ((z - values[i]) ** 2).sum(), np.clip(values[i], lower[i], upper[i]),
+                             method="SLSQP", bounds=list(zip(lower[i], upper[i])),
+                             constraints=[{"type": "eq", "fun": lambda z: z.sum() - budget[i]}],
+                             options={"ftol": 1e-14, "maxiter": 500})
+        np.testing.assert_allclose(x[i], reference.x, atol=1e-5)
+
+
+# Concave curves (alpha <= 1) and S-shaped ones, which have several local optima
+@pytest.mark.parametrize("alpha_range", [(0.5, 1.0), (1.0, 3.0)])
+@pytest.mark.parametrize("seed", range(10))
+def test_maximize_response_matches_reference(alpha_range, seed):
+    rng = np.random.default_rng(seed)
+    curves = _curves(rng, 6, alpha_range)
+    spend, lower, upper = _bounds(rng, 6)
+    budget = spend.sum() * 1.3
+    x = allocator.maximize_response(curves, spend, lower, upper, budget)
+    assert (x >= lower - 1e-6).all() and (x <= upper + 1e-6).all()
+    assert x.sum() == pytest.approx(budget)
+    starts = [allocator.project(s, lower, upper, budget) for s in [spend] + [rng.uniform(lower, upper) for _ in range(5)]]
+    reference = _reference_optimum(curves, lower, upper, budget, starts)
+    assert response_curves.response(curves, x).sum() >= reference * (1 - 1e-6)
+
+
+def test_maximize_response_batched_budgets():
+    rng = np.random.default_rng(11)
+    curves = _curves(rng, 5, (0.8, 2.5))
+    spend, lower, upper = _bounds(rng, 5)
+    budgets = np.linspace(lower.sum(), upper.sum(), 6)
+    # The scenario batch is the leading shape of the bounds, as in allocator.sweep
+    lower, upper = np.broadcast_to(lower, (6, 5)), np.broadcast_to(upper, (6, 5))
+    x = allocator.maximize_response(curves, spend, lower, upper, budgets)
+    assert x.shape == (6, 5)
+    assert (x >= lower - 1e-6).all() and (x <= upper + 1e-6).all()
+    np.testing.assert_allclose(x.sum(axis=-1), budgets)
+    # A larger budget never buys less response
+    assert (np.diff(response_curves.response(curves, x).sum(axis=-1)) >= -1e-6).all()
+
+
+def test_budget_outside_constraints_is_rejected():
+    rng = np.random.default_rng(0)
+    curves = _curves(rng, 3, (1.0, 2.0))
+    spend, lower, upper = _bounds(rng, 3)
+    with pytest.raises(ValueError):
+        allocator.maximize_response(curves, spend, lower, upper, upper.sum() * 1.1)
@@ -0,0 +1,41 @@
+import pandas as pd
+import pytest
+
+import data_ingest
+import data_schema
+
+
+def _upload():
+    return pd.DataFrame({
+        "event_day": ["2024-01-01", "2024-01-02", "2024-01-03"],
+        "market": ["uk", "uk", "uk"],
+        "dsp_recruit_spend": [1, 2, 3],
+    })
+
+
+def test_mapped_columns_get_schema_names_and_types():
+    mapping = {data_schema.DATE_COLUMN: "event_day", data_schema.COUNTRY_COLUMN: "market",
+               "dsp_recruit_cost": "dsp_recruit_spend"}
+    df = data_ingest.map_columns(_upload(), mapping)
+    assert list(df.columns) == [data_schema.DATE_COLUMN, data_schema.COUNTRY_COLUMN, "dsp_recruit_cost"]
+    assert pd.api.types.is_datetime64_any_dtype(df[data_schema.DATE_COLUMN])
+    assert df["dsp_recruit_cost"].dtype == "float64"
+    assert df[data_schema.COUNTRY_COLUMN].dtype == "category"
+    report = data_schema.validate(df)
+    assert {data_schema.DATE_COLUMN, data_schema.COUNTRY_COLUMN, "dsp_recruit_cost"}.isdisjoint(report["missing_columns"])
+
+
+def test_mapped_column_replaces_an_existing_one():
+    upload = _upload().assign(date="not a date")
+    df = data_ingest.map_columns(upload, {data_schema.DATE_COLUMN: "event_day"})
+    assert list(df.columns).count(data_schema.DATE_COLUMN) == 1
+    assert df[data_schema.DATE_COLUMN].notna().all()
+
+
+@pytest.mark.parametrize("mapping", [
+    {data_schema.DATE_COLUMN: "event_day", data_schema.COUNTRY_COLUMN: "event_day"},
+    {data_schema.DATE_COLUMN: "day"},
+])
+def test_invalid_mappings_are_rejected(mapping):
+    with pytest.raises(ValueError):
+        data_ingest.map_columns(_upload(), mapping)
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+import pareto
+
+
+def brute_force_fronts(points, max_fronts=None):
+    # Peel off the non-dominated rows one front at a time, comparing every pair
+    fronts = np.zeros(len(points), dtype=np.int64)
+    remaining = [i for i in range(len(points)) if not np.isnan(points[i]).any()]
+    front_no = 1
+    while remaining and (not max_fronts or front_no <= max_fronts):
+        members = [i for i in remaining
+                   if not any((points[j] <= points[i]).all() and (points[j] < points[i]).any() for j in remaining)]
+        fronts[members] = front_no
+        remaining = [i for i in remaining if i not in members]
+        front_no += 1
+    return fronts
+
+
+@pytest.mark.parametrize("n_objectives", [2, 3])
+@pytest.mark.parametrize("seed", range(5))
+def test_fronts_match_brute_force(n_objectives, seed):
+    rng = np.random.default_rng(seed)
+    points = rng.random((200, n_objectives))
+    np.testing.assert_array_equal(pareto.nondominated_fronts(points), brute_force_fronts(points))
+
+
+@pytest.mark.parametrize("n_objectives", [2, 3])
+def test_fronts_with_ties(n_objectives):
+    # Few distinct values: many duplicate points and ties on single objectives
+    rng = np.random.default_rng(1)
+    points = rng.integers(0, 4, size=(300, n_objectives)).astype("float64")
+    np.testing.assert_array_equal(pareto.nondominated_fronts(points), brute_force_fronts(points))
+
+
+@pytest.mark.parametrize("n_objectives", [2, 3])
+def test_max_fronts_and_missing_objectives(n_objectives):
+    rng = np.random.default_rng(2)
+    points = rng.random((150, n_objectives))
+    points[::17, -1] = np.nan
+    fronts = pareto.nondominated_fronts(points, max_fronts=3)
+    np.testing.assert_array_equal(fronts, brute_force_fronts(points, max_fronts=3))
+    assert (fronts[::17] == 0).all()
+
+
+def test_fronts_across_chunks():
+    # More points than one dominance chunk, so the chunked first-front search is exercised
+    rng = np.random.default_rng(3)
+    points = rng.random((pareto.CHUNK_SIZE + 300, 3))
+    first = pareto.nondominated_fronts(points, max_fronts=1) == 1
+    np.testing.assert_array_equal(first, brute_force_fronts(points, max_fronts=1) == 1)
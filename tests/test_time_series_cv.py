@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from scipy.optimize import lsq_linear
+
+import model_fit
+import time_series_cv
+
+
+def _problem(seed, n_samples=4, n_days=120, n_media=3, n_context=2):
+    rng = np.random.default_rng(seed)
+    X = rng.random((n_samples, n_days, n_media + n_context))
+    true = np.concatenate([rng.random(n_media), rng.normal(size=n_context)])
+    y = X[0] @ true + rng.normal(scale=0.1, size=n_days) + 5
+    lambdas = rng.uniform(0.1, 10, size=n_samples)
+    return X, y, lambdas, n_media
+
+
+def _objective(X, y, lambda_, coef, intercept):
+    # The penalized loss both fitters minimise, on the unit-variance scale of fit_ridge
+    x_std, y_std = X.std(axis=0), y.std()
+    residual = (y - X @ coef - intercept) / y_std
+    return residual @ residual + lambda_ * np.sum((coef * x_std / y_std) ** 2)
+
+
+def _exact_ridge(X, y, lambda_, n_media):
+    # The same problem solved exactly as bounded least squares on the centred, scaled design
+    x_std, y_std = X.std(axis=0), y.std()
+    X_s, y_s = (X - X.mean(axis=0)) / x_std, (y - y.mean()) / y_std
+    A = np.vstack([X_s, np.sqrt(lambda_) * np.eye(X.shape[1])])
+    target = np.concatenate([y_s, np.zeros(X.shape[1])])
+    lower = np.where(np.arange(X.shape[1]) < n_media, 0.0, -np.inf)
+    coef = lsq_linear(A, target, bounds=(lower, np.inf), method="bvls", tol=1e-12).x * y_std / x_std
+    return coef, y.mean() - X.mean(axis=0) @ coef
+
+
+@pytest.mark.parametrize("scheme", time_series_cv.SCHEMES)
+@pytest.mark.parametrize("seed", range(3))
+def test_fit_folds_matches_fit_ridge(scheme, seed):
+    X, y, lambdas, n_media = _problem(seed)
+    folds, _ = time_series_cv.splits(X.shape[1], scheme=scheme)
+    coefs, intercepts = time_series_cv.fit_folds(X, y, lambdas, n_media, folds)
+    for i in range(X.shape[0]):
+        for k, (train_start, train_end, _) in enumerate(folds):
+            X_fold, y_fold = X[i, train_start:train_end], y[train_start:train_end]
+            coef, intercept = model_fit.fit_ridge(X_fold, y_fold, lambdas[i], n_media)
+            # sklearn's solver stops slightly short of the optimum, so the loss may only be lower
+            reference = _objective(X_fold, y_fold, lambdas[i], coef, intercept)
+            assert _objective(X_fold, y_fold, lambdas[i], coefs[i, k], intercepts[i, k]) <= reference * (1 + 1e-9)
+            coef, intercept = _exact_ridge(X_fold, y_fold, lambdas[i], n_media)
+            np.testing.assert_allclose(coefs[i, k], coef, rtol=1e-6, atol=1e-8)
+            np.testing.assert_allclose(intercepts[i, k], intercept, rtol=1e-6)
+
+
+def test_media_coefficients_are_non_negative():
+    X, y, lambdas, n_media = _problem(7)
+    # A media column that hurts the target would get a negative coefficient without the constraint
+    y = y - 3 * X[0, :, 0]
+    folds, _ = time_series_cv.splits(X.shape[1])
+    coefs, _ = time_series_cv.fit_folds(X, y, lambdas, n_media, folds)
+    assert (coefs[..., :n_media] >= 0).all()
+
+
+@pytest.mark.parametrize("scheme", time_series_cv.SCHEMES)
+def test_splits_are_consecutive_and_before_the_test_rows(scheme):
+    folds, test_start = time_series_cv.splits(200, folds=3, scheme=scheme, start=20)
+    for (train_start, train_end, val_end), (_, next_train_end, _) in zip(folds, folds[1:]):
+        assert next_train_end == val_end
+    assert all(20 <= train_start < train_end < val_end <= test_start for train_start, train_end, val_end in folds)
+    assert len({train_end - train_start for train_start, train_end, _ in folds}) == (1 if scheme == "rolling" else 3)
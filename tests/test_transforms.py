@@ -0,0 +1,21 @@
+import numpy as np
+import pytest
+
+import transforms
+
+
+@pytest.mark.parametrize("alpha", [0.3, 0.5, 1.0, 2.0, 3.0])
+def test_hill_derivative_matches_finite_differences(alpha):
+    x = np.linspace(10.0, 5000.0, 50)[np.newaxis]
+    h = 1e-3
+    numeric = (transforms.hill_saturation(x + h, [alpha], [1000.0]) -
+               transforms.hill_saturation(x - h, [alpha], [1000.0])) / (2 * h)
+    np.testing.assert_allclose(transforms.hill_derivative(x, [alpha], [1000.0]), numeric, rtol=1e-5)
+
+
+def test_hill_derivative_at_zero_spend():
+    # Infinite slope at 0 for alpha < 1 becomes a large finite one, never 0
+    slope = transforms.hill_derivative(np.zeros((3, 1)), [0.5, 1.0, 2.0], [1000.0, 1000.0, 1000.0])[:, 0]
+    assert np.isfinite(slope).all()
+    assert slope[0] > transforms.hill_derivative(np.ones((1, 1)), [0.5], [1000.0])[0, 0]
+    np.testing.assert_allclose(slope[1:], [1e-3, 0.0], atol=1e-12)
@@ -0,0 +1,128 @@
+import numpy as np
+
+# Time-series cross-validation of candidate models. Folds are consecutive
+# blocks of days: each fold trains on the days before its validation block
+# (all of them for "expanding", a fixed-length window for "rolling"), and the
+# last TEST_SHARE of days is held out as a test set for the final fit.
+#
+# The adstocked and saturated design of a candidate is built once and shared
+# by every fold. A fold's ridge fit only needs sums over its rows (X'X, X'y,
+# ...), which are added up from per-segment sums between fold boundaries, and
+# is then solved on the small (features x features) system for all candidates
+# and folds at once.
+SCHEMES = ("expanding", "rolling")
+FOLDS = 3
+TEST_SHARE = 0.1
+MIN_TRAIN_SHARE = 0.5
+SWEEPS = 300
+TOLERANCE = 1e-10
+
+
+def splits(n_days, folds=FOLDS, scheme="expanding", start=0, test_share=TEST_SHARE):
+    """Row ranges (train_start, train_end, val_end) of every fold, and the first test row.
+
+    Rows before `start` are never fitted; they only carry adstock into the window.
+    """
+    if scheme not in SCHEMES:
+        raise ValueError(f"Unknown validation scheme: {scheme}")
+    test_start = n_days - int(round((n_days - start) * test_share))
+    n = test_start - start
+    val_days = int(n * (1 - MIN_TRAIN_SHARE)) // folds
+    if folds < 1 or val_days < 1:
+        raise ValueError(f"Too few days for {folds} validation folds")
+    train_days = n - folds * val_days
+    result = []
+    for k in range(folds):
+        train_end = start + train_days + k * val_days
+        train_start = start if scheme == "expanding" else train_end - train_days
+        result.append((train_start, train_end, train_end + val_days))
+    return result, test_start
+
+
+def design(saturated, context):
+    # (n_samples, n_days, n_features): saturated media columns, then the context columns
+    n = saturated.shape[0]
+    context = np.broadcast_to(context, (n,) + context.shape)
+    return np.concatenate([saturated.transpose(0, 2, 1), context], axis=2)
+
+
+def _window_sums(X, y, folds):
+    # Sums over each fold's training rows, added up from per-segment sums
+    edges = sorted({edge for train_start, train_end, _ in folds for edge in (train_start, train_end)})
+    seg_x, seg_xx, seg_y, seg_xy, seg_yy = [], [], [], [], []
+    for a, b in zip(edges[:-1], edges[1:]):
+        Xs, ys = X[:, a:b], y[a:b]
+        seg_x.append(Xs.sum(axis=1))
+        seg_xx.append(np.einsum("ntp,ntq->npq", Xs, Xs))
+        seg_y.append(ys.sum())
+        seg_xy.append(np.einsum("ntp,t->np", Xs, ys))
+        seg_yy.append(ys @ ys)
+
+    def cumulative(parts, axis):
+        parts = np.stack(parts, axis=axis)
+        zero = np.zeros_like(np.take(parts, [0], axis=axis))
+        return np.cumsum(np.concatenate([zero, parts], axis=axis), axis=axis)
+
+    cum = [cumulative(seg_x, 1), cumulative(seg_xx, 1), cumulative(seg_y, 0), cumulative(seg_xy, 1), cumulative(seg_yy, 0)]
+    a_idx = [edges.index(train_start) for train_start, _, _ in folds]
+    b_idx = [edges.index(train_end) for _, train_end, _ in folds]
+    # Every sum as (n_samples, n_folds, ...); the y sums are the same for all samples
+    Sx, Sxx, Sy, Sxy, Syy = (c[:, b_idx] - c[:, a_idx] if c.ndim > 1 else c[b_idx] - c[a_idx] for c in cum)
+    N = np.array([b - a for a, b, _ in folds], dtype="float64")
+    return N, Sx, Sxx, Sy, Sxy, Syy
+
+
+def solve_ridge(gram, xy, lambdas, n_media, sweeps=SWEEPS, tol=TOLERANCE):
+    """Minimise b'Gb - 2c'b + lambda b'b with media coefficients >= 0, for stacked systems.
+
+    Cyclic coordinate descent over the features, vectorized over the leading
+    axes; it solves the same problem as model_fit.fit_ridge on the scaled design.
+    """
+    A = gram + lambdas[..., np.newaxis, np.newaxis] * np.eye(gram.shape[-1])
+    diag = np.diagonal(A, axis1=-2, axis2=-1)
+    b = np.zeros(xy.shape)
+    for _ in range(sweeps):
+        largest = 0.0
+        for j in range(b.shape[-1]):
+            old = b[..., j].copy()
+            residual = xy[..., j] - np.einsum("...k,...k->...", A[..., j, :], b) + diag[..., j] * old
+            new = residual / diag[..., j]
+            if j < n_media:
+                new = np.maximum(new, 0.0)
+            b[..., j] = new
+            largest = max(largest, np.abs(new - old).max(initial=0.0))
+        if largest < tol:
+            break
+    return b
+
+
+def fit_folds(X, y, lambdas, n_media, folds, sweeps=SWEEPS):
+    """Coefficients and intercepts, (n_samples, n_folds, n_features) and (n_samples, n_folds), of every fold's fit."""
+    N, Sx, Sxx, Sy, Sxy, Syy = _window_sums(X, y, folds)
+    n_obs = N[:, np.newaxis]
+    x_mean = Sx / n_obs
+    y_mean = Sy / N
+    # Centre the sums, then scale to unit variance like fit_ridge does
+    gram = Sxx - n_obs[..., np.newaxis] * x_mean[..., :, np.newaxis] * x_mean[..., np.newaxis, :]
+    xy = Sxy - n_obs * x_mean * y_mean[:, np.newaxis]
+    x_std = np.sqrt(np.maximum(np.diagonal(gram, axis1=-2, axis2=-1) / n_obs, 0))
+    x_std[x_std < 1e-12] = 1.0
+    y_std = np.sqrt(np.maximum(Syy / N - y_mean ** 2, 0))
+    y_std[y_std == 0] = 1.0
+    gram = gram / (x_std[..., :, np.newaxis] * x_std[..., np.newaxis, :])
+    xy = xy / (x_std * y_std[:, np.newaxis])
+    b = solve_ridge(gram, xy, np.broadcast_to(lambdas[:, np.newaxis], gram.shape[:2]), n_media, sweeps)
+    coefs = b * y_std[:, np.newaxis] / x_std
+    intercepts = y_mean - np.einsum("nfp,nfp->nf", coefs, x_mean)
+    return coefs, intercepts
+
+
+def fold_nrmse(X, y, coefs, intercepts, folds):
+    """Validation NRMSE of every candidate (rows) on every fold (columns)."""
+    result = np.empty(intercepts.shape)
+    for k, (_, train_end, val_end) in enumerate(folds):
+        y_val = y[train_end:val_end]
+        pred = np.einsum("ntp,np->nt", X[:, train_end:val_end], coefs[:, k]) + intercepts[:, k, np.newaxis]
+        span = y_val.max() - y_val.min() or 1.0
+        result[:, k] = np.sqrt(np.mean((y_val - pred) ** 2, axis=1)) / span
+    return result
@@ -0,0 +1,91 @@
+import numpy as np
+
+# Geometric adstock and Hill saturation, matching Robyn's `adstock = "geometric"`
+# setup. Every function broadcasts over leading axes so a whole grid of
+# hyperparameter samples is evaluated in one call:
+#   spend  (n_channels, n_days)
+#   params (n_samples, n_channels)
+#   result (n_samples, n_channels, n_days)
+# hill_derivative is taken at no less than this share of the inflexion point:
+# for alpha < 1 the slope at 0 is infinite, and a large finite slope still
+# tells gradient steps that moving off zero spend pays off
+HILL_SLOPE_FLOOR = 1e-12
+
+
+def geometric_adstock(x, theta):
+    """Carry over a share `theta` of yesterday's adstock into today: a_t = x_t + theta * a_{t-1}."""
+    x = np.asarray(x, dtype="float64")
+    theta = np.asarray(theta, dtype="float64")[..., np.newaxis]
+    shape = np.broadcast_shapes(x.shape, theta.shape)
+    x = np.broadcast_to(x, shape)
+    theta = theta[..., 0]
+
+    # The recursion runs over days only; each step is vectorized over all samples and channels
+    out = np.empty(shape)
+    carry = np.zeros(shape[:-1])
+    for t in range(shape[-1]):
+        carry = x[..., t] + theta * carry
+        out[..., t] = carry
+    return out
+
+
+def steady_state_adstock(x, theta):
+    # Adstock level reached by spending `x` every day for long enough
+    return np.asarray(x, dtype="float64") / (1.0 - np.asarray(theta, dtype="float64"))
+
+
+def inflexion_point(x, gamma):
+    """Robyn's gamma is the position of the inflexion inside the range of the adstocked series."""
+    x = np.asarray(x, dtype="float64")
+    low, high = x.min(axis=-1), x.max(axis=-1)
+    return low + np.asarray(gamma, dtype="float64") * (high - low)
+
+
+def hill_saturation(x, alpha, inflexion):
+    """Hill curve x^alpha / (x^alpha + inflexion^alpha), broadcast over leading axes of x."""
+    x = np.asarray(x, dtype="float64")
+    alpha = np.asarray(alpha, dtype="float64")[..., np.newaxis]
+    inflexion = np.asarray(inflexion, dtype="float64")[..., np.newaxis]
+    x_a = np.power(x, alpha)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out = x_a / (x_a + np.power(inflexion, alpha))
+    return np.nan_to_num(out)
+
+
+def hill_derivative(x, alpha, inflexion):
+    # d/dx of hill_saturation, used for marginal response and allocator gradients
+    alpha = np.asarray(alpha, dtype="float64")[..., np.newaxis]
+    inflexion = np.asarray(inflexion, dtype="float64")[..., np.newaxis]
+    x = np.maximum(np.asarray(x, dtype="float64"), HILL_SLOPE_FLOOR * inflexion)
+    x_a = np.power(x, alpha)
+    g_a = np.power(inflexion, alpha)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out = alpha * np.power(x, alpha - 1) * g_a / (x_a + g_a) ** 2
+    return np.nan_to_num(out)
+
+
+def transform_media(spend, thetas, alphas, gammas):
+    """Adstock then saturate the spend series for every hyperparameter sample at once.
+
+    Returns the saturated tensor (n_samples, n_channels, n_days) and the
+    absolute inflexion points (n_samples, n_channels) so response curves can be
+    rebuilt later on any spend grid.
+    """
+    adstocked = geometric_adstock(spend, thetas)
+    inflexion = inflexion_point(adstocked, gammas)
+    return hill_saturation(adstocked, alphas, inflexion), inflexion
+
+
+def adstock_decay_curve(theta, length=30):
+    # Impulse response of the geometric adstock: the share of day-0 spend still active on day i
+    impulse = np.zeros(length)
+    impulse[0] = 1.0
+    return geometric_adstock(impulse, theta)
+
+
+def response_curve(spend, theta, alpha, gamma, n_points=50):
+    """Saturation curve of a single channel over a grid up to its peak adstocked spend."""
+    adstocked = geometric_adstock(spend, theta)
+    inflexion = inflexion_point(adstocked, gamma)
+    grid = np.linspace(0, adstocked.max(), n_points)
+    return grid, hill_saturation(grid, alpha, inflexion)
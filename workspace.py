@@ -0,0 +1,129 @@
+import os
+import re
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+# Per-tenant workspaces: every customer/country pair gets its own directory
+# for saved settings and model runs, so analysts working on different
+# tenants never write the same files.
+#
+#   <WORKSPACE_ROOT>/<cust>/<country>/config/   hyperparameter_config.csv, model_params.csv, allocation_params.json
+#   <WORKSPACE_ROOT>/<cust>/<country>/runs/     Robyn_<timestamp>_<tag>/ run folders, <solID>/ allocator results
+#
+# Files are written atomically (temp file + rename) and run folders are
+# published in one rename, so readers never see half-written output.
+WORKSPACE_ROOT = os.environ.get("ROBYN_WORKSPACES", "./workspaces")
+MAX_WORKSPACE_BYTES = int(os.environ.get("ROBYN_WORKSPACE_QUOTA_MB", "5120")) * 1024 ** 2
+MAX_RUNS = int(os.environ.get("ROBYN_WORKSPACE_MAX_RUNS", "100"))
+# Runs written before workspaces existed live in ./<cust>_<country> (e.g. ./mars-pne_uk); they are
+# copied into the tenant's workspace the first time it is used
+LEGACY_RUNS_DIR = "./{cust}_{country}"
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+def slug(name):
+    """File-system safe tenant name: 'Mars PNE' -> 'mars-pne'."""
+    value = re.sub(r"[^a-z0-9_-]+", "-", str(name or "").strip().lower()).strip("-")
+    if not value:
+        raise ValueError("Customer and country names are required")
+    return value
+
+
+def tenant_dir(cust, country):
+    return os.path.join(WORKSPACE_ROOT, slug(cust), slug(country))
+
+
+def config_path(cust, country, name):
+    path = os.path.join(tenant_dir(cust, country), "config")
+    os.makedirs(path, exist_ok=True)
+    return os.path.join(path, name)
+
+
+def runs_dir(cust, country):
+    """Output root for the tenant's model runs, created on first use.
+
+    A tenant with runs in its legacy folder gets a copy of them on first use;
+    the legacy folder is only read, never written to again.
+    """
+    path = os.path.join(tenant_dir(cust, country), "runs")
+    if os.path.isdir(path):
+        return path
+    legacy = LEGACY_RUNS_DIR.format(cust=slug(cust), country=slug(country))
+    if not os.path.isdir(legacy):
+        os.makedirs(path, exist_ok=True)
+        return path
+    # Copied into a hidden folder and published in one rename, so a half-done copy is never used
+    os.makedirs(tenant_dir(cust, country), exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=".migrate-", dir=tenant_dir(cust, country))
+    try:
+        shutil.copytree(legacy, staging, ignore=shutil.ignore_patterns(".*"), dirs_exist_ok=True)
+        os.chmod(staging, 0o755)
+        os.rename(staging, path)
+    except OSError:
+        # Another process published its copy first
+        shutil.rmtree(staging, ignore_errors=True)
+        if not os.path.isdir(path):
+            raise
+    return path
+
+
+@contextmanager
+def atomic_open(path, mode="w", **kwargs):
+    """Open a temp file next to `path` and move it into place only if the block succeeds."""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", dir=directory)
+    try:
+        with os.fdopen(fd, mode, **kwargs) as tmp_file:
+            yield tmp_file
+        # mkstemp files are owner-only; give the result the usual permissions
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def staging_dir(output_root):
+    # Hidden folder a run is written into before it is published under its final name
+    os.makedirs(output_root, exist_ok=True)
+    return tempfile.mkdtemp(prefix=".staging-", dir=output_root)
+
+
+def publish_dir(staging, target):
+    # `target` is an empty folder reserved for the run; renaming over it is atomic
+    try:
+        os.chmod(staging, 0o755)
+        os.rename(staging, target)
+    except OSError:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+
+def usage(path):
+    """Bytes used and number of run folders under a tenant's run directory."""
+    total, runs = 0, 0
+    if not os.path.isdir(path):
+        return {"bytes": 0, "runs": 0}
+    for entry in os.scandir(path):
+        if entry.is_dir() and entry.name.startswith("Robyn_"):
+            runs += 1
+    for directory, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(directory, f)) for f in files)
+    return {"bytes": total, "runs": runs}
+
+
+def check_quota(cust, country):
+    """Raise QuotaExceeded when the tenant has no room for another run."""
+    used = usage(runs_dir(cust, country))
+    if used["bytes"] >= MAX_WORKSPACE_BYTES:
+        raise QuotaExceeded(f"Workspace {slug(cust)}/{slug(country)} uses {used['bytes'] / 1024 ** 2:.0f}MB "
+                            f"of its {MAX_WORKSPACE_BYTES / 1024 ** 2:.0f}MB quota; delete old runs first")
+    if used["runs"] >= MAX_RUNS:
+        raise QuotaExceeded(f"Workspace {slug(cust)}/{slug(country)} has {used['runs']} runs, "
+                            f"the limit is {MAX_RUNS}; delete old runs first")
+    return used